@@ -0,0 +1,249 @@
+"""
+Benchmarks of dps-control hot paths against the simulated device
+
+Run from the repository root:
+
+    python -m benchmarks.bench                        run and print results
+    python -m benchmarks.bench --save base.json       store results as baseline
+    python -m benchmarks.bench --compare base.json    compare against baseline, exit 1 on regression
+
+Each benchmark is repeated and the best run is reported, as time per
+operation and operations per second
+"""
+
+import io
+import json
+import os
+import platform
+import sys
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from time import perf_counter, sleep, time
+from yaml import safe_load
+
+from lib.dps_controller import DPSController
+from lib.dps_engine import DPSEngine
+from lib.dps_status import DPSStatus
+from lib.sim_instrument import SimInstrument
+
+# Defaults of a run
+REPEAT = 5
+MIN_TIME = 0.2
+THRESHOLD = 15.0
+EVENT_WINDOW = 1.0
+# Poll interval outside of the event provider benchmark, slow enough not to disturb the others
+IDLE_POLL_INTERVAL = 1.0
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dps_control.cfg')
+
+
+def load_config() -> dict:
+    """Repository configuration, discovery off and slow polling"""
+    with open(CONFIG_FILE, 'r') as file:
+        conf = safe_load(file)
+    conf['discovery'] = dict(conf.get('discovery') or {}, enabled = False)
+    conf['misc']['poll_interval'] = IDLE_POLL_INTERVAL
+    conf['misc']['device_process'] = False
+    conf['misc']['capture_file'] = None
+    return conf
+
+def connected_controller() -> DPSController:
+    """Controller connected to simulated device, output silenced"""
+    controller = DPSController(load_config())
+    controller.engine.instrument_factory = SimInstrument
+    with redirect_stdout(io.StringIO()):
+        controller.connect(discover = False)
+    return controller
+
+def measure(func, repeat: int = REPEAT, min_time: float = MIN_TIME) -> float:
+    """Best time per call of func over repeat runs, each run lasts at least min_time"""
+    # Calibrate number of calls per run
+    number = 1
+    while True:
+        t_start = perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = perf_counter() - t_start
+        if elapsed >= min_time / 10:
+            break
+        number *= 10
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    best = float('inf')
+    for _ in range(repeat):
+        t_start = perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (perf_counter() - t_start) / number)
+    return best
+
+def bench_engine_get_registers() -> float:
+    """Block read from simulated device and decode into engineering units"""
+    engine = DPSEngine()
+    engine.instrument_factory = SimInstrument
+    with redirect_stdout(io.StringIO()):
+        engine.connect('sim', 1, 9600)
+    scale = engine.scale
+    return measure(lambda: engine.get_registers().to_units(scale))
+
+def bench_parse_command(controller: DPSController) -> float:
+    """Command dispatch mix of setpoint, energy and trip commands"""
+    commands = ('v 1.5', 'a 0.5', 'e', 't', 'va 2.0 0.8')
+
+    def run():
+        for cmd in commands:
+            controller.parse_command(cmd)
+    return measure(run) / len(commands)
+
+def bench_printable_status(controller: DPSController) -> float:
+    """Info command formatting including its register read"""
+    return measure(controller.engine.get_printable_status)
+
+def bench_event_provider(controller: DPSController) -> float:
+    """Time per event delivered by the running event provider, polling as fast as possible"""
+    queue = controller.event_queue
+    poll_interval = controller.poll_interval
+    controller.poll_interval = 0.0
+    try:
+        # Poller picks up the new interval after its current sleep, wait for the first fresh event
+        while not queue.empty():
+            queue.get_nowait()
+        queue.get()
+        sleep(0.1)
+        while not queue.empty():
+            queue.get_nowait()
+        count = 0
+        t_start = perf_counter()
+        while perf_counter() - t_start < EVENT_WINDOW:
+            queue.get()
+            count += 1
+        elapsed = perf_counter() - t_start
+    finally:
+        controller.poll_interval = poll_interval
+    return elapsed / count
+
+def bench_cli_monitor(controller: DPSController) -> float:
+    """Live monitor rendering of one refresh with changed values"""
+    from lib.rolling_stats import RollingStats
+    from ui.dps_cli import DPSCli, MONITOR_CHANNELS
+    cli = DPSCli(controller)
+    render = getattr(cli, '_DPSCli__render_monitor')
+    stats = [RollingStats(60) for _ in MONITOR_CHANNELS]
+    scaling = [(100.0, 2), (1000.0, 3), (100.0, 2)]
+    latest = [0] * len(MONITOR_CHANNELS)
+    state = {'n': 0}
+
+    def run():
+        state['n'] += 1
+        for n, rs in enumerate(stats):
+            latest[n] = 500 + state['n'] % 50
+            rs.add(latest[n])
+        with redirect_stdout(io.StringIO()):
+            render(stats, latest, scaling, {}, f'Timing: {controller.poll_timing.get_summary()}')
+    return measure(run)
+
+def bench_gui_update_status(controller: DPSController) -> float or None:
+    """DPSMainWindow.update_status under offscreen Qt, None if Qt is not available"""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PySide6.QtWidgets import QApplication
+        from ui.dps_gui import DPSMainWindow
+    except ImportError:
+        return None
+    app = QApplication.instance() or QApplication([])
+    window = DPSMainWindow(controller)
+    window.setup()
+    status = DPSStatus()
+    status.registers = controller.engine.get_registers()
+    result = measure(lambda: window.update_status(status))
+    window.close()
+    app.processEvents()
+    return result
+
+def bench_archive_decode() -> float:
+    """Time per sample of decoding an archive chunk of steady output with poll jitter"""
+    import numpy as np
+    from lib.archive import encode_chunk, decode_chunk, CHUNK_SAMPLES
+    rng = np.random.default_rng(1)
+    block = np.zeros((CHUNK_SAMPLES, 15), dtype = np.int64)
+    block[:, :13] = (500, 100, 500, 100, 50, 2400, 0, 0, 0, 1, 4, 5015, 17)
+    block[:, 3] += rng.integers(-1, 2, CHUNK_SAMPLES)
+    block[:, 13] = np.cumsum(20000 + rng.integers(-300, 300, CHUNK_SAMPLES))
+    block[:, 14] = 8000 + rng.integers(0, 1000, CHUNK_SAMPLES)
+    chunk = memoryview(encode_chunk(block))
+    return measure(lambda: decode_chunk(chunk)) / CHUNK_SAMPLES
+
+def bench_sqlite_insert(controller: DPSController) -> float:
+    """Time per sample of inserting batches of 500 samples into SQLite in WAL mode"""
+    import tempfile
+    from lib.sqlite_store import SQLiteWriter
+    batch = [controller.engine.get_registers() for _ in range(500)]
+    with tempfile.TemporaryDirectory() as directory:
+        writer = SQLiteWriter(os.path.join(directory, 'bench.db'))
+        result = measure(lambda: writer.add_batch(batch)) / len(batch)
+        writer.close()
+    return result
+
+def run_benchmarks() -> dict:
+    """Run all benchmarks, results by name"""
+    controller = connected_controller()
+    benchmarks = {
+        'engine.get_registers': bench_engine_get_registers,
+        'controller.parse_command': lambda: bench_parse_command(controller),
+        'engine.get_printable_status': lambda: bench_printable_status(controller),
+        'controller.event_provider': lambda: bench_event_provider(controller),
+        'cli.render_monitor': lambda: bench_cli_monitor(controller),
+        'gui.update_status': lambda: bench_gui_update_status(controller),
+        'archive.decode_sample': bench_archive_decode,
+        'sqlite.insert_sample': lambda: bench_sqlite_insert(controller),
+    }
+    results = {}
+    for name, bench in benchmarks.items():
+        per_op = bench()
+        if per_op is None:
+            print(f'{name:<32}skipped')
+            continue
+        results[name] = {'us_per_op': per_op * 1e6, 'ops_per_s': 1.0 / per_op}
+        print(f'{name:<32}{per_op * 1e6:>12.2f} us/op{1.0 / per_op:>14.0f} ops/s')
+    return results
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """Print change against baseline, False if any benchmark is slower than threshold percent"""
+    ok = True
+    print(f'\n{"benchmark":<32}{"baseline us":>14}{"now us":>12}{"change":>10}')
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f'{name:<32}{"-":>14}{result["us_per_op"]:>12.2f}{"new":>10}')
+            continue
+        change = 100.0 * (result['us_per_op'] / base['us_per_op'] - 1.0)
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            ok = False
+        print(f'{name:<32}{base["us_per_op"]:>14.2f}{result["us_per_op"]:>12.2f}{change:>+9.1f}%{flag}')
+    return ok
+
+def main() -> int:
+    """Benchmark entry point"""
+    parser = ArgumentParser(description = 'dps-control benchmarks')
+    parser.add_argument('--save', metavar = 'FILE', help = 'store results as JSON baseline')
+    parser.add_argument('--compare', metavar = 'FILE', help = 'compare results against JSON baseline')
+    parser.add_argument('--threshold', type = float, default = THRESHOLD, metavar = 'PCT',
+                        help = f'slowdown in percent counted as regression (default {THRESHOLD})')
+    args = parser.parse_args()
+
+    results = run_benchmarks()
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'meta': {'time': time(), 'python': sys.version.split()[0],
+                                'platform': platform.platform(), 'machine': platform.node()},
+                       'results': results}, file, indent = 2)
+        print(f'Baseline written to {args.save}')
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+        if not compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""
+Archive module stores recorded samples compressed, for keeping long runs
+of many units. Samples are cut into chunks, every column of a chunk is
+delta encoded and the deltas are run-length and varint encoded. Registers
+mostly repeat between samples and times advance by the poll interval, so
+a chunk of a steady output is a few bytes per sample instead of 42 of a
+session record. Decoding is vectorised with NumPy, a chunk comes out as a
+block of raw registers followed by end and start time, one row per sample
+
+File format:
+============
+
+Archive <file>:         b'DPSARC1\\n', then chunks: <I> sample count, <15I> encoded
+                        length of each column, encoded columns
+Chunk index <file>.aix: b'DPSAIX1\\n', then <ddQI> wall time of first and last sample,
+                        file offset and sample count of every chunk
+
+Columns: 13 raw registers, wall time of read end and read duration, both
+times in integer microseconds
+
+Column encoding: order 1 deltas (order 2 for read end time, so a steady poll
+interval becomes zeros), zigzag mapped to unsigned, runs of zeros replaced by
+0 and the run length, all as varints
+
+"""
+
+import atexit
+import mmap
+import os
+import struct
+from itertools import repeat
+from operator import add
+from threading import Lock
+from time import monotonic, time
+from typing import Iterator
+import numpy as np
+
+from .dps_status import DPSSample, NUM_REGISTERS
+from .session_store import SessionReader, format_wall_time, parse_wall_time, print_samples
+
+ARCHIVE_MAGIC = b'DPSARC1\n'
+CHUNK_INDEX_MAGIC = b'DPSAIX1\n'
+CHUNK_INDEX_SUFFIX = '.aix'
+ARCHIVE_SUFFIX = '.dpsa'
+COLUMNS = NUM_REGISTERS + 2
+# Delta order of each column: registers, read end time, read duration
+DELTA_ORDER: tuple[int, ...] = (1,) * NUM_REGISTERS + (2, 1)
+CHUNK_HEADER = struct.Struct(f'<I{COLUMNS}I')
+CHUNK_ENTRY = struct.Struct('<ddQI')
+# Stored time resolution
+TICKS_PER_SECOND = 1_000_000
+# Defaults when not configured
+CHUNK_SAMPLES = 4096
+
+
+def encode_column(values: np.ndarray, order: int) -> bytes:
+    """Delta, zigzag, run-length and varint encode one int64 column"""
+    for _ in range(order):
+        values = np.diff(values, prepend = 0)
+    # Zigzag, small negative deltas become small unsigned values
+    zigzag = ((values << 1) ^ (values >> 63)).astype(np.uint64)
+    # Runs of zeros become 0 and run length, other values are stored as is
+    zero = zigzag == 0
+    edges = np.diff(np.r_[False, zero, False].astype(np.int8))
+    run_starts = np.flatnonzero(edges == 1)
+    run_lengths = np.flatnonzero(edges == -1) - run_starts
+    keep = ~zero
+    keep[run_starts] = True
+    tokens = zigzag[keep]
+    # Each run start becomes two tokens, 0 then the length, inserted behind the 0
+    positions = np.cumsum(keep)[run_starts]
+    tokens = np.insert(tokens, positions, run_lengths.astype(np.uint64))
+    return encode_varints(tokens)
+
+def encode_varints(values: np.ndarray) -> bytes:
+    """LEB128 encode unsigned values, 7 bits per byte, high bit set on all but the last byte"""
+    lengths = np.ones(len(values), dtype = np.int64)
+    for k in range(1, 10):
+        lengths += values >= np.uint64(1) << np.uint64(7 * k)
+    offsets = np.cumsum(lengths) - lengths
+    out = np.empty(int(lengths.sum()), dtype = np.uint8)
+    for k in range(int(lengths.max(initial = 0))):
+        has = lengths > k
+        byte = (values[has] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        out[offsets[has] + k] = byte | np.where(lengths[has] > k + 1, 0x80, 0).astype(np.uint64)
+    return out.tobytes()
+
+def decode_varints(data: bytes) -> np.ndarray:
+    """Unsigned values of LEB128 encoded bytes"""
+    raw = np.frombuffer(data, dtype = np.uint8)
+    if not len(raw):
+        return np.zeros(0, dtype = np.uint64)
+    ends = np.flatnonzero(raw < 0x80)
+    starts = np.r_[0, ends[:-1] + 1]
+    # Position of each byte within its value gives its shift
+    shift = np.arange(len(raw)) - np.repeat(starts, ends - starts + 1)
+    parts = (raw & 0x7f).astype(np.uint64) << (7 * shift).astype(np.uint64)
+    return np.bitwise_or.reduceat(parts, starts)
+
+def decode_column(data: bytes, order: int) -> np.ndarray:
+    """Inverse of encode_column, int64 column"""
+    tokens = decode_varints(data)
+    # A 0 token is followed by the length of the run of zeros, lengths are never 0
+    zeros = np.flatnonzero(tokens == 0)
+    counts = np.ones(len(tokens), dtype = np.int64)
+    counts[zeros] = tokens[zeros + 1].astype(np.int64)
+    counts[zeros + 1] = 0
+    zigzag = np.repeat(tokens, counts)
+    values = ((zigzag >> np.uint64(1)).astype(np.int64)) ^ -((zigzag & np.uint64(1)).astype(np.int64))
+    for _ in range(order):
+        values = np.cumsum(values)
+    return values
+
+def encode_chunk(block: np.ndarray) -> bytes:
+    """Encode (n, COLUMNS) int64 block of registers, end and duration ticks"""
+    columns = [encode_column(block[:, c], DELTA_ORDER[c]) for c in range(COLUMNS)]
+    return CHUNK_HEADER.pack(len(block), *(len(column) for column in columns)) + b''.join(columns)
+
+def decode_chunk(data: memoryview) -> np.ndarray:
+    """Decode chunk into (n, NUM_REGISTERS + 2) float block, last columns are end and start
+    wall time
+    """
+    count, *lengths = CHUNK_HEADER.unpack_from(data)
+    block = np.empty((count, COLUMNS), dtype = np.float64)
+    offset = CHUNK_HEADER.size
+    for c, length in enumerate(lengths):
+        block[:, c] = decode_column(data[offset:offset + length], DELTA_ORDER[c])
+        offset += length
+    end, duration = block[:, NUM_REGISTERS], block[:, NUM_REGISTERS + 1]
+    end /= TICKS_PER_SECOND
+    # Read duration column becomes start time
+    block[:, NUM_REGISTERS + 1] = end - duration / TICKS_PER_SECOND
+    return block
+
+class ArchiveWriter:
+    """Appends samples to an archive in chunks of chunk_samples, safe to call from several threads"""
+    def __init__(self, path: str, chunk_samples: int = CHUNK_SAMPLES) -> None:
+        """Constructor, existing archive at path is overwritten"""
+        self.path: str = path
+        self.chunk_samples: int = chunk_samples
+        self.records: int = 0
+        self.bytes: int = len(ARCHIVE_MAGIC)
+        self.__lock = Lock()
+        self.__data = open(path, 'wb')
+        self.__index = open(path + CHUNK_INDEX_SUFFIX, 'wb')
+        self.__data.write(ARCHIVE_MAGIC)
+        self.__index.write(CHUNK_INDEX_MAGIC)
+        # Monotonic sample times are stored as wall time
+        self.__wall_offset: float = time() - monotonic()
+        self.__pending: list[tuple] = []
+        atexit.register(self.close)
+
+    def closed(self) -> bool:
+        return self.__data.closed
+
+    def add(self, sample: DPSSample, wall_time: bool = False) -> None:
+        """Append polled sample, wall_time if its times are wall times already"""
+        offset = 0.0 if wall_time else self.__wall_offset
+        with self.__lock:
+            if self.__data.closed:
+                return
+            self.__pending.append((*sample.registers(), round((sample.t + offset) * TICKS_PER_SECOND),
+                                   round((sample.t - sample.t_start) * TICKS_PER_SECOND)))
+            self.records += 1
+            if len(self.__pending) >= self.chunk_samples:
+                self.__write_chunk()
+
+    def __write_chunk(self) -> None:
+        """Encode and write pending samples, caller holds the lock. Chunk is on disk before
+        the index points at it
+        """
+        if not self.__pending:
+            return
+        block = np.array(self.__pending, dtype = np.int64)
+        self.__pending = []
+        chunk = encode_chunk(block)
+        offset = self.bytes
+        self.__data.write(chunk)
+        self.__data.flush()
+        self.bytes += len(chunk)
+        self.__index.write(CHUNK_ENTRY.pack(block[0, NUM_REGISTERS] / TICKS_PER_SECOND,
+                                            block[-1, NUM_REGISTERS] / TICKS_PER_SECOND, offset, len(block)))
+        self.__index.flush()
+
+    def close(self) -> None:
+        """Write last partial chunk and close files"""
+        with self.__lock:
+            if self.__data.closed:
+                return
+            self.__write_chunk()
+            self.__data.close()
+            self.__index.close()
+
+class ArchiveReader:
+    """Time range queries on an archive, decodes only chunks overlapping the range"""
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        # Index before data, every chunk it lists is within the mapping also while recording
+        with open(path + CHUNK_INDEX_SUFFIX, 'rb') as file:
+            if file.read(len(CHUNK_INDEX_MAGIC)) != CHUNK_INDEX_MAGIC:
+                raise ValueError(f'{path + CHUNK_INDEX_SUFFIX} is not an archive index')
+            entries = file.read()
+        with open(path, 'rb') as file:
+            if file.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError(f'{path} is not an archive')
+            self.__data: mmap.mmap = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        # Whole index in memory, one entry per chunk
+        self.chunks: list[tuple[float, float, int, int]] = list(
+            CHUNK_ENTRY.iter_unpack(entries[:len(entries) - len(entries) % CHUNK_ENTRY.size]))
+        self.__first: list[float] = [chunk[0] for chunk in self.chunks]
+
+    def close(self) -> None:
+        self.__data.close()
+
+    def __enter__(self) -> 'ArchiveReader':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def record_count(self) -> int:
+        return sum(chunk[3] for chunk in self.chunks)
+
+    def time_range(self) -> tuple[float, float] or None:
+        """Wall times of first and last sample, None if the archive is empty"""
+        if not self.chunks:
+            return None
+        return self.chunks[0][0], self.chunks[-1][1]
+
+    def blocks(self, t_from: float = 0.0, t_to: float = float('inf')) -> Iterator[np.ndarray]:
+        """Samples with read end between t_from and t_to, one (n, NUM_REGISTERS + 2) block
+        per chunk. The chunk index gives the first chunk, decoding stops after the last
+        """
+        first = max(0, int(np.searchsorted(self.__first, t_from, side = 'right')) - 1)
+        data = memoryview(self.__data)
+        try:
+            for t_first, t_last, offset, _ in self.chunks[first:]:
+                if t_first > t_to:
+                    return
+                if t_last < t_from:
+                    continue
+                block = decode_chunk(data[offset:])
+                if t_first < t_from or t_last > t_to:
+                    t = block[:, NUM_REGISTERS]
+                    block = block[(t >= t_from) & (t <= t_to)]
+                yield block
+        finally:
+            data.release()
+
+    def samples(self, t_from: float = 0.0, t_to: float = float('inf')) -> Iterator[DPSSample]:
+        """Samples of blocks as DPSSamples stamped with wall times"""
+        for block in self.blocks(t_from, t_to):
+            registers = block[:, :NUM_REGISTERS].astype(np.int64).tolist()
+            times = block[:, NUM_REGISTERS:].tolist()
+            # Rows are complete samples, registers then end and start time
+            yield from map(tuple.__new__, repeat(DPSSample), map(add, registers, times))
+
+def is_archive(path: str) -> bool:
+    """True if file at path starts with archive magic"""
+    with open(path, 'rb') as file:
+        return file.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+
+def compress_session(session_path: str, archive_path: str or None = None,
+                     chunk_samples: int = CHUNK_SAMPLES) -> tuple[bool, str]:
+    """Write all samples of a recorded session into an archive, next to the session with
+    ARCHIVE_SUFFIX if no path is given. Events are not archived, they stay in the session index
+    """
+    archive_path = archive_path or os.path.splitext(session_path)[0] + ARCHIVE_SUFFIX
+    try:
+        with SessionReader(session_path) as reader:
+            writer = ArchiveWriter(archive_path, chunk_samples)
+            try:
+                for sample in reader.samples(0.0, float('inf')):
+                    writer.add(sample, wall_time = True)
+            finally:
+                writer.close()
+    except (OSError, ValueError) as error:
+        return False, str(error)
+    size = os.path.getsize(session_path)
+    packed = os.path.getsize(archive_path) + os.path.getsize(archive_path + CHUNK_INDEX_SUFFIX)
+    return True, (f'{writer.records} samples, {size} bytes to {packed} bytes ({size / max(packed, 1):.1f}x) '
+                  f'in {archive_path}')
+
+def print_archive_query(path: str, start: str or None, end: str or None) -> None:
+    """Print samples between start and end or a summary of the archive, as print_query
+    of session store does. Raises ValueError on invalid input
+    """
+    with ArchiveReader(path) as reader:
+        time_range = reader.time_range()
+        if time_range is None:
+            print(f'{path}: empty archive')
+            return
+        if start or end:
+            t_from = parse_wall_time(start, time_range[0]) if start else time_range[0]
+            t_to = parse_wall_time(end, time_range[0]) if end else time_range[1]
+            print_samples(reader.samples(t_from, t_to))
+            return
+        size = os.path.getsize(path)
+        count = reader.record_count()
+        print(f'Archive:\t{path}\n'
+              f'From:\t\t{format_wall_time(time_range[0])}\n'
+              f'To:\t\t{format_wall_time(time_range[1])}\n'
+              f'Samples:\t{count}\n'
+              f'Chunks:\t\t{len(reader.chunks)}\n'
+              f'Size:\t\t{size} bytes, {size / max(count, 1):.2f} bytes per sample')
+
+if __name__ == "__main__":
+    print('Archive is not meant to be run standalone')
@@ -0,0 +1,118 @@
+"""
+BusScheduler module arbitrates access to the Modbus line. Transactions are
+granted by priority class and in FIFO order within a class, so a power-off
+request never waits behind queued polls. A transaction already on the wire
+cannot be preempted, it finishes or times out first
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from enum import IntEnum
+from threading import Condition
+from time import monotonic
+
+# Number of latest queueing latencies kept per class for percentiles
+LATENCY_HISTORY = 1000
+
+
+class Priority(IntEnum):
+    """Transaction classes, smaller value is served first"""
+    SAFETY = 0
+    SETPOINT = 1
+    POLL = 2
+
+class LatencyStats:
+    """Queueing latency statistics of one transaction class"""
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.cancelled: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+        self.recent: deque = deque(maxlen = LATENCY_HISTORY)
+
+    def add(self, latency: float) -> None:
+        """Add queueing latency of a granted transaction"""
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+        self.recent.append(latency)
+
+    def mean(self) -> float:
+        """Mean latency of all granted transactions"""
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, pct: float) -> float:
+        """Latency percentile over recent transactions"""
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+    def __str__(self) -> str:
+        return (f'n={self.count} cancelled={self.cancelled} mean={self.mean() * 1000.0:.2f} ms '
+                f'p99={self.percentile(99) * 1000.0:.2f} ms max={self.max * 1000.0:.2f} ms')
+
+class BusScheduler:
+    """Priority lock for bus transactions"""
+    def __init__(self) -> None:
+        self.__cond = Condition()
+        self.__busy: bool = False
+        self.__queues: tuple[deque, ...] = tuple(deque() for _ in Priority)
+        self.stats: tuple[LatencyStats, ...] = tuple(LatencyStats() for _ in Priority)
+
+    def __higher_pending(self, priority: Priority) -> bool:
+        """True if there are waiters with higher priority than given"""
+        return any(self.__queues[p] for p in range(priority))
+
+    def acquire(self, priority: Priority, cancellable: bool = False,
+                timeout: float or None = None) -> bool:
+        """Wait for the bus. Cancellable requests give up if higher priority work is
+        pending, any request gives up after timeout seconds. Return True if granted
+        """
+        t_request = monotonic()
+        token = object()
+        queue = self.__queues[priority]
+        with self.__cond:
+            queue.append(token)
+            while True:
+                if cancellable and self.__higher_pending(priority):
+                    break
+                if (not self.__busy and queue[0] is token
+                        and not self.__higher_pending(priority)):
+                    queue.popleft()
+                    self.__busy = True
+                    self.stats[priority].add(monotonic() - t_request)
+                    return True
+                remaining = None if timeout is None else timeout - (monotonic() - t_request)
+                if remaining is not None and remaining <= 0:
+                    break
+                self.__cond.wait(remaining)
+            queue.remove(token)
+            self.stats[priority].cancelled += 1
+            self.__cond.notify_all()
+            return False
+
+    def release(self) -> None:
+        """Release the bus for next transaction"""
+        with self.__cond:
+            self.__busy = False
+            self.__cond.notify_all()
+
+    @contextmanager
+    def transaction(self, priority: Priority, cancellable: bool = False,
+                    timeout: float or None = None):
+        """Context manager around acquire/release, yields True if granted"""
+        granted = self.acquire(priority, cancellable, timeout)
+        try:
+            yield granted
+        finally:
+            if granted:
+                self.release()
+
+    def get_printable_stats(self) -> str:
+        """Queueing latency statistics per class"""
+        return '\n'.join(f'{p.name:<10}{self.stats[p]}' for p in Priority)
+
+if __name__ == "__main__":
+    print('BusScheduler is not meant to be run standalone')
@@ -0,0 +1,289 @@
+"""
+Device process module runs DPSEngine and the poll loop in a child process,
+so GUI rendering and other threads of the main process cannot disturb
+sampling timing. Samples are published into a shared memory ring buffer
+and signalled with an event, commands go over a pipe
+
+RemoteEngine has the same interface as DPSEngine and is used by the
+controller in place of it
+"""
+
+import atexit
+import multiprocessing
+import multiprocessing.connection
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock
+from time import monotonic
+import numpy as np
+import minimalmodbus
+
+from .dps_status import DPSSample, NUM_REGISTERS
+from .dps_models import DPSModel, ScaleTable, DEFAULT_SCALE, SCALE_TABLES
+from .presets import Preset
+
+# Seconds to wait for child process to connect or answer a command
+COMMAND_TIMEOUT = 10.0
+
+
+class SampleRing:
+    """Single writer ring buffer of samples in shared memory.
+    Layout: int64 write count, int64 capacity, int32 registers[capacity][NUM_REGISTERS],
+    float64 timestamps[capacity][2] (acquisition end and start)
+    """
+    HEADER = 16
+
+    def __init__(self, capacity: int = 4096, name: str or None = None) -> None:
+        """Create new ring, or attach to existing one if name is given"""
+        if name is None:
+            size = self.HEADER + capacity * (NUM_REGISTERS * 4 + 16)
+            self.shm = SharedMemory(create = True, size = size)
+            self.owner = True
+        else:
+            # Spawned children share the resource tracker of the owner, only the owner unlinks
+            self.shm = SharedMemory(name = name)
+            self.owner = False
+        buf = self.shm.buf
+        self.header: np.ndarray = np.ndarray((2,), dtype = np.int64, buffer = buf)
+        if self.owner:
+            self.header[:] = (0, capacity)
+        self.capacity: int = int(self.header[1])
+        regs_size = self.capacity * NUM_REGISTERS * 4
+        self.regs: np.ndarray = np.ndarray((self.capacity, NUM_REGISTERS), dtype = np.int32,
+                                           buffer = buf, offset = self.HEADER)
+        self.times: np.ndarray = np.ndarray((self.capacity, 2), dtype = np.float64,
+                                            buffer = buf, offset = self.HEADER + regs_size)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def count(self) -> int:
+        """Number of samples written since creation"""
+        return int(self.header[0])
+
+    def write(self, registers: list[int], t: float, t_start: float) -> None:
+        """Publish sample, slot is filled before count is advanced"""
+        count = int(self.header[0])
+        slot = count % self.capacity
+        self.regs[slot] = registers[:NUM_REGISTERS]
+        self.times[slot] = (t, t_start)
+        self.header[0] = count + 1
+
+    def sample(self, seq: int) -> DPSSample or None:
+        """Sample number seq, None if it has been overwritten already"""
+        slot = seq % self.capacity
+        values = self.regs[slot].tolist()
+        values += self.times[slot].tolist()
+        # Writer may have lapped the reader while copying
+        if self.count() - seq > self.capacity - 1:
+            return None
+        return tuple.__new__(DPSSample, values)
+
+    def close(self) -> None:
+        """Detach, owner also frees the segment"""
+        del self.header, self.regs, self.times
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def _device_main(conn: Connection, ring_name: str, published, instrument_factory, capture_path: str or None,
+                 port: str, slave: int, baud_rate: int, first_sample: DPSSample or None,
+                 poll_interval: float) -> None:
+    """Child process: connect, then poll into ring and serve commands between polls.
+    Event published is set after every sample written
+    """
+    # Imported here, the child process needs only the engine
+    from .dps_engine import DPSEngine
+    engine = DPSEngine(debug = False, capture_path = capture_path)
+    engine.instrument_factory = instrument_factory
+    ring = SampleRing(name = ring_name)
+    ret, msg = engine.connect(port, slave, baud_rate, first_sample)
+    conn.send((ret, msg, engine.scale.model, engine.registers))
+    if not ret:
+        ring.close()
+        return
+    try:
+        t_next = monotonic()
+        while True:
+            timeout = t_next - monotonic()
+            # Wait for commands until next poll is due
+            if conn.poll(max(0.0, timeout)):
+                request = conn.recv()
+                if request is None:
+                    break
+                method, args = request
+                try:
+                    conn.send((True, getattr(engine, method)(*args)))
+                except Exception as error:
+                    conn.send((False, str(error)))
+                continue
+            t_next += poll_interval
+            if t_next < monotonic():
+                # Fell behind, do not try to catch up with a burst of polls
+                t_next = monotonic() + poll_interval
+            try:
+                sample = engine.get_registers()
+            except (minimalmodbus.ModbusException, OSError):
+                continue
+            if sample is not None:
+                ring.write(list(sample), sample.t, sample.t_start)
+                published.set()
+    finally:
+        ring.close()
+
+class RemoteEngine:
+    """DPSEngine counterpart in the main process, talks to the device process"""
+    # Poll rate is set by the device process, the controller does not sleep between reads
+    self_paced: bool = True
+
+    def __init__(self, capture_path: str or None = None, poll_interval: float = 1.0,
+                 capacity: int = 4096) -> None:
+        """Constructor, the device process is started at connect"""
+        self.capture_path: str or None = capture_path
+        self.poll_interval: float = poll_interval
+        self.capacity: int = capacity
+        self.instrument_factory: callable = minimalmodbus.Instrument
+        self.registers: DPSSample = DPSSample()
+        self.scale: ScaleTable = DEFAULT_SCALE
+        self.ring: SampleRing or None = None
+        self.process: multiprocessing.Process or None = None
+        self.__conn: Connection or None = None
+        self.__lock = Lock()
+        # Guards ring against being freed while it is read, and the read position
+        self.__ring_lock = Lock()
+        self.__next_seq: int = 0
+        # Set by device process when it has written a sample
+        self.__published = None
+
+    def connect(self, port: str, slave: int, baud_rate: int,
+                first_sample: DPSSample or None = None) -> tuple[bool, str]:
+        """Start device process and connect to DPS in it"""
+        ctx = multiprocessing.get_context('spawn')
+        self.ring = SampleRing(self.capacity)
+        self.__published = ctx.Event()
+        self.__conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target = _device_main, daemon = True,
+                                   args = (child_conn, self.ring.name, self.__published,
+                                           self.instrument_factory, self.capture_path, port, slave, baud_rate,
+                                           first_sample, self.poll_interval))
+        self.process.start()
+        # Wait for connect result, or for the child to die
+        multiprocessing.connection.wait([self.__conn, self.process.sentinel], COMMAND_TIMEOUT)
+        if not self.__conn.poll():
+            self.close()
+            return False, 'Device process did not respond'
+        ret, msg, model, self.registers = self.__conn.recv()
+        if not ret:
+            self.close()
+            return ret, msg
+        self.scale = self.__scale_for(model)
+        self.__next_seq = self.ring.count()
+        atexit.register(self.close)
+        return ret, msg
+
+    @staticmethod
+    def __scale_for(model: DPSModel) -> ScaleTable:
+        """Scale table matching model chosen by device process"""
+        return next((table for table in SCALE_TABLES.values() if table.model == model), DEFAULT_SCALE)
+
+    def close(self) -> None:
+        """Stop device process and free the ring"""
+        if self.__conn is not None and self.process is not None and self.process.is_alive():
+            with self.__lock:
+                self.__conn.send(None)
+            self.process.join(COMMAND_TIMEOUT)
+        with self.__ring_lock:
+            if self.ring is not None:
+                self.ring.close()
+                self.ring = None
+        # Wake up a reader waiting for samples
+        if self.__published is not None:
+            self.__published.set()
+
+    def __call(self, method: str, *args):
+        """Run engine method in device process"""
+        with self.__lock:
+            self.__conn.send((method, args))
+            if not self.__conn.poll(COMMAND_TIMEOUT):
+                raise minimalmodbus.NoResponseError('Device process did not answer')
+            ok, result = self.__conn.recv()
+        if not ok:
+            raise minimalmodbus.ModbusException(result)
+        return result
+
+    def get_registers(self, cancellable: bool = False, timeout: float or None = None) -> DPSSample or None:
+        """Next sample published by device process, each sample is returned once in order.
+        Waits up to timeout seconds (forever if None) for a new sample
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            sample = self.__take_sample()
+            if sample is not None:
+                self.registers = sample
+                return sample
+            if self.ring is None:
+                return None
+            # Cleared before checking again, a sample written after the check sets it
+            self.__published.clear()
+            sample = self.__take_sample()
+            if sample is not None:
+                self.registers = sample
+                return sample
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining <= 0.0:
+                return None
+            self.__published.wait(remaining)
+
+    def __take_sample(self) -> DPSSample or None:
+        """Sample at read position and advance it, None if there is no new sample"""
+        with self.__ring_lock:
+            ring = self.ring
+            if ring is None:
+                return None
+            count = ring.count()
+            while count > self.__next_seq:
+                if count - self.__next_seq >= ring.capacity:
+                    # Reader was lapped, skip to the oldest sample still in ring
+                    self.__next_seq = count - ring.capacity + 1
+                sample = ring.sample(self.__next_seq)
+                self.__next_seq += 1
+                if sample is not None:
+                    return sample
+                count = ring.count()
+            return None
+
+    def set_power(self, enable: bool) -> tuple[bool, str]:
+        return self.__call('set_power', enable)
+
+    def toggle_power(self) -> tuple[bool, str]:
+        return self.__call('toggle_power')
+
+    def set_volts(self, volts: float) -> tuple[bool, str]:
+        return self.__call('set_volts', volts)
+
+    def set_amps(self, amps: float) -> tuple[bool, str]:
+        return self.__call('set_amps', amps)
+
+    def set_volts_and_amps(self, volts: float, amps: float) -> tuple[bool, str]:
+        return self.__call('set_volts_and_amps', volts, amps)
+
+    def read_preset(self, group: int) -> tuple[bool, Preset]:
+        return self.__call('read_preset', group)
+
+    def write_preset(self, group: int, preset: Preset) -> tuple[bool, str]:
+        return self.__call('write_preset', group, preset)
+
+    def recall_preset(self, group: int) -> tuple[bool, str]:
+        return self.__call('recall_preset', group)
+
+    def get_printable_status(self) -> tuple[bool, str]:
+        return self.__call('get_printable_status')
+
+    def get_bus_stats(self) -> tuple[bool, str]:
+        if self.process is None or not self.process.is_alive():
+            return False, 'Device process is not running'
+        return self.__call('get_bus_stats')
+
+if __name__ == "__main__":
+    print('Device process module is not meant to be run standalone')
@@ -0,0 +1,178 @@
+"""
+Discovery module finds DPS devices on serial ports. Candidate ports are
+probed in parallel, one thread per port, and slave IDs of a port are
+scanned one after another with a short timeout. A device is identified by
+its MODEL register. Found devices are cached in a file so the next connect
+tries them before a scan when the configured port and slave do not answer
+
+A probe reads the whole status register block, connect reuses the block of
+the located device instead of reading it again. Probe timeout is the transfer
+time of request and reply at the probed baud rate plus the device response
+time, a responder is accepted only if its MODEL register is a known DPS model
+"""
+
+import glob
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, time
+from typing import NamedTuple
+import minimalmodbus
+from minimalmodbus import ModbusException
+from serial import SerialException
+from serial.tools import list_ports
+
+from .dps_engine import REGISTER_BLOCK
+from .dps_models import MODELS
+from .dps_status import DPSSample
+from .utils import conf_get
+
+# Defaults when not configured
+PORT_PATTERNS = ('/dev/ttyUSB*', '/dev/ttyACM*')
+SLAVE_RANGE = (1, 5)
+PROBE_TIMEOUT = 0.25
+# Modbus RTU frame sizes of a status block read and bits on the wire per byte
+REQUEST_BYTES = 8
+REPLY_BYTES = 5 + 2 * REGISTER_BLOCK
+BITS_PER_BYTE = 11
+CACHE_FILE = 'dps_discovery.json'
+
+
+class DiscoveredDevice(NamedTuple):
+    """Device answering on port with slave ID"""
+    port: str
+    slave: int
+    baud_rate: int
+    model: int
+
+    def __str__(self) -> str:
+        model = MODELS[self.model].name if self.model in MODELS else f'unknown model {self.model}'
+        return f'{self.port}\tslave {self.slave}\t{self.baud_rate} baud\t{model}'
+
+class Discovery:
+    """Parallel port and slave ID scanner with a cache of found devices"""
+    def __init__(self, conf) -> None:
+        self.enabled: bool = conf_get(conf, 'discovery', 'enabled', True)
+        self.patterns: list[str] = list(conf_get(conf, 'discovery', 'port_patterns') or PORT_PATTERNS)
+        first, last = conf_get(conf, 'discovery', 'slave_range') or SLAVE_RANGE
+        self.slaves: range = range(first, last + 1)
+        self.baud_rates: list[int] = list(conf_get(conf, 'discovery', 'baud_rates')
+                                          or [conf['connection']['baud_rate']])
+        # Device response time allowed on top of frame transfer time
+        self.timeout: float = conf_get(conf, 'discovery', 'probe_timeout') or PROBE_TIMEOUT
+        self.cache_file: str = conf_get(conf, 'discovery', 'cache_file') or CACHE_FILE
+        # Creates the instrument, called as factory(port, slave)
+        self.instrument_factory: callable = minimalmodbus.Instrument
+        self.devices: list[DiscoveredDevice] = self.__load_cache()
+        # Register block read by latest probe of each device
+        self.samples: dict[DiscoveredDevice, DPSSample] = {}
+
+    def candidate_ports(self) -> list[str]:
+        """Serial ports matching configured patterns, all serial ports if none match"""
+        ports = sorted({port for pattern in self.patterns for port in glob.glob(pattern)})
+        if not ports:
+            ports = sorted(info.device for info in list_ports.comports())
+        return ports
+
+    def probe_timeout(self, baud_rate: int) -> float:
+        """Time to wait for the reply of one probe at baud_rate"""
+        return (REQUEST_BYTES + REPLY_BYTES) * BITS_PER_BYTE / baud_rate + self.timeout
+
+    def probe(self, port: str, slave: int, baud_rate: int) -> DiscoveredDevice or None:
+        """Read status register block of single slave, None if nothing answers or the
+        responder is not a known DPS model. Port is closed after the probe
+        """
+        try:
+            instrument = self.instrument_factory(port, slave)
+        except (SerialException, ModbusException, OSError):
+            return None
+        # Serial port object is shared by all instruments of the port
+        serial_port = instrument.serial
+        timeout = serial_port.timeout
+        try:
+            serial_port.baudrate = baud_rate
+            serial_port.timeout = self.probe_timeout(baud_rate)
+            instrument.close_port_after_each_call = False
+            t_start = monotonic()
+            reg_list = instrument.read_registers(registeraddress = 0x0, number_of_registers = REGISTER_BLOCK)
+        except (SerialException, ModbusException, OSError):
+            return None
+        finally:
+            serial_port.timeout = timeout
+            serial_port.close()
+        sample = DPSSample.from_registers(reg_list, monotonic(), t_start)
+        if sample.model not in MODELS:
+            return None
+        device = DiscoveredDevice(port, slave, baud_rate, sample.model)
+        self.samples[device] = sample
+        return device
+
+    def __scan_port(self, port: str) -> list[DiscoveredDevice]:
+        """Scan all slave IDs and baud rates on one port, devices share the line so probes are sequential"""
+        found = []
+        for baud_rate in self.baud_rates:
+            for slave in self.slaves:
+                device = self.probe(port, slave, baud_rate)
+                if device is not None:
+                    found.append(device)
+            if found:
+                break
+        return found
+
+    def scan(self) -> list[DiscoveredDevice]:
+        """Probe all candidate ports in parallel, found devices replace the cache"""
+        ports = self.candidate_ports()
+        if not ports:
+            self.devices = []
+            return self.devices
+        with ThreadPoolExecutor(max_workers = len(ports)) as pool:
+            results = pool.map(self.__scan_port, ports)
+        self.devices = [device for found in results for device in found]
+        self.__save_cache()
+        return self.devices
+
+    def locate(self, port: str, slave: int, baud_rate: int) -> DiscoveredDevice or None:
+        """Find device to connect to: configured port and slave first, then cached
+        devices, finally a full scan. Its register block is in samples
+        """
+        candidates = [(port, slave, baud_rate)]
+        candidates += [(d.port, d.slave, d.baud_rate) for d in self.devices
+                       if (d.port, d.slave, d.baud_rate) != (port, slave, baud_rate)]
+        for candidate in candidates:
+            device = self.probe(*candidate)
+            if device is not None:
+                if device not in self.devices:
+                    self.devices.insert(0, device)
+                    self.__save_cache()
+                return device
+        devices = self.scan()
+        return devices[0] if devices else None
+
+    def get_printable_devices(self) -> tuple[bool, str]:
+        """Scan and list found devices"""
+        devices = self.scan()
+        if not devices:
+            return False, 'No DPS devices found'
+        return True, '\n' + '\n'.join(str(device) for device in devices)
+
+    def __load_cache(self) -> list[DiscoveredDevice]:
+        """Devices found in earlier runs"""
+        if not os.path.exists(self.cache_file):
+            return []
+        try:
+            with open(self.cache_file, 'r') as file:
+                cache = json.load(file)
+            return [DiscoveredDevice(*device) for device in cache['devices']]
+        except (OSError, ValueError, KeyError, TypeError):
+            return []
+
+    def __save_cache(self) -> None:
+        """Store found devices for next run"""
+        try:
+            with open(self.cache_file, 'w') as file:
+                json.dump({'time': time(), 'devices': [list(device) for device in self.devices]}, file)
+        except OSError as error:
+            print(f'Cannot write discovery cache: {error}')
+
+if __name__ == "__main__":
+    print('Discovery is not meant to be run standalone')
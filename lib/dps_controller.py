@@ -10,6 +10,7 @@ Commands supported:
 ===================
 
 Connect:                    c [<port>]
+Discover devices:           d
 Set port:                   p <port>
 Set voltage:                v <float>
 Set current:                a <float>
@@ -17,16 +18,43 @@ Set voltage and current     va <float> <float>
 Info:                       i
 Power set/toggle ON/OFF:    x [0/1]
 Monitor toggle ON/OFF:      m
+Energy and charge:          e [reset]
+Protection trips:           t
+Bus latency statistics:     b
+Poll timing:                j [reset]
+Profiling:                  profile start|stop
+Constant power/resistance:  cp <float> | cr <float>
+Back to CV/CC:              cv
+Regulator status:           r
+Group of devices:           g c|s|x 0/1|va <float> <float>|start|stop
+Record session:             record [<file>]|stop
+History:                    hist [<window>|reset]
+Telemetry sinks:            sinks
+Memory groups M0-M9:        mem <n> | mem r <n> | mem w <n> <V> <A> [<ovp> <ocp> <opp>] | mem load [<file>]
 
 """
 
 import threading
 from typing import Callable
 from queue import SimpleQueue
-from time import sleep
+from time import sleep, monotonic, time
+from minimalmodbus import ModbusException
+from serial import SerialException
 
-from lib.dps_status import DPSStatus
+from lib.dps_status import DPSStatus, DPSSample
 from lib.dps_engine import DPSEngine
+from lib.dps_group import DPSGroup
+from lib.discovery import Discovery
+from lib.device_process import RemoteEngine
+from lib.energy import EnergyAccumulator, EnergySnapshot
+from lib.poll_timing import PollTiming
+from lib.protection import ProtectionEngine, ProtectionTrip
+from lib.presets import Preset, PRESETS_FILE, PRESET_GROUPS, load_presets
+from lib.profiling import profiler
+from lib.regulator import Regulator, RegulatorMode
+from lib.rollup import Rollup, parse_duration
+from lib.session_store import SessionWriter, INDEX_STRIDE, SESSION_FILE
+from lib.sinks import TelemetrySinks
 from lib.utils import *
 
 VERSION: str = '0.9_beta1'
@@ -43,8 +71,21 @@ class DPSController:
         self.event_queue: SimpleQueue = SimpleQueue()
         self.event_thread : threading.Thread
 
-        # Instance to talk to DPS device through Modbus
-        self.engine = DPSEngine(debug = False)
+        # Seconds between samples read by the event provider
+        self.poll_interval: float = conf_get(conf, 'misc', 'poll_interval', 1.0)
+        # Events name the fields changed since previous sample, every keyframe_interval-th
+        # event is a keyframe that subscribers treat as fully changed
+        self.keyframe_interval: int = conf_get(conf, 'misc', 'keyframe_interval') or 10
+        self.__published: DPSSample or None = None
+        self.__since_keyframe: int = 0
+
+        # Instance to talk to DPS device through Modbus, optionally in a separate process
+        capture_path: str or None = conf_get(conf, 'misc', 'capture_file')
+        if conf_get(conf, 'misc', 'device_process', False):
+            self.engine = RemoteEngine(capture_path, self.poll_interval,
+                                       conf_get(conf, 'misc', 'ring_capacity', 4096))
+        else:
+            self.engine = DPSEngine(debug = False, capture_path = capture_path)
         self.version: str = VERSION
 
         # Limits from configuration
@@ -53,6 +94,54 @@ class DPSController:
         self.a_max = self.conf['limits']['max_current']
         self.a_min = self.conf['limits']['min_current']
 
+        # Software CP/CR loop run on every polled sample, its setpoint writes are coalesced
+        # so that only the latest pending setpoint is written once per poll cycle
+        self.regulator = Regulator(conf.get('regulator'), self.v_min, self.v_max)
+        self.__setpoint_lock = threading.Lock()
+        self.__pending_volts: float or None = None
+
+        # Connect sequence timing, first sample is published by the event thread
+        self.__t_connect: float = 0.0
+        self.connect_time: float or None = None
+        self.time_to_first_sample: float or None = None
+        # Start power off is skipped once the user has switched power
+        self.__power_lock = threading.Lock()
+        self.__power_commanded: bool = False
+        # Trip and offending sample time of a power off write that failed, retried every poll cycle
+        self.__trip_off: tuple[ProtectionTrip, float] or None = None
+
+        # Energy and charge integrated from polled samples
+        max_gap: float = conf_get(conf, 'energy', 'max_gap', 5 * self.poll_interval)
+        self.energy = EnergyAccumulator(max_gap)
+
+        # Poll interval jitter, read duration, age of samples when consumed and failed polls
+        self.poll_timing = PollTiming()
+
+        # Software protection evaluated against every polled sample
+        self.protection = ProtectionEngine(self.conf.get('protection'))
+
+        # Downsampled min/max/mean history of output, fixed size for runs of weeks
+        self.history = Rollup(conf.get('history'))
+        self.history_rows: int = conf_get(conf, 'history', 'cli_rows') or 24
+
+        # Polled samples and events recorded into an indexed session file
+        self.recorder: SessionWriter or None = None
+
+        # Destinations fed with every polled sample, each written by its own thread
+        self.sinks = TelemetrySinks(conf.get('sinks'))
+
+        # Finds port and slave ID of device when connecting without explicit port
+        self.discovery = Discovery(conf)
+
+        # Devices controlled together with broadcast writes and aligned sampling
+        self.group = DPSGroup(conf)
+
+        # Hot paths covered when profiling is started
+        profiler.report_dir = conf_get(conf, 'misc', 'profile_dir', '.')
+        profiler.register(self, '_DPSController__poll_once', 'DPSController.__event_provider')
+        profiler.register(self, 'parse_command', 'DPSController.parse_command')
+        profiler.register(self.engine, 'get_registers', 'DPSEngine.get_registers')
+
     @staticmethod
     def get_version() -> str:
         """Get version string"""
@@ -70,29 +159,44 @@ class DPSController:
         """Get baud rate as string"""
         return str(self.status.baudrate)
 
-    def connect(self) -> tuple[bool, str]:
-        """Start controller, connect to device"""
-        conn, msg = self.engine.connect(self.status.port, self.status.slave, self.status.baudrate)
+    def connect(self, discover: bool = True) -> tuple[bool, str]:
+        """Start controller, connect to device. With discover, cached and configured
+        devices are tried first and serial ports are scanned if neither answers
+        """
+        self.__t_connect = monotonic()
+        self.time_to_first_sample = None
+        # Register block read by discovery doubles as handshake
+        first_sample: DPSSample or None = None
+        if discover and self.discovery.enabled:
+            device = self.discovery.locate(self.status.port, self.status.slave, self.status.baudrate)
+            if device is None:
+                return False, 'ERROR: No DPS device found.'
+            self.status.port = device.port
+            self.status.slave = device.slave
+            self.status.baudrate = device.baud_rate
+            first_sample = self.discovery.samples.get(device)
+        conn, msg = self.engine.connect(self.status.port, self.status.slave, self.status.baudrate, first_sample)
         if not conn:
             return False, "ERROR: Cannot connect to DPS device."
+        model_msg = msg if msg else f'model {self.engine.scale.model.name}'
 
+        # Handshake block is the initial status, rest of the sequence runs in event thread
         self.status.connected = True
-        self.get_status()
-
-        # If configured, start with power off always
-        if self.conf['misc']['start_power_off']:
-            self.engine.set_power(False)
-            self.status.registers.onoff = 0
-
+        self.status.registers = self.engine.registers
+        self.connect_time = monotonic() - self.__t_connect
+        self.poll_timing.reset()
+        self.__published = None
         self.start_events()
-        return True, "Connection successful"
+        return True, f'Connection successful, {model_msg}, {self.connect_time * 1000.0:.0f} ms'
 
     def get_portinfo(self) -> tuple[bool, str]:
         """Convenience method to get just the port info"""
-        return (
-            True,
-            f'Connected:\t{self.status.connected}\nPort:\t\t{self.status.port}\nSlave:\t\t{self.status.slave}',
-        )
+        info = f'Connected:\t{self.status.connected}\nPort:\t\t{self.status.port}\nSlave:\t\t{self.status.slave}'
+        if self.connect_time is not None:
+            info += f'\nConnect:\t{self.connect_time * 1000.0:.1f} ms'
+        if self.time_to_first_sample is not None:
+            info += f'\nFirst sample:\t{self.time_to_first_sample * 1000.0:.1f} ms'
+        return True, info
 
     def get_connected(self) -> bool:
         """Get connected status"""
@@ -124,14 +228,140 @@ class DPSController:
         """Get min current from configuration"""
         return self.a_min
 
+    def get_energy(self) -> EnergySnapshot:
+        """Get accumulated energy and charge"""
+        return self.energy.snapshot()
+
+    def __warm_up(self) -> None:
+        """Finish connect sequence in event thread: switch power off if configured
+        and publish the handshake block as first sample
+        """
+        registers: DPSSample = self.status.registers
+        # If configured, start with power off always, unless user already switched power
+        if self.conf['misc']['start_power_off'] and registers.onoff:
+            with self.__power_lock:
+                if not self.__power_commanded:
+                    self.engine.set_power(False)
+                    registers = registers.replace(onoff = 0)
+                    self.status.registers = registers
+        self.__process(registers)
+        self.time_to_first_sample = monotonic() - self.__t_connect
+
     def __event_provider(self) -> None:
-        """Event provider thread filling up the event queue"""
+        """Event provider thread filling up the event queue. Bus errors fail one cycle
+        only, they are counted in poll timing and polling goes on
+        """
+        try:
+            self.__warm_up()
+        except (SerialException, ModbusException) as error:
+            self.poll_timing.error(error)
+        if not self.engine.self_paced:
+            sleep(self.poll_interval)
         while True:
-            status: DPSStatus = DPSStatus()
-            registers : dict[str, any] = self.engine.get_registers()
-            status.registers = registers
-            self.event_queue.put_nowait(status)
-            sleep(1)
+            try:
+                if self.__trip_off is not None:
+                    self.__switch_off_tripped()
+                self.__poll_once()
+            except (SerialException, ModbusException) as error:
+                self.poll_timing.error(error)
+            if not self.engine.self_paced:
+                sleep(self.poll_interval)
+
+    def __poll_once(self) -> None:
+        """Read one sample, run per-sample processing and queue it as event"""
+        # Poll gives way to pending writes and is dropped if it cannot start within one interval
+        registers: DPSSample = self.engine.get_registers(cancellable = True, timeout = self.poll_interval)
+        if registers is None:
+            return
+        self.__process(registers)
+
+    def __process(self, registers: DPSSample) -> None:
+        """Per-sample processing, queue sample as event"""
+        status: DPSStatus = DPSStatus()
+        t_start, t_end = registers.t_start, registers.t
+        status.registers = registers
+        # Latest sample for commands that act on device state, like power toggle
+        self.status.registers = registers
+        self.poll_timing.add(registers)
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.add(registers)
+        self.sinks.offer(registers)
+        _, _, u_out, i_out, p_out, u_in = registers.to_units(self.engine.scale)
+        on = bool(registers.onoff)
+        # Timestamp the sample at the middle of the read transaction
+        self.energy.add((t_start + t_end) * 0.5, p_out, i_out, on)
+        self.history.add(t_end, u_out, i_out, p_out)
+        trip: ProtectionTrip = self.protection.check(t_end, u_out, i_out, p_out, u_in, on)
+        if trip is not None:
+            self.__trip(trip, t_end)
+            status.trip = trip
+        elif self.regulator.active():
+            volts = self.regulator.update(t_end, u_out, i_out, on)
+            if volts is not None:
+                self.queue_setpoint(volts)
+        self.__set_changes(status)
+        self.event_queue.put_nowait(status)
+        self.__flush_setpoint()
+
+    def __set_changes(self, status: DPSStatus) -> None:
+        """Mark event as keyframe or with the fields changed since previous event"""
+        prev, self.__published = self.__published, status.registers
+        self.__since_keyframe += 1
+        if prev is None or self.__since_keyframe >= self.keyframe_interval:
+            self.__since_keyframe = 0
+            return
+        status.keyframe = False
+        status.changed = status.registers.diff(prev)
+
+    def queue_setpoint(self, volts: float) -> None:
+        """Queue voltage setpoint to be written after the next sample, a newer
+        setpoint replaces one not written yet
+        """
+        with self.__setpoint_lock:
+            self.__pending_volts = volts
+
+    def __stop_regulator(self) -> None:
+        """Stop CP/CR loop and drop its unwritten setpoint"""
+        self.regulator.stop()
+        with self.__setpoint_lock:
+            self.__pending_volts = None
+
+    def __flush_setpoint(self) -> None:
+        """Write pending setpoint, called from poll cycle"""
+        with self.__setpoint_lock:
+            volts, self.__pending_volts = self.__pending_volts, None
+        if volts is not None:
+            self.engine.set_volts(volts)
+
+    def __trip(self, trip: ProtectionTrip, t_sample: float) -> None:
+        """Switch output off because of protection trip, latency is measured from
+        receiving the offending sample until the off command has been written
+        """
+        self.__trip_off = (trip, t_sample)
+        try:
+            self.__switch_off_tripped()
+        except (SerialException, ModbusException) as error:
+            # Written again before every poll until it succeeds
+            self.poll_timing.error(error)
+        self.__stop_regulator()
+        trip.wall_time = time()
+        self.protection.record(trip)
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.add_trip(t_sample, trip.rule, trip.value)
+
+    def __switch_off_tripped(self) -> None:
+        """Write power off of pending trip, raises on bus errors and stays pending"""
+        trip, t_sample = self.__trip_off
+        self.engine.set_power(False)
+        self.__trip_off = None
+        trip.latency = monotonic() - t_sample
+        self.status.registers = self.status.registers.replace(onoff = 0)
+
+    def get_trips(self) -> list[ProtectionTrip]:
+        """Get history of protection trips, oldest first"""
+        return list(self.protection.trips)
 
     def start_events(self) -> None:
         """Start a thread providing events from DPS"""
@@ -183,8 +413,16 @@ class DPSController:
             return False, 'Already connected'
         if len(cmd):
             self.status.port = args
+            # Explicit port is used as it is
+            return self.connect(discover = False)
         return self.connect()
 
+    def __handle_discover(self, args: str = '') -> tuple[bool, str]:
+        """Handle discover command, scan serial ports for devices"""
+        if self.status.connected:
+            return False, 'Discovery would disturb the connected device, restart to scan'
+        return self.discovery.get_printable_devices()
+
     def __handle_info(self, cmd: str = '') -> tuple[bool, str]:
         """Handle info command"""
         return self.engine.get_printable_status()
@@ -194,14 +432,227 @@ class DPSController:
         switchto: bool
         if len(pwr) == 0:
             switchto = not self.status.registers.onoff
+        elif validate_int(pwr):
+            switchto = int(pwr) != 0
         else:
-            switchto = bool(pwr)
+            return False, 'Invalid argument, use \'x\', \'x 0\' or \'x 1\''
 
-        self.engine.set_power(switchto)
-        self.status.registers.onoff = switchto
+        with self.__power_lock:
+            self.__power_commanded = True
+            self.engine.set_power(switchto)
+            self.status.registers = self.status.registers.replace(onoff = int(switchto))
         pwr = 'ON' if switchto is True else 'OFF'
         return True, f'Power switched {pwr}'
 
+    def __handle_energy(self, args: str) -> tuple[bool, str]:
+        """Handle energy command, show or reset accumulators"""
+        if args == 'reset':
+            self.energy.reset()
+            return True, 'Energy and charge reset'
+        if len(args):
+            return False, 'Invalid argument, use \'e\' or \'e reset\''
+        return True, '\n' + str(self.energy.snapshot())
+
+    def __handle_trips(self, args: str = '') -> tuple[bool, str]:
+        """Handle trips command, list protection trips"""
+        if not self.protection.enabled():
+            return True, 'No protection rules configured'
+        trips = self.get_trips()
+        if not trips:
+            return True, 'No protection trips'
+        return True, '\n' + '\n'.join(str(trip) for trip in trips)
+
+    def __handle_bus_stats(self, args: str = '') -> tuple[bool, str]:
+        """Handle bus command, queueing latency per transaction class"""
+        return self.engine.get_bus_stats()
+
+    def __handle_poll_timing(self, args: str = '') -> tuple[bool, str]:
+        """Handle poll timing command, show or reset interval, jitter and age statistics"""
+        if args == 'reset':
+            self.poll_timing.reset()
+            return True, 'Poll timing statistics reset'
+        if len(args):
+            return False, 'Invalid argument, use \'j\' or \'j reset\''
+        return True, '\n' + self.poll_timing.get_printable_status()
+
+    def __handle_record(self, args: str = '') -> tuple[bool, str]:
+        """Handle record command, start recording samples into session file or stop"""
+        recorder = self.recorder
+        if args == 'stop':
+            if recorder is None:
+                return False, 'Not recording'
+            self.recorder = None
+            recorder.close()
+            return True, f'Recorded {recorder.records} samples and {recorder.events} events to {recorder.path}'
+        if recorder is not None:
+            return False, f'Already recording to {recorder.path}'
+        path = args or conf_get(self.conf, 'session', 'file') or SESSION_FILE
+        try:
+            self.recorder = SessionWriter(path, conf_get(self.conf, 'session', 'index_stride') or INDEX_STRIDE)
+        except OSError as error:
+            return False, f'Cannot record to {path}: {error}'
+        return True, f'Recording to {path}'
+
+    def __handle_sinks(self, args: str = '') -> tuple[bool, str]:
+        """Handle sinks command, samples offered, written and dropped per sink, fails if a
+        configured sink could not be started
+        """
+        if len(args):
+            return False, 'Invalid argument, use \'sinks\''
+        return not self.sinks.start_errors, '\n' + self.sinks.get_printable_status()
+
+    def __handle_history(self, args: str = '') -> tuple[bool, str]:
+        """Handle history command, downsampled output history of window or reset"""
+        if args == 'reset':
+            self.history.reset()
+            return True, 'History reset'
+        try:
+            window = parse_duration(args) if args else 3600.0
+        except ValueError:
+            return False, 'Invalid window, use seconds or e.g. 90s, 15m, 6h, 30d'
+        return True, '\n' + self.history.get_printable_series(window, self.history_rows, time() - monotonic())
+
+    @staticmethod
+    def __handle_profile(args: str) -> tuple[bool, str]:
+        """Handle profile command, start or stop profiling"""
+        if args == 'start':
+            return profiler.start()
+        if args == 'stop':
+            return profiler.stop()
+        return False, 'Invalid argument, use \'profile start\' or \'profile stop\''
+
+    def __handle_group(self, args: str) -> tuple[bool, str]:
+        """Handle group command, subcommands c, s, x, va, start and stop"""
+        sub_cmd: list[str] = args.split()
+        if not sub_cmd:
+            return False, 'Group subcommand is required'
+        if sub_cmd[0] == 'c':
+            if self.group.connected:
+                return False, 'Group already connected'
+            return self.group.connect()
+        if not self.group.connected:
+            return False, 'Group is not connected. Use \'g c\' to connect first.'
+        if sub_cmd[0] == 's':
+            return self.group.get_printable_status()
+        elif sub_cmd[0] == 'x' and len(sub_cmd) == 2 and sub_cmd[1] in ('0', '1'):
+            return self.group.set_power(sub_cmd[1] == '1')
+        elif sub_cmd[0] == 'va' and len(sub_cmd) == 3 and validate_float(sub_cmd[1]) and validate_float(sub_cmd[2]):
+            v, a = float(sub_cmd[1]), float(sub_cmd[2])
+            if not self.__check_amps_range(a) or not self.__check_volts_range(v):
+                return False, f'Voltage or current requested out of configured limits [{self.v_max} V, {self.a_max} A]'
+            return self.group.set_volts_and_amps(v, a)
+        elif sub_cmd[0] == 'start':
+            return self.group.start_sampling()
+        elif sub_cmd[0] == 'stop':
+            return self.group.stop_sampling()
+        return False, 'Invalid group command'
+
+    def __handle_memory(self, args: str) -> tuple[bool, str]:
+        """Handle mem command: recall, read, write or load memory groups from presets file"""
+        sub_cmd = args.split()
+        if len(sub_cmd) == 1 and validate_int(sub_cmd[0]):
+            group = int(sub_cmd[0])
+            if not 0 <= group < PRESET_GROUPS:
+                return False, f'Memory group must be 0-{PRESET_GROUPS - 1}'
+            try:
+                _, preset = self.engine.read_preset(group)
+            except (ModbusException, SerialException) as error:
+                return False, f'Reading M{group} failed ({error})'
+            if not self.__check_preset(preset):
+                return False, f'M{group} values out of configured limits: {preset}'
+            # Output must only be switched on by power commands
+            if preset.power_on:
+                return False, f'M{group} switches output on when recalled (power on set), not recalled'
+            # Recalled setpoints replace CP/CR setpoints
+            self.__stop_regulator()
+            try:
+                self.engine.recall_preset(group)
+            except (ModbusException, SerialException) as error:
+                return False, f'Recalling M{group} failed ({error})'
+            self.__written_setpoints(preset.volts, preset.amps)
+            return True, f'Recalled M{group}: {preset.volts} V {preset.amps} A'
+        if len(sub_cmd) == 2 and sub_cmd[0] == 'r' and validate_int(sub_cmd[1]):
+            group = int(sub_cmd[1])
+            if not 0 <= group < PRESET_GROUPS:
+                return False, f'Memory group must be 0-{PRESET_GROUPS - 1}'
+            try:
+                _, preset = self.engine.read_preset(group)
+            except (ModbusException, SerialException) as error:
+                return False, f'Reading M{group} failed ({error})'
+            return True, f'M{group}: {preset}'
+        if len(sub_cmd) in (4, 7) and sub_cmd[0] == 'w' and validate_int(sub_cmd[1]) \
+                and all(validate_float(value) for value in sub_cmd[2:]):
+            group = int(sub_cmd[1])
+            if not 0 <= group < PRESET_GROUPS:
+                return False, f'Memory group must be 0-{PRESET_GROUPS - 1}'
+            volts, amps = float(sub_cmd[2]), float(sub_cmd[3])
+            ovp, ocp, opp = (float(value) for value in sub_cmd[4:]) if len(sub_cmd) == 7 else \
+                (self.v_max, self.a_max, self.v_max * self.a_max)
+            return self.__write_presets({group: Preset(volts, amps, ovp, ocp, opp)})
+        if sub_cmd and sub_cmd[0] == 'load' and len(sub_cmd) <= 2:
+            path = sub_cmd[1] if len(sub_cmd) == 2 else conf_get(self.conf, 'presets', 'file') or PRESETS_FILE
+            try:
+                presets = load_presets(path, self.conf['limits'])
+            except ValueError as error:
+                return False, str(error)
+            if not presets:
+                return False, f'No presets in {path}'
+            return self.__write_presets(presets)
+        return False, 'Invalid memory command, use mem <n>, mem r <n>, mem w <n> <V> <A> [<ovp> <ocp> <opp>] or mem load [<file>]'
+
+    def __check_preset(self, preset: Preset) -> bool:
+        """Check that setpoints and protection values of memory group are within configured limits"""
+        return (self.__check_volts_range(preset.volts) and self.__check_amps_range(preset.amps)
+                and self.__check_volts_range(preset.ovp) and self.__check_amps_range(preset.ocp)
+                and 0.0 <= preset.opp <= self.v_max * self.a_max)
+
+    def __write_presets(self, presets: dict[int, Preset]) -> tuple[bool, str]:
+        """Write memory groups, one transaction each, setpoints and protection values must be
+        within configured limits
+        """
+        for group, preset in presets.items():
+            if not self.__check_preset(preset):
+                return False, (f'M{group} values out of configured limits [{self.v_max} V, {self.a_max} A, '
+                               f'{self.v_max * self.a_max} W]')
+        written = []
+        for group, preset in sorted(presets.items()):
+            try:
+                self.engine.write_preset(group, preset)
+            except (ModbusException, SerialException) as error:
+                return False, f'Writing M{group} failed ({error}), written: {written}'
+            written.append(f'M{group}')
+        return True, f'Written {", ".join(written)}'
+
+    def __handle_regulate(self, args: str, mode: RegulatorMode) -> tuple[bool, str]:
+        """Start CP or CR loop from current voltage setpoint"""
+        unit = 'W' if mode is RegulatorMode.CP else 'ohm'
+        if not validate_float(args) or float(args) <= 0:
+            return False, f'Target {unit} must be a positive number'
+        target = float(args)
+        # Latest polled sample, v command updates it with the written setpoint
+        u_set = self.status.registers.u_set / self.engine.scale.volts_scale
+        self.regulator.start(mode, target, u_set, self.engine.scale.volts_decimals)
+        return True, f'{mode.value} mode, holding {target} {unit} with setpoint updates every poll'
+
+    def __handle_constant_power(self, args: str) -> tuple[bool, str]:
+        """Handle cp command"""
+        return self.__handle_regulate(args, RegulatorMode.CP)
+
+    def __handle_constant_resistance(self, args: str) -> tuple[bool, str]:
+        """Handle cr command"""
+        return self.__handle_regulate(args, RegulatorMode.CR)
+
+    def __handle_constant_voltage(self, args: str = '') -> tuple[bool, str]:
+        """Handle cv command, stop CP/CR loop"""
+        if not self.regulator.active():
+            return False, 'Regulator is not running'
+        self.__stop_regulator()
+        return True, f'CV/CC mode, voltage setpoint left at {self.regulator.setpoint:.2f} V'
+
+    def __handle_regulator_status(self, args: str = '') -> tuple[bool, str]:
+        """Handle r command, loop rate and regulation error"""
+        return True, '\n' + self.regulator.get_printable_status()
+
     def __handle_set_port(self, port) -> tuple[bool, str]:
         """Handle set port"""
         if len(port) == 0:
@@ -209,6 +660,16 @@ class DPSController:
         self.status.port = port
         return True, f'Port set to {port}'
 
+    def __written_setpoints(self, volts: float or None = None, amps: float or None = None) -> None:
+        """Put written setpoints into latest sample until the next poll reads them back"""
+        scale = self.engine.scale
+        registers = self.status.registers
+        if volts is not None:
+            registers = registers.replace(u_set = scale.encode_volts(volts))
+        if amps is not None:
+            registers = registers.replace(i_set = scale.encode_amps(amps))
+        self.status.registers = registers
+
     def __check_volts_range(self, volts: float) -> bool:
         """Check that requested volts are within configured limits"""
         if self.v_max >= volts >= self.v_min:
@@ -227,9 +688,12 @@ class DPSController:
             volts = float(args)
             if not self.__check_volts_range(volts):
                 return False, f'Voltage requested out of configured limits [{self.v_max}]'
+            # Manual setpoint ends CP/CR mode
+            self.__stop_regulator()
             ret, msg = self.engine.set_volts(volts)
             if not ret:
                 return False, f'Set volts to {volts} V failed'
+            self.__written_setpoints(volts = volts)
             return True, f'Set volts to {volts} V'
         else:
             return False, 'Invalid values'
@@ -240,6 +704,8 @@ class DPSController:
             amps = float(args)
             if not self.__check_amps_range(amps):
                 return False, f'Current requested out of configured limits [{self.a_max}]'
+            # Manual setpoint ends CP/CR mode
+            self.__stop_regulator()
             ret, msg = self.engine.set_amps(amps)
             if not ret:
                 return False, f'Set amps to {amps} A failed'
@@ -260,9 +726,11 @@ class DPSController:
             if not self.__check_amps_range(a) or not self.__check_volts_range(v):
                 return False, f'Voltage or current requested out of configured limits [{self.v_max} V, {self.a_max} A]'
 
+            self.__stop_regulator()
             ret, msg = self.engine.set_volts_and_amps(float(volts), float(amps))
             if not ret:
                 return False, 'Set values failed'
+            self.__written_setpoints(v, a)
             return True, f'Set volts to {v} V and amps to {a} A'
         else:
             return False, 'Invalid values'
@@ -278,6 +746,8 @@ class DPSController:
             return self.__handle_connect, args, False
         elif main_cmd == 'p':
             return self.__handle_set_port, args, False
+        elif main_cmd == 'd':
+            return self.__handle_discover, args, False
         elif main_cmd == 'v':
             return self.__handle_set_volts, args, True
         elif main_cmd == 'va':
@@ -288,6 +758,34 @@ class DPSController:
             return self.__handle_info, args, True
         elif main_cmd == 'x':
             return self.__handle_power_switch, args, True
+        elif main_cmd == 'e':
+            return self.__handle_energy, args, False
+        elif main_cmd == 't':
+            return self.__handle_trips, args, False
+        elif main_cmd == 'b':
+            return self.__handle_bus_stats, args, False
+        elif main_cmd == 'j':
+            return self.__handle_poll_timing, args, False
+        elif main_cmd == 'profile':
+            return self.__handle_profile, args, False
+        elif main_cmd == 'cp':
+            return self.__handle_constant_power, args, True
+        elif main_cmd == 'cr':
+            return self.__handle_constant_resistance, args, True
+        elif main_cmd == 'cv':
+            return self.__handle_constant_voltage, args, True
+        elif main_cmd == 'r':
+            return self.__handle_regulator_status, args, False
+        elif main_cmd == 'g':
+            return self.__handle_group, args, False
+        elif main_cmd == 'record':
+            return self.__handle_record, args, False
+        elif main_cmd == 'hist':
+            return self.__handle_history, args, False
+        elif main_cmd == 'sinks':
+            return self.__handle_sinks, args, False
+        elif main_cmd == 'mem':
+            return self.__handle_memory, args, True
         else:
             # Unrecognized command, return None
             return None, 'Invalid command', False
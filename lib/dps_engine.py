@@ -4,18 +4,24 @@ Modbus protocol
 """
 
 from typing import List, Union
-from threading import Lock
+from time import monotonic
 import minimalmodbus
 from minimalmodbus import ModbusException, NoResponseError
 from serial import SerialException
 from enum import IntEnum
-from .dps_status import DPSRegisters
+from .dps_status import DPSSample
+from .bus_scheduler import BusScheduler, Priority
+from .modbus_capture import CaptureInstrument
+from .presets import Preset, PRESET_GROUPS, PRESET_REGISTERS, preset_address
 
-# Converters from int -> float
-from .utils import iampsf, ivoltsf, iwattsf
+# Register scaling of connected model
+from .dps_models import ScaleTable, DEFAULT_SCALE, scale_table_for
 
-# Use lock to prevent simultaneous R/W access to DPS device
-lock = Lock()
+# Registers read in one status block, NUM_REGISTERS of them are used
+REGISTER_BLOCK = 20
+
+# Scheduler prevents simultaneous R/W access to DPS device and orders waiting transactions by priority
+bus = BusScheduler()
 
 class DPSRegister(IntEnum):
     """Register addresses of DPS5005"""
@@ -27,19 +33,34 @@ class DPSRegister(IntEnum):
     VOLTS_UIN = 0x5
     PWR_ONOFF = 0x9
     MODEL = 0x0B
+    EXTRACT_M = 0x23
 
 class DPSEngine:
     """Class interacting with DPS5005 through Modbus protocol"""
-    def __init__(self, debug : bool = False) -> None:
-        """Constructor"""
+    # Controller paces polling with its own sleep
+    self_paced: bool = False
+
+    def __init__(self, debug : bool = False, capture_path: str or None = None) -> None:
+        """Constructor, if capture_path is given all Modbus traffic is logged there"""
         self.instrument = None
-        self.registers = DPSRegisters()
+        self.registers: DPSSample = DPSSample()
+        # Register scaling, selected by model at connect
+        self.scale: ScaleTable = DEFAULT_SCALE
         self.debug: bool = debug
-
-    def connect(self, port: str, slave: int, baud_rate: int) -> tuple[bool, str]:
-        """Connect to DPS through modbus"""
+        self.capture_path: str or None = capture_path
+        # Creates the instrument, called as factory(port, slave). Replaced to replay captured traffic
+        self.instrument_factory: callable = minimalmodbus.Instrument
+
+    def connect(self, port: str, slave: int, baud_rate: int,
+                first_sample: DPSSample or None = None) -> tuple[bool, str]:
+        """Connect to DPS through modbus. One register block read serves as connection
+        test, initial status and model identification, it is skipped if the caller
+        already read the block (first_sample)
+        """
         try:
-            self.instrument = minimalmodbus.Instrument(port, slave)
+            self.instrument = self.instrument_factory(port, slave)
+            if self.capture_path:
+                self.instrument = CaptureInstrument(self.instrument, self.capture_path)
             self.instrument.serial.baudrate = baud_rate
             self.instrument.serial.bytesize = 8
             self.instrument.serial.timeout = 0.5
@@ -48,18 +69,27 @@ class DPSEngine:
             self.instrument.debug = self.debug
             print(self.instrument)
             # Connection test
-            val = self.__read_register(DPSRegister.PWR_ONOFF, 0)
-            self.registers.onoff = val
+            if first_sample is None:
+                first_sample = self.get_registers()
+            else:
+                self.registers = first_sample
         except (SerialException, ModbusException, NoResponseError) as error:
             print(error)
             return False, 'Serial exception'
+        if first_sample is None:
+            return False, 'Invalid response'
 
+        model = first_sample.model
+        known, self.scale = scale_table_for(model)
+        if not known:
+            return True, f'Unknown model {model}, using {self.scale.model.name} scaling'
         return True, str('')
 
     # Getters and setters
     def set_power(self, enable: bool) -> tuple[bool, str]:
-        """Set current power ON/OFF status"""
-        self.__write_register(DPSRegister.PWR_ONOFF, int(enable), 0)
+        """Set current power ON/OFF status, switching off is a safety write served first"""
+        priority = Priority.SETPOINT if enable else Priority.SAFETY
+        self.__write_register(DPSRegister.PWR_ONOFF, int(enable), 0, priority)
         return True, ''
 
     def get_power_status(self) -> tuple[bool, int]:
@@ -76,107 +106,128 @@ class DPSEngine:
     def set_volts(self, volts: float) -> tuple[bool, str]:
         """Set voltage of DPS device"""
         #TODO: Limit check
-        self.__write_register(DPSRegister.VOLTS_SET, volts, 2)
+        self.__write_register(DPSRegister.VOLTS_SET, volts, self.scale.volts_decimals)
         return True, ''
 
     def get_volts_set(self) -> tuple[bool, float]:
         """Get set value of volts out, not necessary the actual out voltage atm"""
-        return True, ivoltsf(self.get_registers().u_set)
+        return True, self.get_registers().u_set / self.scale.volts_scale
 
     def get_volts_out(self) -> tuple[bool, float]:
         """Get voltage output at the moment"""
-        return True, ivoltsf(self.get_registers().u_out)
+        return True, self.get_registers().u_out / self.scale.volts_scale
 
     def set_amps(self, amps: float) -> tuple[bool, str]:
         """Set current of DPS device"""
         #TODO: Limit check
-        self.__write_register(DPSRegister.AMPS_SET, amps, 3)
+        self.__write_register(DPSRegister.AMPS_SET, amps, self.scale.amps_decimals)
         return True, ''
 
     def get_amps_set(self) -> tuple[bool, float]:
         """Get set value of amps out, not necessary the actual out current atm"""
-        return True, iampsf(self.get_registers().i_set)
+        return True, self.get_registers().i_set / self.scale.amps_scale
 
     def get_amps_out(self) -> tuple[bool, float]:
         """Get current output at the moment"""
-        return True, iampsf(self.get_registers().i_out)
+        return True, self.get_registers().i_out / self.scale.amps_scale
 
     def set_volts_and_amps(self, volts: float, amps: float) -> tuple[bool, str]:
         """Set voltage and amps in single write"""
         #TODO: Limit check
-        values: List[int] = [int(volts*100), int(amps*1000)]
+        values: List[int] = [self.scale.encode_volts(volts), self.scale.encode_amps(amps)]
         self.__write_registers(DPSRegister.VOLTS_SET, values)
         return True, ''
 
+    def read_preset(self, group: int) -> tuple[bool, Preset]:
+        """Read memory group in one transaction"""
+        regs, _ = self.__read_registers(preset_address(group), PRESET_REGISTERS)
+        return True, Preset.from_registers(regs, self.scale)
+
+    def write_preset(self, group: int, preset: Preset) -> tuple[bool, str]:
+        """Write memory group in one transaction"""
+        self.__write_registers(preset_address(group), preset.to_registers(self.scale))
+        return True, ''
+
+    def recall_preset(self, group: int) -> tuple[bool, str]:
+        """Load memory group into output setpoints, raises ValueError if group does not exist"""
+        if not 0 <= group < PRESET_GROUPS:
+            raise ValueError(f'Invalid memory group {group}, use 0-{PRESET_GROUPS - 1}')
+        self.__write_register(DPSRegister.EXTRACT_M, group, 0)
+        return True, ''
+
     def get_power_out(self) -> tuple[bool, float]:
         """Get current power output"""
-        return True, iwattsf(self.get_registers().p_out)
+        return True, self.get_registers().p_out / self.scale.watts_scale
 
     def get_printable_status(self) -> tuple[bool, str]:
         """Get dump of status variables of DPS"""
         # TODO: Move to DPSStatus() __repr__ __str__?
-        self.get_registers()
+        regs: DPSSample = self.get_registers()
+        u_set, i_set, u_out, i_out, p_out, u_in = regs.to_units(self.scale)
         ret_str = '\n'
-        ret_str += f'U-Set:\t\t{self.registers.u_set / 100.0}\n'
-        ret_str += f'I-Set:\t\t{self.registers.i_set / 1000.0}\n'
-        ret_str += f'U-Out:\t\t{self.registers.u_out / 100.0}\n'
-        ret_str += f'I-Out:\t\t{self.registers.i_out / 1000.0}\n'
-        ret_str += f'P-Out:\t\t{self.registers.p_out / 100.0}\n'
-        ret_str += f'U-In:\t\t{self.registers.u_in / 100.0}\n'
-        ret_str += f'Locked:\t\t{self.registers.lock}\n'
-        ret_str += f'Protected:\t\t{self.registers.protect}\n'
-        ret_str += f'CV/CC:\t\t{self.registers.cvcc}\n'
-        ret_str += f'ONOFF:\t\t{self.registers.onoff}\n'
-        ret_str += f'Backlight:\t\t{self.registers.b_led}\n'
-        ret_str += f'Model:\t\t{self.registers.model}\n'
-        ret_str += f'Firmware:\t\t{self.registers.version / 10.0}\n'
+        ret_str += f'U-Set:\t\t{u_set}\n'
+        ret_str += f'I-Set:\t\t{i_set}\n'
+        ret_str += f'U-Out:\t\t{u_out}\n'
+        ret_str += f'I-Out:\t\t{i_out}\n'
+        ret_str += f'P-Out:\t\t{p_out}\n'
+        ret_str += f'U-In:\t\t{u_in}\n'
+        ret_str += f'Locked:\t\t{regs.lock}\n'
+        ret_str += f'Protected:\t\t{regs.protect}\n'
+        ret_str += f'CV/CC:\t\t{regs.cvcc}\n'
+        ret_str += f'ONOFF:\t\t{regs.onoff}\n'
+        ret_str += f'Backlight:\t\t{regs.b_led}\n'
+        ret_str += f'Model:\t\t{regs.model} ({self.scale.model.name})\n'
+        ret_str += f'Firmware:\t\t{regs.version / 10.0}\n'
         return True, ret_str
 
-    def get_registers(self) -> DPSRegisters or None:
-        """Get status registers from DPS device, updates self.registers to current values"""
-        reg_list: List[int] = self.__read_registers(0x0, 20)
-        if len(reg_list) != 20:
+    def get_registers(self, cancellable: bool = False, timeout: float or None = None) -> DPSSample or None:
+        """Get status registers from DPS device as a new sample, self.registers is set to it.
+        Cancellable read gives up (returns None) if higher priority traffic is pending
+        or the bus is not free within timeout seconds
+        """
+        reg_list, t_start = self.__read_registers(0x0, REGISTER_BLOCK, cancellable, timeout)
+        if len(reg_list) != REGISTER_BLOCK:
             return None
-        reg: DPSRegisters = self.registers
-        reg.u_set = reg_list[0]
-        reg.i_set = reg_list[1]
-        reg.u_out = reg_list[2]
-        reg.i_out = reg_list[3]
-        reg.p_out = reg_list[4]
-        reg.u_in = reg_list[5]
-        reg.lock = reg_list[6]
-        reg.protect = reg_list[7]
-        reg.cvcc = reg_list[8]
-        reg.onoff = reg_list[9]
-        reg.b_led = reg_list[10]
-        reg.model = reg_list[11]
-        reg.version = reg_list[12]
-        return reg
+        self.registers = DPSSample.from_registers(reg_list, monotonic(), t_start)
+        return self.registers
 
     # Private methods
     # Communication through Modbus, catch exceptions on these (TODO), used internally by class
-    def __write_register(self, address: int, value: Union[int,float], num_decimals: int) -> None:
+    def __write_register(self, address: int, value: Union[int,float], num_decimals: int,
+                         priority: Priority = Priority.SETPOINT) -> None:
         """Write single register at address"""
-        with lock:
+        with bus.transaction(priority):
             self.instrument.write_register(address, value=value, number_of_decimals=num_decimals)
 
-    def __write_registers(self, address: int, values: List[int]) -> None:
+    def __write_registers(self, address: int, values: List[int],
+                          priority: Priority = Priority.SETPOINT) -> None:
         """Write list of registers into address"""
-        with lock:
+        with bus.transaction(priority):
             self.instrument.write_registers(registeraddress=address, values=values)
 
     def __read_register(self, address: int, num_decimals: int) -> Union[int, float]:
         """Read single register from address"""
-        with lock:
+        with bus.transaction(Priority.POLL):
             retval: int | float = self.instrument.read_register(address, num_decimals)
         return retval
 
-    def __read_registers(self, address: int, number: int) -> List[int]:
-        """Read number of registers starting from address"""
-        with lock:
+    def __read_registers(self, address: int, number: int, cancellable: bool = False,
+                         timeout: float or None = None) -> tuple[List[int], float]:
+        """Read number of registers starting from address, empty list if cancelled.
+        Second value is the time the bus was granted, start of the read
+        """
+        with bus.transaction(Priority.POLL, cancellable, timeout) as granted:
+            t_start = monotonic()
+            if not granted:
+                return [], t_start
             regs : List[int] = self.instrument.read_registers(registeraddress=address,
                                                    number_of_registers=number)
-        return regs
+        return regs, t_start
+
+    @staticmethod
+    def get_bus_stats() -> tuple[bool, str]:
+        """Get queueing latency statistics of bus transaction classes"""
+        return True, '\n' + bus.get_printable_stats()
 
 if __name__ == "__main__":
     print('DPSEngine is not meant to be run standalone')
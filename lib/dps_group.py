@@ -0,0 +1,203 @@
+"""
+DPSGroup module controls several DPS devices on one RS485 bus as a group.
+Power and setpoints are written to all members at once with Modbus
+broadcast (slave 0), members are sampled back to back inside a single bus
+transaction so their samples are as close in time as the bus allows.
+Residual skew between members is measured on every sweep
+
+Broadcast writes are not acknowledged, result is verified by reading back
+"""
+
+import threading
+from time import monotonic, sleep
+from typing import NamedTuple
+import minimalmodbus
+from minimalmodbus import ModbusException
+from serial import SerialException
+
+from .bus_scheduler import LatencyStats, Priority
+from .dps_engine import DPSEngine, DPSRegister, bus
+from .dps_status import DPSSample, NUM_REGISTERS
+from .utils import conf_get
+
+# Modbus broadcast address, devices act on the request but do not answer
+BROADCAST_SLAVE = 0
+
+
+class GroupSample(NamedTuple):
+    """One sweep over all members. Sweep time t is the mean of member read
+    transaction midpoints, skew is the spread between earliest and latest member
+    """
+    t: float
+    samples: tuple[DPSSample, ...]
+    skew: float
+
+class DPSGroup:
+    """Group of DPS devices sharing a serial port"""
+    def __init__(self, conf) -> None:
+        self.conf = conf
+        # Group shares the serial port of the controller unless configured otherwise
+        self.port: str = conf_get(conf, 'group', 'tty_port') or conf['connection']['tty_port']
+        self.baud_rate: int = conf_get(conf, 'group', 'baud_rate') or conf['connection']['baud_rate']
+        self.slaves: list[int] = list(conf_get(conf, 'group', 'slaves') or [])
+        self.poll_interval: float = conf_get(conf, 'group', 'poll_interval') or 1.0
+        self.members: dict[int, DPSEngine] = {}
+        self.broadcaster = None
+        self.instrument_factory: callable = minimalmodbus.Instrument
+        self.connected: bool = False
+        # Latest sweep, kept up to date by the sampling thread while it runs
+        self.last: GroupSample or None = None
+        self.skew: LatencyStats = LatencyStats()
+        self.__running: bool = False
+        self.__thread: threading.Thread or None = None
+
+    def connect(self) -> tuple[bool, str]:
+        """Connect to every member and open the broadcast instrument"""
+        if len(self.slaves) < 2:
+            return False, 'Group needs at least two slaves, set group/slaves in configuration'
+        failed = []
+        for slave in self.slaves:
+            engine = DPSEngine()
+            engine.instrument_factory = self.instrument_factory
+            ret, _ = engine.connect(self.port, slave, self.baud_rate)
+            if not ret:
+                failed.append(str(slave))
+            self.members[slave] = engine
+        if failed:
+            self.members.clear()
+            return False, f'Cannot connect to slaves {", ".join(failed)}'
+        try:
+            self.broadcaster = self.instrument_factory(self.port, BROADCAST_SLAVE)
+            self.broadcaster.serial.baudrate = self.baud_rate
+            self.broadcaster.mode = minimalmodbus.MODE_RTU
+            self.broadcaster.close_port_after_each_call = False
+        except SerialException as error:
+            return False, f'Cannot open broadcast instrument: {error}'
+        self.connected = True
+        models = ', '.join(f'{slave}: {engine.scale.model.name}' for slave, engine in self.members.items())
+        return True, f'Group connected ({models})'
+
+    def __common_scale(self):
+        """Scale table shared by all members, None if members scale differently"""
+        scales = {engine.scale for engine in self.members.values()}
+        return scales.pop() if len(scales) == 1 else None
+
+    def __broadcast(self, address: int, values: list[int], priority: Priority) -> tuple[bool, str]:
+        """Write registers on all members with one broadcast request"""
+        try:
+            with bus.transaction(priority):
+                self.broadcaster.write_registers(registeraddress = address, values = values)
+        except (SerialException, ModbusException) as error:
+            return False, f'Broadcast failed: {error}'
+        return True, ''
+
+    def __verify(self, address: int, values: list[int]) -> tuple[bool, str]:
+        """Read back broadcast registers from every member"""
+        mismatched = []
+        with bus.transaction(Priority.SETPOINT):
+            for slave, engine in self.members.items():
+                try:
+                    regs = engine.instrument.read_registers(registeraddress = address,
+                                                            number_of_registers = len(values))
+                except (SerialException, ModbusException):
+                    regs = None
+                if regs != values:
+                    mismatched.append(str(slave))
+        if mismatched:
+            return False, f'Broadcast not applied on slaves {", ".join(mismatched)}'
+        return True, ''
+
+    def set_power(self, enable: bool) -> tuple[bool, str]:
+        """Switch all members ON/OFF simultaneously, switching off is a safety write"""
+        priority = Priority.SETPOINT if enable else Priority.SAFETY
+        values = [int(enable)]
+        ret, msg = self.__broadcast(DPSRegister.PWR_ONOFF, values, priority)
+        if ret:
+            ret, msg = self.__verify(DPSRegister.PWR_ONOFF, values)
+        if not ret:
+            return ret, msg
+        return True, f'Group power switched {"ON" if enable else "OFF"}'
+
+    def set_volts_and_amps(self, volts: float, amps: float) -> tuple[bool, str]:
+        """Set voltage and current of all members simultaneously"""
+        scale = self.__common_scale()
+        if scale is None:
+            return False, 'Members have different register scaling, cannot broadcast setpoints'
+        values = [scale.encode_volts(volts), scale.encode_amps(amps)]
+        ret, msg = self.__broadcast(DPSRegister.VOLTS_SET, values, Priority.SETPOINT)
+        if ret:
+            ret, msg = self.__verify(DPSRegister.VOLTS_SET, values)
+        if not ret:
+            return ret, msg
+        return True, f'Group set to {volts} V and {amps} A'
+
+    def sample(self, timeout: float or None = None) -> GroupSample or None:
+        """Sample all members back to back in one bus transaction. Returns None
+        if the sweep gave way to pending writes or a member did not answer
+        """
+        samples = []
+        with bus.transaction(Priority.POLL, True, timeout) as granted:
+            if not granted:
+                return None
+            for engine in self.members.values():
+                t_start = monotonic()
+                try:
+                    regs = engine.instrument.read_registers(registeraddress = 0x0,
+                                                            number_of_registers = NUM_REGISTERS)
+                except (SerialException, ModbusException):
+                    return None
+                engine.registers = DPSSample.from_registers(regs, monotonic(), t_start)
+                samples.append(engine.registers)
+        # Members are compared at the middle of their read transactions
+        times = [(sample.t_start + sample.t) * 0.5 for sample in samples]
+        skew = max(times) - min(times)
+        self.skew.add(skew)
+        self.last = GroupSample(sum(times) / len(times), tuple(samples), skew)
+        return self.last
+
+    def __sampler(self) -> None:
+        """Sampling thread, sweeps on a fixed schedule so sweeps do not drift. Only the
+        latest sweep is kept, in last
+        """
+        t_next = monotonic()
+        while self.__running:
+            self.sample(self.poll_interval)
+            t_next += self.poll_interval
+            delay = t_next - monotonic()
+            if delay > 0:
+                sleep(delay)
+            else:
+                t_next = monotonic()
+
+    def start_sampling(self) -> tuple[bool, str]:
+        """Start periodic sweeps, g s shows the latest one instead of sweeping"""
+        if self.__running:
+            return False, 'Group sampling already running'
+        self.__running = True
+        self.__thread = threading.Thread(target = self.__sampler, daemon = True)
+        self.__thread.start()
+        return True, f'Group sampling every {self.poll_interval} s'
+
+    def stop_sampling(self) -> tuple[bool, str]:
+        """Stop periodic sweeps"""
+        if not self.__running:
+            return False, 'Group sampling is not running'
+        self.__running = False
+        self.__thread.join()
+        return True, 'Group sampling stopped'
+
+    def get_printable_status(self) -> tuple[bool, str]:
+        """Latest sweep of all members and skew statistics"""
+        group_sample = self.last if self.__running else self.sample()
+        if group_sample is None:
+            return False, 'Group sample failed'
+        ret_str = '\n'
+        for slave, sample in zip(self.members, group_sample.samples):
+            u_set, i_set, u_out, i_out, p_out, u_in = sample.to_units(self.members[slave].scale)
+            ret_str += (f'Slave {slave}:\tU-Out {u_out:.2f} V\tI-Out {i_out:.3f} A\t'
+                        f'P-Out {p_out:.2f} W\tONOFF {sample.onoff}\n')
+        ret_str += f'Skew:\t\tlast {group_sample.skew * 1000.0:.2f} ms, {self.skew}\n'
+        return True, ret_str
+
+if __name__ == "__main__":
+    print('DPSGroup is not meant to be run standalone')
@@ -0,0 +1,79 @@
+"""
+DPS models module has the register scaling of supported models in the
+DPS/DPH family. Model is read once at connect and its ScaleTable is used
+for all decoding and encoding, so there is no per-sample branching
+
+Raw register value = engineering value * 10^decimals
+"""
+
+from dataclasses import dataclass
+
+from .dps_status import DPSSample
+
+
+@dataclass(frozen = True)
+class DPSModel:
+    """Identity and register decimals of a model"""
+    name: str
+    volts_decimals: int
+    amps_decimals: int
+    watts_decimals: int
+
+# Known models by value of MODEL register
+MODELS: dict[int, DPSModel] = {
+    3005: DPSModel('DPS3005', 2, 3, 2),
+    5005: DPSModel('DPS5005', 2, 3, 2),
+    5205: DPSModel('DPH5005', 2, 3, 2),
+    5015: DPSModel('DPS5015', 2, 2, 1),
+    5020: DPSModel('DPS5020', 2, 2, 1),
+    8005: DPSModel('DPS8005', 2, 3, 2),
+}
+DEFAULT_MODEL: int = 5005
+
+# Registers holding voltage, current and power values
+VOLTS_FIELDS = ('u_set', 'u_out', 'u_in')
+AMPS_FIELDS = ('i_set', 'i_out')
+WATTS_FIELDS = ('p_out',)
+
+
+class ScaleTable:
+    """Precomputed decode/encode factors of one model"""
+    def __init__(self, model: DPSModel) -> None:
+        self.model: DPSModel = model
+        self.volts_decimals: int = model.volts_decimals
+        self.amps_decimals: int = model.amps_decimals
+        self.volts_scale: float = 10.0 ** model.volts_decimals
+        self.amps_scale: float = 10.0 ** model.amps_decimals
+        self.watts_scale: float = 10.0 ** model.watts_decimals
+
+    def decode(self, sample: DPSSample) -> tuple[float, float, float, float, float, float]:
+        """Set and output values in engineering units: u_set, i_set, u_out, i_out, p_out, u_in"""
+        v, a = self.volts_scale, self.amps_scale
+        return (sample[0] / v, sample[1] / a, sample[2] / v,
+                sample[3] / a, sample[4] / self.watts_scale, sample[5] / v)
+
+    def encode_volts(self, volts: float) -> int:
+        """Volts to raw register value"""
+        return int(round(volts * self.volts_scale))
+
+    def encode_amps(self, amps: float) -> int:
+        """Amps to raw register value"""
+        return int(round(amps * self.amps_scale))
+
+    def encode_watts(self, watts: float) -> int:
+        """Watts to raw register value"""
+        return int(round(watts * self.watts_scale))
+
+# Tables are immutable, build each once
+SCALE_TABLES: dict[int, ScaleTable] = {number: ScaleTable(model) for number, model in MODELS.items()}
+DEFAULT_SCALE: ScaleTable = SCALE_TABLES[DEFAULT_MODEL]
+
+def scale_table_for(model: int) -> tuple[bool, ScaleTable]:
+    """Get scale table for model register value, default table and False if model is unknown"""
+    table = SCALE_TABLES.get(model)
+    if table is None:
+        return False, DEFAULT_SCALE
+    return True, table
+
+if __name__ == "__main__":
+    print('DPS models module is not meant to be run standalone')
@@ -1,29 +1,99 @@
 from dataclasses import dataclass, field
+from operator import itemgetter
+from typing import Sequence
+
+from .protection import ProtectionTrip
 """
 DPSStatus module represents the status of the controller, including the registers of DPS device
 """
 
-@dataclass
-class DPSRegisters:
-    """Values of DPS registers"""
-    u_set: int = 0
-    i_set: int = 0
-    u_out: int = 0
-    i_out: int = 0
-    p_out: int = 0
-    u_in: int = 0
-    lock: int = 0
-    protect: int = 0
-    cvcc: int = 0
-    onoff: int = 0
-    b_led: int = 0
-    model: int = 0
-    version: int = 0
+# Status registers read from DPS device, in register address order
+REGISTER_FIELDS: tuple[str, ...] = (
+    'u_set', 'i_set', 'u_out', 'i_out', 'p_out', 'u_in', 'lock',
+    'protect', 'cvcc', 'onoff', 'b_led', 'model', 'version',
+)
+NUM_REGISTERS: int = len(REGISTER_FIELDS)
+# Positions of acquisition times following the registers in a sample
+TIME_FIELDS: dict[str, int] = {'t': NUM_REGISTERS, 't_start': NUM_REGISTERS + 1}
+
+
+class DPSSample(tuple):
+    """Immutable sample of DPS registers, raw register values followed by
+    monotonic acquisition end time t and start time t_start. Built straight from
+    the register list read from device, each new sample is a new object so
+    queued samples never change
+    """
+    __slots__ = ()
+
+    def __new__(cls, registers: Sequence[int] = (), t: float = 0.0, t_start: float or None = None):
+        values = list(registers[:NUM_REGISTERS])
+        values += [0] * (NUM_REGISTERS - len(values))
+        values.append(t)
+        values.append(t if t_start is None else t_start)
+        return tuple.__new__(cls, values)
+
+    @classmethod
+    def from_registers(cls, reg_list: list[int], t: float, t_start: float or None = None) -> 'DPSSample':
+        """Fast constructor from read_registers result of at least NUM_REGISTERS values"""
+        values = reg_list[:NUM_REGISTERS]
+        values.append(t)
+        values.append(t if t_start is None else t_start)
+        return tuple.__new__(cls, values)
+
+    u_set = property(itemgetter(0))
+    i_set = property(itemgetter(1))
+    u_out = property(itemgetter(2))
+    i_out = property(itemgetter(3))
+    p_out = property(itemgetter(4))
+    u_in = property(itemgetter(5))
+    lock = property(itemgetter(6))
+    protect = property(itemgetter(7))
+    cvcc = property(itemgetter(8))
+    onoff = property(itemgetter(9))
+    b_led = property(itemgetter(10))
+    model = property(itemgetter(11))
+    version = property(itemgetter(12))
+    t = property(itemgetter(NUM_REGISTERS))
+    t_start = property(itemgetter(NUM_REGISTERS + 1))
+
+    def registers(self) -> tuple[int, ...]:
+        """Raw register values without timestamp"""
+        return self[:NUM_REGISTERS]
+
+    def diff(self, other: 'DPSSample') -> tuple[str, ...]:
+        """Names of register fields that differ from other sample, timestamps are not compared"""
+        return tuple(name for name, new, old in zip(REGISTER_FIELDS, self, other) if new != old)
+
+    def replace(self, **fields) -> 'DPSSample':
+        """New sample with given fields changed"""
+        values = list(self)
+        for name, value in fields.items():
+            values[TIME_FIELDS[name] if name in TIME_FIELDS else REGISTER_FIELDS.index(name)] = value
+        return tuple.__new__(type(self), values)
+
+    def to_units(self, table) -> tuple[float, float, float, float, float, float]:
+        """Set and output values in engineering units with model ScaleTable:
+        u_set, i_set, u_out, i_out, p_out, u_in
+        """
+        return table.decode(self)
+
+    def __getnewargs__(self) -> tuple:
+        # Pickled samples (device process) keep their timestamp
+        return self[:NUM_REGISTERS], self.t, self.t_start
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{name}={value}' for name, value in zip(REGISTER_FIELDS, self))
+        return f'DPSSample({fields}, t={self.t}, t_start={self.t_start})'
 
 @dataclass
 class DPSStatus:
     """State variables of a DPS device"""
-    registers: DPSRegisters = field(default_factory=DPSRegisters)
+    registers: DPSSample = field(default_factory=DPSSample)
+    # Register fields changed since previous event, all of them in a keyframe
+    changed: tuple[str, ...] = REGISTER_FIELDS
+    keyframe: bool = True
+    # Protection trip caused by this sample, output has been switched off
+    trip: ProtectionTrip or None = None
     connected: bool = False
     port: str = "/dev/ttyUSB0"
     slave: int = 1
@@ -0,0 +1,74 @@
+"""
+Energy module integrates output power and current of polled samples
+into energy (Wh) and charge (Ah) using trapezoidal integration
+"""
+
+from dataclasses import dataclass
+from threading import Lock
+
+
+@dataclass
+class EnergySnapshot:
+    """Accumulated values at a point in time"""
+    wh: float = 0.0
+    ah: float = 0.0
+    on_time: float = 0.0
+    samples: int = 0
+    gaps: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f'Energy:\t\t{self.wh:.4f} Wh\n'
+            f'Charge:\t\t{self.ah:.4f} Ah\n'
+            f'On time:\t{self.on_time:.1f} s\n'
+            f'Samples:\t{self.samples}\n'
+            f'Gaps:\t\t{self.gaps}'
+        )
+
+class EnergyAccumulator:
+    """Integrates samples as they arrive, thread safe"""
+    def __init__(self, max_gap: float) -> None:
+        """Constructor, intervals longer than max_gap seconds are not integrated"""
+        self.max_gap: float = max_gap
+        self.__lock = Lock()
+        self.__prev: tuple[float, float, float, bool] or None = None
+        self.__totals = EnergySnapshot()
+
+    def add(self, t: float, watts: float, amps: float, on: bool) -> None:
+        """Add sample taken at monotonic time t"""
+        with self.__lock:
+            totals = self.__totals
+            totals.samples += 1
+            prev = self.__prev
+            self.__prev = (t, watts, amps, on)
+            if prev is None:
+                return
+            t0, w0, a0, on0 = prev
+            dt = t - t0
+            if dt <= 0.0:
+                return
+            if dt > self.max_gap:
+                # Unknown what happened in between, do not guess
+                totals.gaps += 1
+                return
+            if not (on0 and on):
+                # Output was switched off during the interval
+                return
+            totals.wh += (w0 + watts) * 0.5 * dt / 3600.0
+            totals.ah += (a0 + amps) * 0.5 * dt / 3600.0
+            totals.on_time += dt
+
+    def reset(self) -> None:
+        """Zero accumulators, next sample starts a new integration"""
+        with self.__lock:
+            self.__prev = None
+            self.__totals = EnergySnapshot()
+
+    def snapshot(self) -> EnergySnapshot:
+        """Copy of current accumulated values"""
+        with self.__lock:
+            totals = self.__totals
+            return EnergySnapshot(totals.wh, totals.ah, totals.on_time, totals.samples, totals.gaps)
+
+if __name__ == "__main__":
+    print('EnergyAccumulator is not meant to be run standalone')
@@ -0,0 +1,210 @@
+"""
+Modbus capture and replay. CaptureInstrument wraps a minimalmodbus
+Instrument and logs every transaction with its timing into a compact
+binary file. ReplayInstrument plays such a file back in place of the
+serial port, either in real time or as fast as possible
+
+File format:
+============
+
+Header:     b'DPSCAP1\\n'
+Record:     <dfBBHH> start time [s from capture start], duration [s],
+            function code, status, register address, value count,
+            followed by value count of <H> register values
+            (read response or written values)
+
+"""
+
+import atexit
+import struct
+from threading import Lock
+from time import monotonic, sleep
+from types import SimpleNamespace
+from typing import Iterator, List, NamedTuple, Union
+from minimalmodbus import ModbusException, NoResponseError, InvalidResponseError
+
+CAPTURE_MAGIC = b'DPSCAP1\n'
+RECORD = struct.Struct('<dfBBHH')
+
+# Modbus function codes used by DPSEngine
+FC_READ_REGISTERS = 3
+FC_WRITE_REGISTER = 6
+FC_WRITE_REGISTERS = 16
+
+# Transaction status codes
+STATUS_OK = 0
+STATUS_NO_RESPONSE = 1
+STATUS_INVALID_RESPONSE = 2
+STATUS_ERROR = 3
+
+
+class CaptureRecord(NamedTuple):
+    """Single captured transaction"""
+    t: float
+    duration: float
+    function_code: int
+    status: int
+    address: int
+    values: tuple
+
+
+def read_capture(path: str) -> Iterator[CaptureRecord]:
+    """Iterate records of a capture file"""
+    with open(path, 'rb') as file:
+        if file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f'{path} is not a capture file')
+        while True:
+            header = file.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            t, duration, fc, status, address, count = RECORD.unpack(header)
+            values = struct.unpack(f'<{count}H', file.read(2 * count))
+            yield CaptureRecord(t, duration, fc, status, address, values)
+
+def _status_of(error: Exception) -> int:
+    """Map minimalmodbus exception to status code"""
+    if isinstance(error, NoResponseError):
+        return STATUS_NO_RESPONSE
+    if isinstance(error, InvalidResponseError):
+        return STATUS_INVALID_RESPONSE
+    return STATUS_ERROR
+
+def _error_of(status: int) -> Exception:
+    """Map status code back to minimalmodbus exception"""
+    if status == STATUS_NO_RESPONSE:
+        return NoResponseError('No communication with the instrument (replayed)')
+    if status == STATUS_INVALID_RESPONSE:
+        return InvalidResponseError('Invalid response from the instrument (replayed)')
+    return ModbusException('Modbus error (replayed)')
+
+class CaptureInstrument:
+    """Proxy for minimalmodbus.Instrument logging transactions into a file"""
+    def __init__(self, instrument, path: str) -> None:
+        """Constructor, capture file is truncated"""
+        object.__setattr__(self, '_instrument', instrument)
+        object.__setattr__(self, '_file', open(path, 'wb', buffering = 64 * 1024))
+        object.__setattr__(self, '_lock', Lock())
+        object.__setattr__(self, '_t0', monotonic())
+        self._file.write(CAPTURE_MAGIC)
+        atexit.register(self.close_capture)
+
+    # Everything not captured is passed to the wrapped instrument
+    def __getattr__(self, name: str):
+        return getattr(self._instrument, name)
+
+    def __setattr__(self, name: str, value) -> None:
+        setattr(self._instrument, name, value)
+
+    def __repr__(self) -> str:
+        return f'CaptureInstrument({self._instrument!r})'
+
+    def __record(self, t_start: float, fc: int, status: int, address: int, values: List[int]) -> None:
+        """Append transaction record to capture file"""
+        duration = monotonic() - t_start
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(RECORD.pack(t_start - self._t0, duration, fc, status, address, len(values)))
+            self._file.write(struct.pack(f'<{len(values)}H', *values))
+
+    def __call(self, fc: int, address: int, request: List[int], func, *args, **kwargs):
+        """Run transaction on wrapped instrument and record it"""
+        t_start = monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except ModbusException as error:
+            self.__record(t_start, fc, _status_of(error), address, request if fc != FC_READ_REGISTERS else [])
+            raise
+        if fc == FC_READ_REGISTERS:
+            values = result if isinstance(result, list) else [int(round(result * 10 ** kwargs.get('number_of_decimals', 0)))]
+        else:
+            values = request
+        self.__record(t_start, fc, STATUS_OK, address, values)
+        return result
+
+    def read_register(self, registeraddress: int, number_of_decimals: int = 0, *args, **kwargs) -> Union[int, float]:
+        return self.__call(FC_READ_REGISTERS, registeraddress, [], self._instrument.read_register,
+                           registeraddress, *args, number_of_decimals = number_of_decimals, **kwargs)
+
+    def read_registers(self, registeraddress: int, number_of_registers: int, *args, **kwargs) -> List[int]:
+        return self.__call(FC_READ_REGISTERS, registeraddress, [], self._instrument.read_registers,
+                           registeraddress, number_of_registers, *args, **kwargs)
+
+    def write_register(self, registeraddress: int, value: Union[int, float], number_of_decimals: int = 0,
+                       *args, **kwargs) -> None:
+        raw = int(round(value * 10 ** number_of_decimals))
+        return self.__call(FC_WRITE_REGISTER, registeraddress, [raw], self._instrument.write_register,
+                           registeraddress, value, number_of_decimals, *args, **kwargs)
+
+    def write_registers(self, registeraddress: int, values: List[int]) -> None:
+        return self.__call(FC_WRITE_REGISTERS, registeraddress, list(values), self._instrument.write_registers,
+                           registeraddress, values)
+
+    def close_capture(self) -> None:
+        """Flush and close capture file"""
+        with self._lock:
+            self._file.close()
+
+class ReplayInstrument:
+    """Stand-in for minimalmodbus.Instrument serving reads from a capture file.
+    Reads are answered in recorded order, writes are accepted and not checked.
+    Speed 1.0 reproduces the recorded timing, 0 replays as fast as possible
+    """
+    def __init__(self, path: str, speed: float = 1.0, port: str = '', slave: int = 1, loop: bool = False) -> None:
+        """Constructor, port and slave are accepted for compatibility and ignored"""
+        self.records: list[CaptureRecord] = list(read_capture(path))
+        self.speed: float = speed
+        self.loop: bool = loop
+        self.address: int = slave
+        self.serial = SimpleNamespace(port = port or path, baudrate = 9600, bytesize = 8, timeout = 0.5)
+        self.mode: str = 'rtu'
+        self.close_port_after_each_call: bool = False
+        self.debug: bool = False
+        self.__cursor: int = 0
+        self.__t_offset: float or None = None
+
+    def __repr__(self) -> str:
+        return f'ReplayInstrument<records={len(self.records)}, speed={self.speed}>'
+
+    def __pace(self, record: CaptureRecord) -> None:
+        """Wait until recorded completion time of the transaction"""
+        if self.speed <= 0:
+            return
+        if self.__t_offset is None:
+            self.__t_offset = monotonic() - record.t / self.speed
+        delay = self.__t_offset + (record.t + record.duration) / self.speed - monotonic()
+        if delay > 0:
+            sleep(delay)
+
+    def __next_read(self, address: int) -> CaptureRecord:
+        """Find next recorded read from address, raise when capture is exhausted"""
+        records = self.records
+        for _ in range(2 if self.loop else 1):
+            while self.__cursor < len(records):
+                record = records[self.__cursor]
+                self.__cursor += 1
+                if record.function_code == FC_READ_REGISTERS and record.address == address:
+                    self.__pace(record)
+                    if record.status != STATUS_OK:
+                        raise _error_of(record.status)
+                    return record
+            # Wrap around, restart timing as well
+            self.__cursor = 0
+            self.__t_offset = None
+        raise NoResponseError('End of capture')
+
+    def read_register(self, registeraddress: int, number_of_decimals: int = 0, *args, **kwargs) -> Union[int, float]:
+        value = self.__next_read(registeraddress).values[0]
+        return value / 10 ** number_of_decimals if number_of_decimals else value
+
+    def read_registers(self, registeraddress: int, number_of_registers: int, *args, **kwargs) -> List[int]:
+        return list(self.__next_read(registeraddress).values[:number_of_registers])
+
+    def write_register(self, *args, **kwargs) -> None:
+        return None
+
+    def write_registers(self, *args, **kwargs) -> None:
+        return None
+
+if __name__ == "__main__":
+    print('Capture module is not meant to be run standalone')
@@ -0,0 +1,92 @@
+"""
+Poll timing module keeps statistics of sample acquisition timing. Every
+sample carries monotonic start and end times of its register read, from
+these the poll interval, its jitter and the read duration are tracked.
+Consumers report when they use a sample, which gives the sample age.
+Failed poll cycles are counted as errors:
+
+interval = t_start - t_start_prev
+jitter   = |interval - interval_prev|
+duration = t - t_start
+age      = t_used - t
+"""
+
+import threading
+from time import monotonic
+
+from .bus_scheduler import LatencyStats
+from .dps_status import DPSSample
+
+
+class PollTiming:
+    """Interval, jitter, read duration and sample age statistics"""
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Clear all statistics"""
+        with self.__lock:
+            self.interval: LatencyStats = LatencyStats()
+            self.jitter: LatencyStats = LatencyStats()
+            self.duration: LatencyStats = LatencyStats()
+            self.age: LatencyStats = LatencyStats()
+            self.errors: int = 0
+            self.last_error: str = ''
+            self.__t_prev: float or None = None
+            self.__interval_prev: float or None = None
+
+    def add(self, sample: DPSSample) -> None:
+        """Account acquired sample, called by poller in sample order"""
+        with self.__lock:
+            self.duration.add(sample.t - sample.t_start)
+            if self.__t_prev is not None:
+                interval = sample.t_start - self.__t_prev
+                self.interval.add(interval)
+                if self.__interval_prev is not None:
+                    self.jitter.add(abs(interval - self.__interval_prev))
+                self.__interval_prev = interval
+            self.__t_prev = sample.t_start
+
+    def consumed(self, sample: DPSSample, t_used: float or None = None) -> float:
+        """Account use of sample by a consumer, returns its age in seconds"""
+        age = (monotonic() if t_used is None else t_used) - sample.t
+        with self.__lock:
+            self.age.add(age)
+        return age
+
+    def error(self, error: Exception) -> None:
+        """Account poll cycle that failed with error, called by poller"""
+        with self.__lock:
+            self.errors += 1
+            self.last_error = f'{type(error).__name__}: {error}'
+
+    def get_jitter(self, pct: float = 99) -> float:
+        """Jitter percentile over recent intervals in seconds"""
+        with self.__lock:
+            return self.jitter.percentile(pct)
+
+    def get_summary(self) -> str:
+        """One line summary for status displays"""
+        with self.__lock:
+            return (f'interval {self.interval.mean() * 1000.0:.1f} ms, '
+                    f'jitter p99 {self.jitter.percentile(99) * 1000.0:.1f} ms, '
+                    f'age p99 {self.age.percentile(99) * 1000.0:.1f} ms'
+                    + (f', errors {self.errors}' if self.errors else ''))
+
+    def get_printable_status(self) -> str:
+        """Statistics of all timing quantities"""
+        with self.__lock:
+            return (f'Interval:\t{self.__format(self.interval)}\n'
+                    f'Jitter:\t\t{self.__format(self.jitter)}\n'
+                    f'Read:\t\t{self.__format(self.duration)}\n'
+                    f'Age:\t\t{self.__format(self.age)}\n'
+                    f'Errors:\t\t{self.errors}' + (f', last {self.last_error}' if self.errors else ''))
+
+    @staticmethod
+    def __format(stats: LatencyStats) -> str:
+        return (f'n={stats.count} mean={stats.mean() * 1000.0:.2f} ms '
+                f'p99={stats.percentile(99) * 1000.0:.2f} ms max={stats.max * 1000.0:.2f} ms')
+
+if __name__ == "__main__":
+    print('Poll timing is not meant to be run standalone')
@@ -0,0 +1,104 @@
+"""
+Presets module maps DPS memory groups M0-M9 to Preset objects. Each group
+is a block of 8 registers at 0x50 + 0x10 * n, so a whole group is read or
+written with one Modbus transaction. Writing the group number into
+EXTRACT_M (0x23) recalls it into the output setpoints
+
+Group registers:
+================
+
+0   U-SET   voltage setpoint
+1   I-SET   current setpoint
+2   S-OVP   over-voltage protection
+3   S-OCP   over-current protection
+4   S-OPP   over-power protection
+5   B-LED   backlight brightness 0-5
+6   M-PRE   show group number on display
+7   S-INI   output on when recalled
+
+Presets file (YAML):
+====================
+
+presets:
+    1: {volts: 3.3, amps: 0.5, ovp: 3.6, ocp: 0.6, opp: 2.0, power_on: false}
+
+Only volts and amps are required, protection values default to the limits
+section of configuration
+"""
+
+from dataclasses import dataclass
+from yaml import safe_load, YAMLError
+
+from .dps_models import ScaleTable
+
+# Memory group layout
+PRESET_BASE = 0x50
+PRESET_STRIDE = 0x10
+PRESET_REGISTERS = 8
+PRESET_GROUPS = 10
+# Defaults when not given in presets file
+BACKLIGHT = 4
+PRESETS_FILE = 'dps_presets.yaml'
+
+
+@dataclass
+class Preset:
+    """Setpoints and protection values of one memory group"""
+    volts: float
+    amps: float
+    ovp: float
+    ocp: float
+    opp: float
+    backlight: int = BACKLIGHT
+    show: bool = False
+    power_on: bool = False
+
+    def to_registers(self, scale: ScaleTable) -> list[int]:
+        """Raw register block in group order"""
+        return [scale.encode_volts(self.volts), scale.encode_amps(self.amps),
+                scale.encode_volts(self.ovp), scale.encode_amps(self.ocp), scale.encode_watts(self.opp),
+                int(self.backlight), int(self.show), int(self.power_on)]
+
+    @classmethod
+    def from_registers(cls, regs: list[int], scale: ScaleTable) -> 'Preset':
+        """Preset from raw register block"""
+        return cls(regs[0] / scale.volts_scale, regs[1] / scale.amps_scale,
+                   regs[2] / scale.volts_scale, regs[3] / scale.amps_scale, regs[4] / scale.watts_scale,
+                   regs[5], bool(regs[6]), bool(regs[7]))
+
+    def __str__(self) -> str:
+        return (f'{self.volts} V {self.amps} A, OVP {self.ovp} V OCP {self.ocp} A OPP {self.opp} W, '
+                f'backlight {self.backlight}, show {int(self.show)}, power on {int(self.power_on)}')
+
+def preset_address(group: int) -> int:
+    """First register of memory group, raises ValueError if group does not exist"""
+    if not 0 <= group < PRESET_GROUPS:
+        raise ValueError(f'Invalid memory group {group}, use 0-{PRESET_GROUPS - 1}')
+    return PRESET_BASE + PRESET_STRIDE * group
+
+def load_presets(path: str, limits: dict) -> dict[int, Preset]:
+    """Read presets file, protection values missing from an entry come from limits
+    (limits section of configuration). Raises ValueError on invalid content
+    """
+    try:
+        with open(path, 'r') as file:
+            content = safe_load(file) or {}
+    except (OSError, YAMLError) as error:
+        raise ValueError(f'Cannot read presets from {path}: {error}')
+    presets: dict[int, Preset] = {}
+    for group, entry in (content.get('presets') or {}).items():
+        # Validates group number
+        preset_address(int(group))
+        if not isinstance(entry, dict) or 'volts' not in entry or 'amps' not in entry:
+            raise ValueError(f'Preset M{group} needs volts and amps')
+        presets[int(group)] = Preset(
+            float(entry['volts']), float(entry['amps']),
+            float(entry.get('ovp', limits['max_voltage'])),
+            float(entry.get('ocp', limits['max_current'])),
+            float(entry.get('opp', limits['max_voltage'] * limits['max_current'])),
+            int(entry.get('backlight', BACKLIGHT)), bool(entry.get('show', False)),
+            bool(entry.get('power_on', False)))
+    return presets
+
+if __name__ == "__main__":
+    print('Presets module is not meant to be run standalone')
@@ -0,0 +1,215 @@
+"""
+Profiling module for long running sessions. Registered hot path methods
+are timed and deterministically profiled (cProfile) while the profiler is
+active, a sampling thread records where all threads spend their time and
+tracemalloc snapshots show where memory is allocated. Report is written
+into a text file when profiling stops
+
+Use the module level profiler instance, register methods once at start
+and start/stop at will. Inactive wrappers only cost an attribute check
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from functools import wraps
+from time import perf_counter, sleep, strftime
+
+# Defaults for sampling and report size
+SAMPLE_INTERVAL = 0.005
+TRACEMALLOC_FRAMES = 10
+REPORT_TOP = 25
+
+
+class _ThreadContext:
+    """Per-thread deterministic profiler, nested calls profile only the outermost"""
+    def __init__(self) -> None:
+        self.profile: cProfile.Profile or None = None
+        self.generation: int = -1
+        self.depth: int = 0
+
+class Profiler:
+    """Sampling, deterministic and allocation profiler"""
+    def __init__(self) -> None:
+        self.active: bool = False
+        self.report_dir: str = '.'
+        self.sample_interval: float = SAMPLE_INTERVAL
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__generation: int = 0
+        self.__contexts: list[_ThreadContext] = []
+        self.__timings: dict[str, list] = {}
+        self.__self_samples: Counter = Counter()
+        self.__total_samples: Counter = Counter()
+        self.__sample_count: int = 0
+        self.__sampler: threading.Thread or None = None
+        self.__snapshot: tracemalloc.Snapshot or None = None
+        self.__started_tracemalloc: bool = False
+        self.__t_start: float = 0.0
+
+    def register(self, obj, attr: str, label: str or None = None) -> None:
+        """Replace method obj.attr with a profiling wrapper, label names it in report"""
+        func = getattr(obj, attr)
+        label = label or f'{type(obj).__name__}.{attr}'
+        self.__timings.setdefault(label, [0, 0.0, 0.0])
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.active:
+                return func(*args, **kwargs)
+            return self.__profiled_call(label, func, args, kwargs)
+
+        setattr(obj, attr, wrapper)
+
+    def __profiled_call(self, label: str, func, args, kwargs):
+        """Call func with timing and deterministic profiling"""
+        state: _ThreadContext or None = getattr(self.__local, 'context', None)
+        if state is None:
+            state = self.__local.context = _ThreadContext()
+            with self.__lock:
+                self.__contexts.append(state)
+        profiling = False
+        if state.depth == 0:
+            # Fresh profile for each profiling run
+            if state.generation != self.__generation:
+                state.profile = cProfile.Profile()
+                state.generation = self.__generation
+            try:
+                state.profile.enable()
+                profiling = True
+            except ValueError:
+                # Python 3.12+ allows one active cProfile at a time, this call is only timed
+                pass
+        state.depth += 1
+        t_start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = perf_counter() - t_start
+            state.depth -= 1
+            if profiling:
+                state.profile.disable()
+            timing = self.__timings[label]
+            timing[0] += 1
+            timing[1] += elapsed
+            if elapsed > timing[2]:
+                timing[2] = elapsed
+
+    def __sample_loop(self) -> None:
+        """Sampling thread, counts functions on stacks of all other threads"""
+        own_id = threading.get_ident()
+        while self.active:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                code = frame.f_code
+                self.__self_samples[(code.co_filename, code.co_firstlineno, code.co_name)] += 1
+                seen = set()
+                while frame is not None:
+                    code = frame.f_code
+                    key = (code.co_filename, code.co_firstlineno, code.co_name)
+                    if key not in seen:
+                        seen.add(key)
+                        self.__total_samples[key] += 1
+                    frame = frame.f_back
+                self.__sample_count += 1
+            sleep(self.sample_interval)
+
+    def start(self) -> tuple[bool, str]:
+        """Start profiling"""
+        if self.active:
+            return False, 'Profiling already running'
+        self.__generation += 1
+        for timing in self.__timings.values():
+            timing[:] = [0, 0.0, 0.0]
+        self.__self_samples.clear()
+        self.__total_samples.clear()
+        self.__sample_count = 0
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.__started_tracemalloc = True
+        self.__snapshot = tracemalloc.take_snapshot()
+        self.__t_start = perf_counter()
+        self.active = True
+        self.__sampler = threading.Thread(target = self.__sample_loop, daemon = True)
+        self.__sampler.start()
+        return True, 'Profiling started'
+
+    def stop(self) -> tuple[bool, str]:
+        """Stop profiling and write report, message contains report path"""
+        if not self.active:
+            return False, 'Profiling is not running'
+        self.active = False
+        self.__sampler.join()
+        report = self.report()
+        if self.__started_tracemalloc:
+            tracemalloc.stop()
+            self.__started_tracemalloc = False
+        path = os.path.join(self.report_dir, f'dps_profile_{strftime("%Y%m%d_%H%M%S")}.txt')
+        with open(path, 'w') as file:
+            file.write(report)
+        return True, f'Profile report written to {path}'
+
+    @staticmethod
+    def __format_function(key: tuple[str, int, str]) -> str:
+        """Short function name for report"""
+        filename, lineno, name = key
+        return f'{name} ({os.path.basename(filename)}:{lineno})'
+
+    def report(self) -> str:
+        """Build profile report text"""
+        out = io.StringIO()
+        duration = perf_counter() - self.__t_start
+        out.write(f'dps-control profile, {duration:.1f} s\n\n')
+
+        out.write('Registered hot paths\n')
+        out.write(f'{"function":<40}{"calls":>10}{"total ms":>12}{"mean us":>12}{"max us":>12}\n')
+        for label, (count, total, longest) in self.__timings.items():
+            mean = total / count if count else 0.0
+            out.write(f'{label:<40}{count:>10}{total * 1e3:>12.1f}{mean * 1e6:>12.1f}{longest * 1e6:>12.1f}\n')
+
+        out.write(f'\nSampling profile, {self.__sample_count} stack samples every {self.sample_interval * 1e3:.1f} ms\n')
+        total_samples = max(1, self.__sample_count)
+        out.write('Top functions by self samples\n')
+        for key, count in self.__self_samples.most_common(REPORT_TOP):
+            out.write(f'{100.0 * count / total_samples:6.1f} %  {self.__format_function(key)}\n')
+        out.write('Top functions by inclusive samples\n')
+        for key, count in self.__total_samples.most_common(REPORT_TOP):
+            out.write(f'{100.0 * count / total_samples:6.1f} %  {self.__format_function(key)}\n')
+
+        out.write('\nDeterministic profile of registered hot paths\n')
+        # Profiles of threads inside a profiled call right now are left out
+        with self.__lock:
+            profiles = [state.profile for state in self.__contexts
+                        if state.generation == self.__generation and not state.depth]
+        stats: pstats.Stats or None = None
+        for prof in profiles:
+            if stats is None:
+                stats = pstats.Stats(prof, stream = out)
+            else:
+                stats.add(prof)
+        if stats is not None:
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(REPORT_TOP)
+        else:
+            out.write('No calls profiled\n')
+
+        if tracemalloc.is_tracing() and self.__snapshot is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            out.write(f'\nAllocations, traced now {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB\n')
+            out.write('Top allocation growth since start\n')
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__),))
+            for stat in snapshot.compare_to(self.__snapshot, 'lineno')[:REPORT_TOP]:
+                out.write(f'{stat}\n')
+        return out.getvalue()
+
+# Profiler shared by the application
+profiler = Profiler()
+
+if __name__ == "__main__":
+    print('Profiler is not meant to be run standalone')
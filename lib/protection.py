@@ -0,0 +1,97 @@
+"""
+Protection module watches live output values of every polled sample and
+tells when the output must be switched off. Limits come from the
+protection section of configuration, a missing or null limit disables the rule
+
+Rules:
+======
+
+Over-power:                 p_out > max_power [W]
+Over-current:               i_out > max_current [A]
+Under-input-voltage:        u_in < min_input_voltage [V]
+Max on-time:                output on longer than max_on_time [s]
+Voltage slew:               |dU/dt| > max_dvdt [V/s]
+
+"""
+
+from collections import deque
+from dataclasses import dataclass
+from time import localtime, strftime
+
+# Number of trips kept in history
+TRIP_HISTORY = 100
+
+
+@dataclass
+class ProtectionTrip:
+    """Record of a protection rule switching the output off"""
+    rule: str
+    value: float
+    limit: float
+    wall_time: float = 0.0
+    latency: float = 0.0
+
+    def __str__(self) -> str:
+        when = strftime('%H:%M:%S', localtime(self.wall_time))
+        return (f'{when} {self.rule}: {self.value:.3f} (limit {self.limit:.3f}), '
+                f'trip latency {self.latency * 1000.0:.1f} ms')
+
+class ProtectionEngine:
+    """Evaluates protection rules against samples, kept cheap for the poll thread"""
+    def __init__(self, limits: dict or None) -> None:
+        """Constructor, limits is the protection section of configuration"""
+        limits = limits or {}
+        self.max_power: float or None = limits.get('max_power')
+        self.max_current: float or None = limits.get('max_current')
+        self.min_input_voltage: float or None = limits.get('min_input_voltage')
+        self.max_on_time: float or None = limits.get('max_on_time')
+        self.max_dvdt: float or None = limits.get('max_dvdt')
+        self.trips: deque = deque(maxlen = TRIP_HISTORY)
+        self.trip_count: int = 0
+        self.__on_since: float or None = None
+        self.__prev_volts: tuple[float, float] or None = None
+
+    def enabled(self) -> bool:
+        """True if any rule is configured"""
+        return any(limit is not None for limit in (self.max_power, self.max_current,
+                                                  self.min_input_voltage, self.max_on_time,
+                                                  self.max_dvdt))
+
+    def check(self, t: float, volts: float, amps: float, watts: float, volts_in: float,
+              on: bool) -> ProtectionTrip or None:
+        """Check sample taken at monotonic time t, return trip if output must be switched off"""
+        if not on:
+            # Nothing to protect, forget history so rules start over on next power on
+            self.__on_since = None
+            self.__prev_volts = None
+            return None
+
+        if self.__on_since is None:
+            self.__on_since = t
+
+        if self.max_power is not None and watts > self.max_power:
+            return ProtectionTrip('Over-power', watts, self.max_power)
+        if self.max_current is not None and amps > self.max_current:
+            return ProtectionTrip('Over-current', amps, self.max_current)
+        if self.min_input_voltage is not None and volts_in < self.min_input_voltage:
+            return ProtectionTrip('Under-input-voltage', volts_in, self.min_input_voltage)
+        if self.max_on_time is not None and t - self.__on_since > self.max_on_time:
+            return ProtectionTrip('Max on-time', t - self.__on_since, self.max_on_time)
+        if self.max_dvdt is not None:
+            prev = self.__prev_volts
+            self.__prev_volts = (t, volts)
+            if prev is not None and t > prev[0]:
+                dvdt = abs(volts - prev[1]) / (t - prev[0])
+                if dvdt > self.max_dvdt:
+                    return ProtectionTrip('Voltage slew', dvdt, self.max_dvdt)
+        return None
+
+    def record(self, trip: ProtectionTrip) -> None:
+        """Store trip into history and reset rule state, output is off now"""
+        self.trips.append(trip)
+        self.trip_count += 1
+        self.__on_since = None
+        self.__prev_volts = None
+
+if __name__ == "__main__":
+    print('ProtectionEngine is not meant to be run standalone')
@@ -0,0 +1,159 @@
+"""
+Regulator module emulates constant-power (CP) and constant-resistance (CR)
+modes on top of the hardware CV/CC loop. Each polled sample u_out/i_out is
+turned into the output voltage that would meet the target, and a PI
+controller in velocity form moves the voltage setpoint towards it:
+
+CP:     U* = P_target / I_out
+CR:     U* = R_target * I_out
+
+du = kp * (e - e_prev) + ki * e * dt,   e = U* - U_out
+
+Setpoint is clamped to the configured voltage range and limited to
+max_step per cycle. Loop interval and regulation error are tracked so
+the quality of regulation can be judged
+
+CR needs a load that draws current like a source with internal
+resistance or a constant current load. Into a plain resistor R_load the
+current follows the voltage, U* = R_target / R_load * U_out has no
+operating point unless R_target equals R_load and the setpoint runs to a
+voltage limit. A CR loop held at a limit for SATURATION_CYCLES is stopped
+and the setpoint goes back to where the loop started
+"""
+
+from enum import Enum
+
+from .bus_scheduler import LatencyStats
+
+# Defaults when not configured
+KP = 0.2
+KI = 0.5
+MAX_STEP = 1.0
+# Below this current [A] the load is treated as open
+MIN_CURRENT = 0.001
+# Cycles a CR setpoint may stay at a voltage limit before the loop is stopped
+SATURATION_CYCLES = 10
+
+
+class RegulatorMode(Enum):
+    """Control loop modes, CV leaves the hardware in charge"""
+    CV = 'CV'
+    CP = 'CP'
+    CR = 'CR'
+
+class Regulator:
+    """PI loop holding output power or resistance by adjusting the voltage setpoint"""
+    def __init__(self, conf: dict or None, v_min: float, v_max: float) -> None:
+        """Constructor, conf is the regulator section of configuration"""
+        conf = conf or {}
+        self.kp: float = conf.get('kp') or KP
+        self.ki: float = conf.get('ki') or KI
+        self.max_step: float = conf.get('max_step') or MAX_STEP
+        self.v_min: float = v_min
+        self.v_max: float = v_max
+        self.mode: RegulatorMode = RegulatorMode.CV
+        self.target: float = 0.0
+        self.setpoint: float = 0.0
+        # Setpoint is written rounded to register resolution
+        self.decimals: int = 2
+        self.__written: float = 0.0
+        # Loop interval [s] and absolute regulation error [W or ohm]
+        self.interval: LatencyStats = LatencyStats()
+        self.error: LatencyStats = LatencyStats()
+        self.last_error: float = 0.0
+        self.__e_prev: float or None = None
+        self.__t_prev: float or None = None
+        self.__u_start: float = 0.0
+        self.__saturated: int = 0
+        # Why the loop stopped itself, empty if it did not
+        self.fault: str = ''
+
+    def active(self) -> bool:
+        """True if a control loop mode is running"""
+        return self.mode is not RegulatorMode.CV
+
+    def start(self, mode: RegulatorMode, target: float, u_set: float, decimals: int) -> None:
+        """Start holding target from current voltage setpoint u_set, statistics are reset.
+        Decimals is the voltage register resolution
+        """
+        self.mode = mode
+        self.target = target
+        self.setpoint = u_set
+        self.decimals = decimals
+        self.__written = round(u_set, decimals)
+        self.interval = LatencyStats()
+        self.error = LatencyStats()
+        self.last_error = 0.0
+        self.__e_prev = None
+        self.__t_prev = None
+        self.__u_start = u_set
+        self.__saturated = 0
+        self.fault = ''
+
+    def stop(self) -> None:
+        """Back to hardware CV/CC, setpoint is left where it is"""
+        self.mode = RegulatorMode.CV
+
+    def update(self, t: float, u_out: float, i_out: float, on: bool) -> float or None:
+        """Run one loop cycle on sample taken at t, new voltage setpoint or None
+        if the setpoint does not change
+        """
+        if not self.active():
+            return None
+        if self.__t_prev is not None:
+            self.interval.add(t - self.__t_prev)
+        dt = 0.0 if self.__t_prev is None else t - self.__t_prev
+        self.__t_prev = t
+        if not on:
+            # Output off, nothing to regulate and no windup
+            self.__e_prev = None
+            return None
+
+        if self.mode is RegulatorMode.CP:
+            measured = u_out * i_out
+            u_target = self.target / i_out if i_out >= MIN_CURRENT else self.v_max
+        else:
+            measured = u_out / i_out if i_out >= MIN_CURRENT else float('inf')
+            u_target = self.target * i_out
+        self.last_error = abs(self.target - measured)
+        if self.last_error != float('inf'):
+            self.error.add(self.last_error)
+
+        e = u_target - u_out
+        step = self.ki * e * dt
+        if self.__e_prev is not None:
+            step += self.kp * (e - self.__e_prev)
+        self.__e_prev = e
+        step = max(-self.max_step, min(self.max_step, step))
+        self.setpoint = max(self.v_min, min(self.v_max, self.setpoint + step))
+        if self.mode is RegulatorMode.CR and self.setpoint in (self.v_min, self.v_max):
+            self.__saturated += 1
+            if self.__saturated >= SATURATION_CYCLES:
+                self.fault = (f'CR stopped at {self.setpoint:.2f} V limit, no operating point for '
+                              f'{self.target} ohm with this load, setpoint back to {self.__u_start:.2f} V')
+                self.stop()
+                self.setpoint = self.__u_start
+        else:
+            self.__saturated = 0
+        setpoint = round(self.setpoint, self.decimals)
+        if setpoint == self.__written:
+            return None
+        self.__written = setpoint
+        return setpoint
+
+    def get_printable_status(self) -> str:
+        """Mode, target, loop rate and regulation error"""
+        if not self.active():
+            return 'Regulator off (CV/CC)' + (f', {self.fault}' if self.fault else '')
+        unit = 'W' if self.mode is RegulatorMode.CP else 'ohm'
+        mean_interval = self.interval.mean()
+        rate = 1.0 / mean_interval if mean_interval else 0.0
+        return (f'Mode:\t\t{self.mode.value} {self.target} {unit}\n'
+                f'Setpoint:\t{self.setpoint:.3f} V\n'
+                f'Loop rate:\t{rate:.2f} Hz, interval mean {mean_interval * 1000.0:.1f} ms '
+                f'p99 {self.interval.percentile(99) * 1000.0:.1f} ms max {self.interval.max * 1000.0:.1f} ms\n'
+                f'Error:\t\tlast {self.last_error:.3f} {unit}, mean {self.error.mean():.3f} {unit} '
+                f'p99 {self.error.percentile(99):.3f} {unit}')
+
+if __name__ == "__main__":
+    print('Regulator is not meant to be run standalone')
@@ -0,0 +1,91 @@
+"""
+RollingStats module keeps min/max/mean/stddev of a value stream over a
+sliding window of samples. Every update is O(1) (amortized for min/max)
+"""
+
+from collections import deque
+from math import sqrt
+
+
+class RollingStats:
+    """Sliding window statistics, values are raw register integers so sums stay exact"""
+    def __init__(self, window: int) -> None:
+        """Constructor, window is the number of samples kept"""
+        self.window: int = max(1, int(window))
+        self.__values: deque = deque()
+        self.__sum: int = 0
+        self.__sumsq: int = 0
+        # Monotonic deques of (index, value) for sliding min and max
+        self.__mins: deque = deque()
+        self.__maxs: deque = deque()
+        self.__index: int = 0
+
+    def __len__(self) -> int:
+        return len(self.__values)
+
+    def reset(self) -> None:
+        """Forget all samples"""
+        self.__values.clear()
+        self.__mins.clear()
+        self.__maxs.clear()
+        self.__sum = 0
+        self.__sumsq = 0
+
+    def add(self, value: int) -> bool:
+        """Add a sample, dropping the oldest one if window is full. Returns False if the
+        statistics did not change, that is the dropped sample had the same value
+        """
+        values = self.__values
+        changed = True
+        if len(values) == self.window:
+            old = values.popleft()
+            self.__sum -= old
+            self.__sumsq -= old * old
+            changed = old != value
+        values.append(value)
+        self.__sum += value
+        self.__sumsq += value * value
+
+        index = self.__index
+        self.__index = index + 1
+        oldest = index - self.window
+
+        mins = self.__mins
+        while mins and mins[-1][1] >= value:
+            mins.pop()
+        mins.append((index, value))
+        if mins[0][0] <= oldest:
+            mins.popleft()
+
+        maxs = self.__maxs
+        while maxs and maxs[-1][1] <= value:
+            maxs.pop()
+        maxs.append((index, value))
+        if maxs[0][0] <= oldest:
+            maxs.popleft()
+        return changed
+
+    def min(self) -> int:
+        """Smallest value in window"""
+        return self.__mins[0][1] if self.__mins else 0
+
+    def max(self) -> int:
+        """Largest value in window"""
+        return self.__maxs[0][1] if self.__maxs else 0
+
+    def mean(self) -> float:
+        """Mean of values in window"""
+        count = len(self.__values)
+        return self.__sum / count if count else 0.0
+
+    def stddev(self) -> float:
+        """Population standard deviation of values in window"""
+        count = len(self.__values)
+        if count < 2:
+            return 0.0
+        # Integer arithmetic keeps the variance exact, no cancellation drift
+        variance = (count * self.__sumsq - self.__sum * self.__sum) / (count * count)
+        return sqrt(variance) if variance > 0 else 0.0
+
+if __name__ == "__main__":
+    print('RollingStats is not meant to be run standalone')
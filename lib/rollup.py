@@ -0,0 +1,206 @@
+"""
+Rollup module keeps downsampled history of output voltage, current and
+power for runs of weeks. Each tier is a ring of fixed-width buckets with
+min, max and mean per channel, all tiers are updated from every polled
+sample so memory use is fixed and independent of run length:
+
+Default tiers:  1 s x 3600 (1 hour), 1 min x 1440 (1 day), 1 h x 960 (40 days)
+
+Queries pick the finest tier covering the requested window and merge
+adjacent buckets down to the requested number of points, so the cost of a
+query depends on the tier size and not on the number of samples
+"""
+
+import math
+import threading
+from time import localtime, strftime
+from typing import NamedTuple
+import numpy as np
+
+# Channels kept per bucket, in sample order of add
+CHANNELS: tuple[str, ...] = ('u_out', 'i_out', 'p_out')
+# Default (bucket width [s], bucket count) of each tier, finest first
+TIERS: tuple[tuple[float, int], ...] = ((1.0, 3600), (60.0, 1440), (3600.0, 960))
+
+
+class RollupSeries(NamedTuple):
+    """Buckets of a window, oldest first. Arrays of min, max and mean have one
+    column per channel. width is the bucket width after merging
+    """
+    width: float
+    t: np.ndarray
+    min: np.ndarray
+    max: np.ndarray
+    mean: np.ndarray
+    count: np.ndarray
+
+class RollupTier:
+    """Ring of closed buckets and the open bucket of one resolution"""
+    def __init__(self, width: float, capacity: int) -> None:
+        self.width: float = width
+        self.capacity: int = capacity
+        channels = len(CHANNELS)
+        # Bucket start time, sample count, per channel min, max and sum
+        self.t: np.ndarray = np.zeros(capacity)
+        self.count: np.ndarray = np.zeros(capacity, dtype = np.int64)
+        self.min: np.ndarray = np.zeros((capacity, channels))
+        self.max: np.ndarray = np.zeros((capacity, channels))
+        self.sum: np.ndarray = np.zeros((capacity, channels))
+        self.written: int = 0
+        self.__bucket: int or None = None
+        self.__count: int = 0
+        self.__min: list[float] = [0.0] * channels
+        self.__max: list[float] = [0.0] * channels
+        self.__sum: list[float] = [0.0] * channels
+
+    def span(self) -> float:
+        """Time covered by a full ring"""
+        return self.width * self.capacity
+
+    def add(self, t: float, values: tuple[float, ...]) -> None:
+        """Add sample values taken at t, closes the open bucket when t is past it"""
+        bucket = int(t // self.width)
+        if bucket != self.__bucket:
+            self.close()
+            self.__bucket = bucket
+            self.__count = 1
+            self.__min = list(values)
+            self.__max = list(values)
+            self.__sum = list(values)
+            return
+        self.__count += 1
+        mins, maxs, sums = self.__min, self.__max, self.__sum
+        for n, value in enumerate(values):
+            if value < mins[n]:
+                mins[n] = value
+            if value > maxs[n]:
+                maxs[n] = value
+            sums[n] += value
+
+    def close(self) -> None:
+        """Move open bucket into the ring"""
+        if self.__bucket is None:
+            return
+        slot = self.written % self.capacity
+        self.t[slot] = self.__bucket * self.width
+        self.count[slot] = self.__count
+        self.min[slot] = self.__min
+        self.max[slot] = self.__max
+        self.sum[slot] = self.__sum
+        self.written += 1
+        self.__bucket = None
+
+    def buckets(self, t_from: float) -> tuple[np.ndarray, ...]:
+        """Closed buckets starting at or after t_from and the open bucket, oldest first:
+        start times, counts, min, max, sum
+        """
+        n = min(self.written, self.capacity)
+        end = self.written % self.capacity
+        order = np.r_[end:n, 0:end] if self.written > self.capacity else np.arange(n)
+        t = self.t[order]
+        first = int(np.searchsorted(t, t_from))
+        order = order[first:]
+        columns = [self.t[order], self.count[order], self.min[order], self.max[order], self.sum[order]]
+        if self.__bucket is not None:
+            columns[0] = np.append(columns[0], self.__bucket * self.width)
+            columns[1] = np.append(columns[1], self.__count)
+            columns[2] = np.vstack((columns[2], self.__min))
+            columns[3] = np.vstack((columns[3], self.__max))
+            columns[4] = np.vstack((columns[4], self.__sum))
+        return tuple(columns)
+
+class Rollup:
+    """Tiered min/max/mean history, safe to add from poller and query from other threads"""
+    def __init__(self, conf: dict or None = None) -> None:
+        """Constructor, conf is the history section of configuration"""
+        conf = conf or {}
+        tiers = conf.get('tiers') or TIERS
+        self.tiers: list[RollupTier] = [RollupTier(float(width), int(capacity))
+                                         for width, capacity in sorted(tiers)]
+        self.__lock = threading.Lock()
+        self.last_t: float or None = None
+
+    def add(self, t: float, u_out: float, i_out: float, p_out: float) -> None:
+        """Add polled sample taken at monotonic time t"""
+        values = (u_out, i_out, p_out)
+        with self.__lock:
+            for tier in self.tiers:
+                tier.add(t, values)
+            self.last_t = t
+
+    def reset(self) -> None:
+        """Forget all history"""
+        with self.__lock:
+            self.tiers = [RollupTier(tier.width, tier.capacity) for tier in self.tiers]
+            self.last_t = None
+
+    def tier_for(self, window: float) -> RollupTier:
+        """Finest tier covering window, coarsest if none does"""
+        for tier in self.tiers:
+            if tier.span() >= window:
+                return tier
+        return self.tiers[-1]
+
+    def series(self, window: float, max_points: int, t_end: float or None = None) -> RollupSeries or None:
+        """History of window seconds up to t_end (latest sample if None) in at most
+        max_points buckets, None if there is no history
+        """
+        with self.__lock:
+            if self.last_t is None:
+                return None
+            t_end = self.last_t if t_end is None else t_end
+            tier = self.tier_for(window)
+            t, count, mins, maxs, sums = tier.buckets(t_end - window)
+        keep = t <= t_end
+        t, count, mins, maxs, sums = t[keep], count[keep], mins[keep], maxs[keep], sums[keep]
+        width = tier.width
+        if len(t) > max_points:
+            # Merge runs of adjacent buckets, min of mins, max of maxes, sums and counts add up
+            step = math.ceil(len(t) / max_points)
+            starts = np.arange(0, len(t), step)
+            t = t[starts]
+            count = np.add.reduceat(count, starts)
+            mins = np.minimum.reduceat(mins, starts)
+            maxs = np.maximum.reduceat(maxs, starts)
+            sums = np.add.reduceat(sums, starts)
+            width *= step
+        mean = sums / np.maximum(count, 1)[:, None]
+        return RollupSeries(width, t, mins, maxs, mean, count)
+
+    def get_printable_series(self, window: float, rows: int, wall_offset: float) -> str:
+        """Table of window in at most rows buckets, times shown as wall clock
+        with wall_offset added to monotonic bucket times
+        """
+        series = self.series(window, rows)
+        if series is None or not len(series.t):
+            return 'No history'
+        fmt = '%m-%d %H:%M' if series.width >= 60.0 else '%H:%M:%S'
+        lines = [f'Bucket {format_duration(series.width)}, {len(series.t)} buckets',
+                 f'{"time":<12}' + ''.join(f'{name + " " + stat:>12}' for name in ('U', 'I', 'P')
+                                           for stat in ('min', 'mean', 'max'))]
+        for n, t in enumerate(series.t):
+            cells = ''.join(f'{series.min[n, c]:>12.3f}{series.mean[n, c]:>12.3f}{series.max[n, c]:>12.3f}'
+                            for c in range(len(CHANNELS)))
+            lines.append(f'{strftime(fmt, localtime(t + wall_offset)):<12}{cells}')
+        return '\n'.join(lines)
+
+# Suffixes of durations, longest first
+DURATION_UNITS: tuple[tuple[str, float], ...] = (('d', 86400.0), ('h', 3600.0), ('m', 60.0), ('s', 1.0))
+
+def parse_duration(text: str) -> float:
+    """Duration like '90', '90s', '15m', '6h' or '30d' in seconds, raises ValueError"""
+    text = text.strip().lower()
+    for suffix, seconds in DURATION_UNITS:
+        if text.endswith(suffix):
+            return float(text[:-1]) * seconds
+    return float(text)
+
+def format_duration(seconds: float) -> str:
+    """Seconds in the largest whole unit"""
+    for suffix, unit in DURATION_UNITS:
+        if seconds >= unit and seconds % unit == 0:
+            return f'{seconds / unit:.0f}{suffix}'
+    return f'{seconds:g}s'
+
+if __name__ == "__main__":
+    print('Rollup is not meant to be run standalone')
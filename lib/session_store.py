@@ -0,0 +1,341 @@
+"""
+Session store records polled samples of a long run into a file with two
+sidecar indexes, so that time ranges and events are found without
+scanning the samples. All three files are fixed-size records in time order:
+lookups are binary searches and the work of a query is proportional to its
+result, not to the length of the session
+
+File format:
+============
+
+Session <file>:         b'DPSSES1\\n', then records <df13H> wall time of read end [s],
+                        read duration [s], raw registers
+Time index <file>.tix:  b'DPSTIX1\\n', then <dQ> wall time, record number of every
+                        index_stride-th record
+Event index <file>.eix: b'DPSEIX1\\n', then <dQBf20s> wall time, record number, kind,
+                        value, label (protection rule of trips)
+
+Events: power on/off, CV to CC and CC to CV change, hardware protection and
+software protection trips
+
+"""
+
+import atexit
+import mmap
+import os
+import struct
+from datetime import datetime, timedelta
+from enum import IntEnum
+from threading import Lock
+from time import monotonic, time
+from typing import Iterator, NamedTuple
+
+from .dps_models import scale_table_for
+from .dps_status import DPSSample, NUM_REGISTERS
+
+SESSION_MAGIC = b'DPSSES1\n'
+TIME_INDEX_MAGIC = b'DPSTIX1\n'
+EVENT_INDEX_MAGIC = b'DPSEIX1\n'
+RECORD = struct.Struct(f'<df{NUM_REGISTERS}H')
+TIME_ENTRY = struct.Struct('<dQ')
+EVENT_ENTRY = struct.Struct('<dQBf20s')
+TIME_INDEX_SUFFIX = '.tix'
+EVENT_INDEX_SUFFIX = '.eix'
+
+# Defaults when not configured
+INDEX_STRIDE = 256
+SESSION_FILE = 'dps_session.dpss'
+# Records read per file access when scanning a range
+READ_CHUNK = 256
+
+
+class SessionEventKind(IntEnum):
+    """Indexed events, value of event is the new register value or the tripped measurement"""
+    POWER_ON = 1
+    POWER_OFF = 2
+    CV_TO_CC = 3
+    CC_TO_CV = 4
+    PROTECT = 5
+    TRIP = 6
+
+class SessionEvent(NamedTuple):
+    """Event index entry, record is the number of the sample it happened on"""
+    t: float
+    record: int
+    kind: SessionEventKind
+    value: float
+    label: str
+
+    def __str__(self) -> str:
+        text = f'{format_wall_time(self.t)} #{self.record} {self.kind.name.lower()}'
+        if self.kind is SessionEventKind.TRIP:
+            text += f' {self.label}: {self.value:.3f}'
+        elif self.kind is SessionEventKind.PROTECT:
+            text += f' {int(self.value)}'
+        return text
+
+def format_wall_time(t: float) -> str:
+    """Wall time as local date and time with milliseconds"""
+    return datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+def parse_wall_time(text: str, reference: float) -> float:
+    """Parse time of day 'HH:MM[:SS]' on the day of reference wall time (next day if that
+    is before reference), 'YYYY-MM-DD HH:MM[:SS]' or seconds since epoch
+    """
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            pass
+    for fmt in ('%H:%M:%S', '%H:%M'):
+        try:
+            clock = datetime.strptime(text, fmt).time()
+        except ValueError:
+            continue
+        day = datetime.fromtimestamp(reference)
+        when = datetime.combine(day.date(), clock)
+        if when.timestamp() < reference - 1.0:
+            when += timedelta(days = 1)
+        return when.timestamp()
+    raise ValueError(f'Invalid time {text}, use HH:MM[:SS], YYYY-MM-DD HH:MM[:SS] or epoch seconds')
+
+class SessionWriter:
+    """Appends samples and events to a session, safe to call from several threads"""
+    def __init__(self, path: str, index_stride: int = INDEX_STRIDE) -> None:
+        """Constructor, existing session at path is overwritten"""
+        self.path: str = path
+        self.index_stride: int = index_stride
+        self.records: int = 0
+        self.events: int = 0
+        self.__lock = Lock()
+        self.__data = open(path, 'wb', buffering = 64 * 1024)
+        self.__time_index = open(path + TIME_INDEX_SUFFIX, 'wb')
+        self.__event_index = open(path + EVENT_INDEX_SUFFIX, 'wb')
+        self.__data.write(SESSION_MAGIC)
+        self.__time_index.write(TIME_INDEX_MAGIC)
+        self.__event_index.write(EVENT_INDEX_MAGIC)
+        # Monotonic sample times are stored as wall time
+        self.__wall_offset: float = time() - monotonic()
+        self.__prev: DPSSample or None = None
+        atexit.register(self.close)
+
+    def closed(self) -> bool:
+        return self.__data.closed
+
+    def add(self, sample: DPSSample) -> None:
+        """Append polled sample, events are derived from the change to previous sample"""
+        t = sample.t + self.__wall_offset
+        with self.__lock:
+            if self.__data.closed:
+                return
+            record = self.records
+            if record % self.index_stride == 0:
+                # Data is on disk before the index points at it
+                self.__data.flush()
+                self.__time_index.write(TIME_ENTRY.pack(t, record))
+                self.__time_index.flush()
+            self.__data.write(RECORD.pack(t, sample.t - sample.t_start, *sample.registers()))
+            self.records += 1
+            prev, self.__prev = self.__prev, sample
+            if prev is None:
+                return
+            if sample.onoff != prev.onoff:
+                self.__write_event(t, record, SessionEventKind.POWER_ON if sample.onoff else SessionEventKind.POWER_OFF,
+                                   sample.onoff)
+            if sample.cvcc != prev.cvcc:
+                self.__write_event(t, record, SessionEventKind.CV_TO_CC if sample.cvcc else SessionEventKind.CC_TO_CV,
+                                   sample.cvcc)
+            if sample.protect != prev.protect and sample.protect:
+                self.__write_event(t, record, SessionEventKind.PROTECT, sample.protect)
+
+    def add_trip(self, t_mono: float, rule: str, value: float) -> None:
+        """Append software protection trip, it is indexed on the latest recorded sample"""
+        with self.__lock:
+            if self.__data.closed:
+                return
+            self.__write_event(t_mono + self.__wall_offset, max(0, self.records - 1),
+                               SessionEventKind.TRIP, value, rule)
+
+    def __write_event(self, t: float, record: int, kind: SessionEventKind, value: float, label: str = '') -> None:
+        """Append event index entry, caller holds the lock. Events are rare, the sample
+        they point at is flushed with them
+        """
+        self.__data.flush()
+        self.__event_index.write(EVENT_ENTRY.pack(t, record, kind, value, label.encode()[:20]))
+        self.__event_index.flush()
+        self.events += 1
+
+    def close(self) -> None:
+        """Flush and close all files"""
+        with self.__lock:
+            for file in (self.__data, self.__time_index, self.__event_index):
+                if not file.closed:
+                    file.close()
+
+class SessionReader:
+    """Time range and event queries on a session, also while it is being recorded"""
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self.__data = open(path, 'rb')
+        if self.__data.read(len(SESSION_MAGIC)) != SESSION_MAGIC:
+            self.__data.close()
+            raise ValueError(f'{path} is not a session file')
+        self.__time_index: mmap.mmap or None = self.__map(path + TIME_INDEX_SUFFIX, TIME_INDEX_MAGIC)
+        self.__event_index: mmap.mmap or None = self.__map(path + EVENT_INDEX_SUFFIX, EVENT_INDEX_MAGIC)
+
+    @staticmethod
+    def __map(path: str, magic: bytes) -> mmap.mmap or None:
+        """Map index file read-only, None if it has no entries"""
+        with open(path, 'rb') as file:
+            if file.read(len(magic)) != magic:
+                raise ValueError(f'{path} is not a session index')
+            if os.fstat(file.fileno()).st_size <= len(magic):
+                return None
+            return mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+
+    def close(self) -> None:
+        self.__data.close()
+        for index in (self.__time_index, self.__event_index):
+            if index is not None:
+                index.close()
+
+    def __enter__(self) -> 'SessionReader':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    @staticmethod
+    def __entries(index: mmap.mmap or None, entry: struct.Struct, magic: bytes) -> int:
+        """Number of complete entries in mapped index"""
+        return 0 if index is None else (len(index) - len(magic)) // entry.size
+
+    @staticmethod
+    def __bisect(index: mmap.mmap, entry: struct.Struct, magic: bytes, count: int, t: float) -> int:
+        """Number of first entry with time not before t"""
+        low, high = 0, count
+        while low < high:
+            mid = (low + high) // 2
+            if entry.unpack_from(index, len(magic) + mid * entry.size)[0] < t:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def record_count(self) -> int:
+        """Number of complete sample records"""
+        return (os.fstat(self.__data.fileno()).st_size - len(SESSION_MAGIC)) // RECORD.size
+
+    def __read(self, first: int, count: int) -> Iterator[tuple]:
+        """Unpacked records first .. first + count - 1"""
+        self.__data.seek(len(SESSION_MAGIC) + first * RECORD.size)
+        yield from RECORD.iter_unpack(self.__data.read(count * RECORD.size))
+
+    @staticmethod
+    def __sample(values: tuple) -> DPSSample:
+        """Stored record as sample stamped with wall times"""
+        t, duration = values[0], values[1]
+        return DPSSample(values[2:], t, t - duration)
+
+    def time_range(self) -> tuple[float, float] or None:
+        """Wall times of first and last sample, None if the session is empty"""
+        count = self.record_count()
+        if not count:
+            return None
+        first = next(self.__read(0, 1))[0]
+        last = next(self.__read(count - 1, 1))[0]
+        return first, last
+
+    def samples(self, t_from: float, t_to: float) -> Iterator[DPSSample]:
+        """Samples with read end between t_from and t_to, as DPSSamples stamped with wall
+        times. Time index gives the start, at most index_stride records are skipped
+        """
+        count = self.record_count()
+        entries = self.__entries(self.__time_index, TIME_ENTRY, TIME_INDEX_MAGIC)
+        record = 0
+        if entries:
+            # Last indexed record before t_from
+            n = self.__bisect(self.__time_index, TIME_ENTRY, TIME_INDEX_MAGIC, entries, t_from)
+            if n:
+                record = TIME_ENTRY.unpack_from(self.__time_index, len(TIME_INDEX_MAGIC) + (n - 1) * TIME_ENTRY.size)[1]
+        while record < count:
+            chunk = min(READ_CHUNK, count - record)
+            for values in self.__read(record, chunk):
+                if values[0] > t_to:
+                    return
+                if values[0] >= t_from:
+                    yield self.__sample(values)
+            record += chunk
+
+    def sample(self, record: int) -> DPSSample:
+        """Sample by record number, as given by events"""
+        return self.__sample(next(self.__read(record, 1)))
+
+    def events(self, kinds: set[SessionEventKind] or None = None, t_from: float = 0.0,
+               t_to: float = float('inf')) -> Iterator[SessionEvent]:
+        """Events between t_from and t_to, of given kinds or all"""
+        index = self.__event_index
+        count = self.__entries(index, EVENT_ENTRY, EVENT_INDEX_MAGIC)
+        if not count:
+            return
+        first = self.__bisect(index, EVENT_ENTRY, EVENT_INDEX_MAGIC, count, t_from)
+        for n in range(first, count):
+            t, record, kind, value, label = EVENT_ENTRY.unpack_from(index, len(EVENT_INDEX_MAGIC) + n * EVENT_ENTRY.size)
+            if t > t_to:
+                return
+            kind = SessionEventKind(kind)
+            if kinds is None or kind in kinds:
+                yield SessionEvent(t, record, kind, value, label.rstrip(b'\0').decode())
+
+def parse_event_kinds(text: str) -> set[SessionEventKind] or None:
+    """Comma separated event kind names, None for 'all'"""
+    if text == 'all':
+        return None
+    try:
+        return {SessionEventKind[name.strip().upper()] for name in text.split(',')}
+    except KeyError as error:
+        names = ', '.join(kind.name.lower() for kind in SessionEventKind)
+        raise ValueError(f'Invalid event kind {error}, use all or some of {names}')
+
+def print_samples(samples: Iterator[DPSSample]) -> None:
+    """Print samples stamped with wall times as table in units"""
+    print(f'{"time":<24}{"U-Set":>8}{"I-Set":>8}{"U-Out":>8}{"I-Out":>8}{"P-Out":>8}{"U-In":>8}'
+          f'{"CC":>4}{"On":>4}')
+    for sample in samples:
+        _, scale = scale_table_for(sample.model)
+        values = ''.join(f'{value:>8.3f}' for value in sample.to_units(scale))
+        print(f'{format_wall_time(sample.t):<24}{values}{sample.cvcc:>4}{sample.onoff:>4}')
+
+def print_query(path: str, start: str or None, end: str or None, kinds: str or None) -> None:
+    """Print events of kinds, samples between start and end or a summary of the session
+    if neither is asked for. Times are parsed with parse_wall_time, raises ValueError on
+    invalid input
+    """
+    with SessionReader(path) as reader:
+        time_range = reader.time_range()
+        if time_range is None:
+            print(f'{path}: empty session')
+            return
+        t_from = parse_wall_time(start, time_range[0]) if start else time_range[0]
+        t_to = parse_wall_time(end, time_range[0]) if end else time_range[1]
+        if kinds is not None:
+            for event in reader.events(parse_event_kinds(kinds), t_from, t_to):
+                print(event)
+        elif start or end:
+            print_samples(reader.samples(t_from, t_to))
+        else:
+            counts = {kind: 0 for kind in SessionEventKind}
+            for event in reader.events():
+                counts[event.kind] += 1
+            print(f'Session:\t{path}\n'
+                  f'From:\t\t{format_wall_time(time_range[0])}\n'
+                  f'To:\t\t{format_wall_time(time_range[1])}\n'
+                  f'Samples:\t{reader.record_count()}\n'
+                  f'Events:\t\t' + ', '.join(f'{kind.name.lower()} {count}' for kind, count in counts.items()))
+
+if __name__ == "__main__":
+    print('Session store is not meant to be run standalone')
@@ -0,0 +1,112 @@
+"""
+Simulated DPS device, stand-in for minimalmodbus.Instrument. Output
+follows a resistive load with CV/CC limiting, so setpoint writes show up
+in the readings. Optional response latency and injected timeouts and CRC
+errors make it usable for benchmarks and soak runs without hardware
+"""
+
+import random
+from time import sleep
+from types import SimpleNamespace
+from typing import List, Union
+from minimalmodbus import NoResponseError, InvalidResponseError
+
+from .dps_engine import DPSRegister
+from .dps_status import REGISTER_FIELDS
+from .presets import PRESET_BASE, PRESET_GROUPS, PRESET_STRIDE, preset_address
+
+# Defaults of simulated device
+SIM_MODEL = 5005
+SIM_VERSION = 16
+SIM_LOAD = 10.0
+SIM_INPUT = 2400
+# Register map covers status block and memory groups
+SIM_REGISTERS = PRESET_BASE + PRESET_STRIDE * PRESET_GROUPS
+
+# Register indices used by the output model
+U_SET, I_SET, U_OUT, I_OUT, P_OUT, CVCC, ONOFF = (REGISTER_FIELDS.index(name) for name in
+                                                  ('u_set', 'i_set', 'u_out', 'i_out', 'p_out', 'cvcc', 'onoff'))
+
+
+class SimInstrument:
+    """Simulated DPS on a resistive load, registers are raw DPS5005 values"""
+    def __init__(self, port: str = 'sim', slave: int = 1, load: float = SIM_LOAD, latency: float = 0.0,
+                 timeout_rate: float = 0.0, crc_error_rate: float = 0.0, seed: int or None = None) -> None:
+        """Constructor, latency is seconds per transaction, error rates are probabilities per transaction"""
+        self.address: int = slave
+        self.serial = SimpleNamespace(port = port, baudrate = 9600, bytesize = 8, timeout = 0.5)
+        self.mode: str = 'rtu'
+        self.close_port_after_each_call: bool = False
+        self.debug: bool = False
+        self.load: float = load
+        self.latency: float = latency
+        self.timeout_rate: float = timeout_rate
+        self.crc_error_rate: float = crc_error_rate
+        self.random = random.Random(seed)
+        self.registers: List[int] = [0] * SIM_REGISTERS
+        self.registers[U_SET] = 500
+        self.registers[I_SET] = 1000
+        self.registers[REGISTER_FIELDS.index('u_in')] = SIM_INPUT
+        self.registers[REGISTER_FIELDS.index('model')] = SIM_MODEL
+        self.registers[REGISTER_FIELDS.index('version')] = SIM_VERSION
+
+    def __repr__(self) -> str:
+        return f'SimInstrument<port={self.serial.port}, slave={self.address}, load={self.load} ohm>'
+
+    def __transaction(self) -> None:
+        """Wait latency and inject errors"""
+        if self.latency:
+            sleep(self.latency)
+        if self.timeout_rate or self.crc_error_rate:
+            draw = self.random.random()
+            if draw < self.timeout_rate:
+                raise NoResponseError('No communication with the instrument (simulated)')
+            if draw < self.timeout_rate + self.crc_error_rate:
+                raise InvalidResponseError('Checksum error in rtu mode (simulated)')
+
+    def __update_output(self) -> None:
+        """Output of supply in CV or CC on the load"""
+        regs = self.registers
+        volts = regs[U_SET] / 100.0 if regs[ONOFF] else 0.0
+        amps_limit = regs[I_SET] / 1000.0
+        amps = volts / self.load
+        cc = amps > amps_limit
+        if cc:
+            amps = amps_limit
+            volts = amps * self.load
+        regs[U_OUT] = int(round(volts * 100))
+        regs[I_OUT] = int(round(amps * 1000))
+        regs[P_OUT] = int(round(volts * amps * 100))
+        regs[CVCC] = int(cc)
+
+    def read_register(self, registeraddress: int, number_of_decimals: int = 0, *args, **kwargs) -> Union[int, float]:
+        self.__transaction()
+        self.__update_output()
+        value = self.registers[registeraddress]
+        return value / 10 ** number_of_decimals if number_of_decimals else value
+
+    def read_registers(self, registeraddress: int, number_of_registers: int, *args, **kwargs) -> List[int]:
+        self.__transaction()
+        self.__update_output()
+        return self.registers[registeraddress:registeraddress + number_of_registers]
+
+    def write_register(self, registeraddress: int, value: Union[int, float], number_of_decimals: int = 0,
+                       *args, **kwargs) -> None:
+        self.__transaction()
+        self.registers[registeraddress] = int(round(value * 10 ** number_of_decimals))
+        if registeraddress == DPSRegister.EXTRACT_M:
+            self.__recall(int(value))
+
+    def __recall(self, group: int) -> None:
+        """Load memory group setpoints, output follows S-INI of the group"""
+        group_regs = self.registers[preset_address(group):]
+        self.registers[U_SET] = group_regs[0]
+        self.registers[I_SET] = group_regs[1]
+        self.registers[ONOFF] = group_regs[7]
+
+    def write_registers(self, registeraddress: int, values: List[int]) -> None:
+        self.__transaction()
+        self.registers[registeraddress:registeraddress + len(values)] = list(values)
+
+if __name__ == "__main__":
+    print('Simulated instrument is not meant to be run standalone')
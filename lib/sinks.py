@@ -0,0 +1,288 @@
+"""
+Sinks module pushes polled samples to several destinations at once. The
+poller only offers each sample to the bounded queue of every sink, which
+never blocks: a full queue drops the sample and counts it. Every sink has
+its own writer thread that collects samples into batches and writes a
+batch when it is full or flush_interval has passed, so a slow disk or a
+stalled socket delays only its own sink and never a poll
+
+Sink types:
+===========
+
+file    session file, archive if path ends with .dpsa        path, chunk_samples
+sqlite  SQLite database, one transaction per batch            path
+socket  JSON lines to unix socket path or TCP host:port       address
+stdout  JSON lines to standard output
+
+Other types are plugins given as 'module:Class', a subclass of
+TelemetrySink implementing write_batch, constructed with its name and
+configuration entry. Options of all sinks: name, queue_size, batch_size,
+flush_interval. Sinks that cannot be started are listed by sinks command
+"""
+
+import atexit
+import json
+from abc import ABC, abstractmethod
+import socket
+import sqlite3
+import sys
+import threading
+from importlib import import_module
+from queue import Queue, Full, Empty
+from time import monotonic, time
+
+from .archive import ArchiveWriter, ARCHIVE_SUFFIX, CHUNK_SAMPLES
+from .bus_scheduler import LatencyStats
+from .dps_models import scale_table_for
+from .dps_status import DPSSample, REGISTER_FIELDS
+from .session_store import SessionWriter
+from .sqlite_store import SQLiteWriter
+
+# Defaults when not configured
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+SOCKET_TIMEOUT = 1.0
+# Fields given in units in JSON lines, the others are raw register values
+UNIT_FIELDS: tuple[str, ...] = ('u_set', 'i_set', 'u_out', 'i_out', 'p_out', 'u_in')
+# Queued by close, writer thread writes what is left and stops
+STOP = None
+
+
+def sample_to_json(sample: DPSSample, wall_offset: float) -> str:
+    """Sample as JSON object, times are wall times with wall_offset added to monotonic times"""
+    _, scale = scale_table_for(sample.model)
+    record = {'t': round(sample.t + wall_offset, 6), 't_start': round(sample.t_start + wall_offset, 6)}
+    record.update(zip(UNIT_FIELDS, (round(value, 4) for value in sample.to_units(scale))))
+    record.update((name, sample[n]) for n, name in enumerate(REGISTER_FIELDS) if name not in record)
+    return json.dumps(record, separators = (',', ':'))
+
+class TelemetrySink(ABC):
+    """Base of sinks. Output is opened by the constructor, write_batch is called from the
+    writer thread only and close_output once after the last batch
+    """
+    def __init__(self, name: str, conf: dict) -> None:
+        self.name: str = name
+        self.batch_size: int = int(conf.get('batch_size') or BATCH_SIZE)
+        self.flush_interval: float = float(conf.get('flush_interval') or FLUSH_INTERVAL)
+        self.__queue: Queue = Queue(int(conf.get('queue_size') or QUEUE_SIZE))
+        self.offered: int = 0
+        self.written: int = 0
+        self.dropped: int = 0
+        # Samples of batches that failed to write
+        self.failed: int = 0
+        self.errors: int = 0
+        self.last_error: str = ''
+        # Time to write one batch
+        self.write_time: LatencyStats = LatencyStats()
+        self.__thread = threading.Thread(target = self.__run, name = f'sink-{name}', daemon = True)
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def offer(self, sample: DPSSample) -> None:
+        """Queue sample for writing, dropped and counted if the queue is full. Called by the poller"""
+        self.offered += 1
+        try:
+            self.__queue.put_nowait(sample)
+        except Full:
+            self.dropped += 1
+
+    @abstractmethod
+    def write_batch(self, batch: list[DPSSample]) -> None:
+        """Write samples, raise on failure"""
+
+    def close_output(self) -> None:
+        """Flush and close output"""
+
+    def __write(self, batch: list[DPSSample]) -> None:
+        """Write batch, a failed batch is dropped and counted"""
+        if not batch:
+            return
+        t_start = monotonic()
+        try:
+            self.write_batch(batch)
+            self.written += len(batch)
+        except Exception as error:
+            # Sinks are plugins, whatever they raise must not end the writer thread
+            self.errors += 1
+            self.failed += len(batch)
+            self.last_error = str(error)
+        self.write_time.add(monotonic() - t_start)
+
+    def __run(self) -> None:
+        """Writer thread, collect batch until it is full or flush interval has passed"""
+        batch: list[DPSSample] = []
+        deadline = monotonic() + self.flush_interval
+        while True:
+            try:
+                sample = self.__queue.get(timeout = max(0.0, deadline - monotonic()))
+                if sample is STOP:
+                    break
+                batch.append(sample)
+            except Empty:
+                pass
+            if len(batch) >= self.batch_size or monotonic() >= deadline:
+                self.__write(batch)
+                batch = []
+                deadline = monotonic() + self.flush_interval
+        self.__write(batch)
+        self.close_output()
+
+    def close(self) -> None:
+        """Write queued samples and stop writer thread"""
+        if not self.__thread.is_alive():
+            return
+        # Stop is queued behind pending samples, wait for room rather than drop it
+        self.__queue.put(STOP)
+        self.__thread.join()
+
+    def __str__(self) -> str:
+        text = (f'{self.name:<12}offered {self.offered} written {self.written} dropped {self.dropped} '
+                f'failed {self.failed} queued {self.__queue.qsize()} errors {self.errors}, '
+                f'batch write {self.write_time}')
+        if self.last_error:
+            text += f'\n{"":<12}last error: {self.last_error}'
+        return text
+
+class FileSink(TelemetrySink):
+    """Session file, or archive if path ends with ARCHIVE_SUFFIX"""
+    def __init__(self, name: str, conf: dict) -> None:
+        super(FileSink, self).__init__(name, conf)
+        path = conf.get('path') or f'dps_{name}.dpss'
+        if path.endswith(ARCHIVE_SUFFIX):
+            self.writer = ArchiveWriter(path, int(conf.get('chunk_samples') or CHUNK_SAMPLES))
+        else:
+            self.writer = SessionWriter(path)
+
+    def write_batch(self, batch: list[DPSSample]) -> None:
+        add = self.writer.add
+        for sample in batch:
+            add(sample)
+
+    def close_output(self) -> None:
+        self.writer.close()
+
+class SQLiteSink(TelemetrySink):
+    """SQLite database, a batch is inserted in one transaction"""
+    def __init__(self, name: str, conf: dict) -> None:
+        super(SQLiteSink, self).__init__(name, conf)
+        try:
+            self.writer = SQLiteWriter(conf.get('path') or f'dps_{name}.db')
+        except sqlite3.Error as error:
+            raise OSError(f'Cannot open database for sink {name}: {error}')
+
+    def write_batch(self, batch: list[DPSSample]) -> None:
+        self.writer.add_batch(batch)
+
+    def close_output(self) -> None:
+        self.writer.close()
+
+    def __str__(self) -> str:
+        return super(SQLiteSink, self).__str__() + f'\n{"":<12}inserted {self.writer}'
+
+class SocketSink(TelemetrySink):
+    """JSON lines to unix socket path or TCP host:port, reconnects on the batch after a failure"""
+    def __init__(self, name: str, conf: dict) -> None:
+        super(SocketSink, self).__init__(name, conf)
+        self.address: str = str(conf.get('address') or '')
+        if not self.address:
+            raise ValueError(f'Sink {name} needs address')
+        self.__socket: socket.socket or None = None
+        self.__wall_offset: float = time() - monotonic()
+
+    def __connect(self) -> socket.socket:
+        host, _, port = self.address.rpartition(':')
+        if host and port.isdigit():
+            sock = socket.create_connection((host, int(port)), timeout = SOCKET_TIMEOUT)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(SOCKET_TIMEOUT)
+            try:
+                sock.connect(self.address)
+            except OSError:
+                sock.close()
+                raise
+        return sock
+
+    def write_batch(self, batch: list[DPSSample]) -> None:
+        lines = ''.join(sample_to_json(sample, self.__wall_offset) + '\n' for sample in batch)
+        if self.__socket is None:
+            self.__socket = self.__connect()
+        try:
+            self.__socket.sendall(lines.encode())
+        except OSError:
+            self.close_output()
+            raise
+
+    def close_output(self) -> None:
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+
+class StdoutSink(TelemetrySink):
+    """JSON lines to standard output"""
+    def __init__(self, name: str, conf: dict) -> None:
+        super(StdoutSink, self).__init__(name, conf)
+        self.__wall_offset: float = time() - monotonic()
+
+    def write_batch(self, batch: list[DPSSample]) -> None:
+        sys.stdout.write(''.join(sample_to_json(sample, self.__wall_offset) + '\n' for sample in batch))
+        sys.stdout.flush()
+
+# Built-in sink types by configured type
+SINK_TYPES: dict[str, type] = {'file': FileSink, 'sqlite': SQLiteSink, 'socket': SocketSink, 'stdout': StdoutSink}
+
+def create_sink(conf: dict) -> TelemetrySink:
+    """Sink of configuration entry, type is built-in or 'module:Class'. Raises ValueError
+    on invalid configuration, OSError if output cannot be opened, TypeError if a plugin
+    does not implement write_batch
+    """
+    kind = str(conf.get('type') or '')
+    sink_type = SINK_TYPES.get(kind)
+    if sink_type is None and ':' in kind:
+        module, _, class_name = kind.partition(':')
+        try:
+            sink_type = getattr(import_module(module), class_name)
+        except (ImportError, AttributeError) as error:
+            raise ValueError(f'Cannot load sink type {kind}: {error}')
+    if not isinstance(sink_type, type) or not issubclass(sink_type, TelemetrySink):
+        raise ValueError(f'Invalid sink type {kind}, use {", ".join(SINK_TYPES)} or module:Class')
+    return sink_type(str(conf.get('name') or kind), conf)
+
+class TelemetrySinks:
+    """Sinks of configuration, samples are offered to all of them"""
+    def __init__(self, conf: list or None) -> None:
+        """Constructor, conf is the sinks section of configuration. Sinks that cannot be
+        created are left out, their errors are kept in start_errors
+        """
+        self.sinks: list[TelemetrySink] = []
+        self.start_errors: list[str] = []
+        for entry in conf or ():
+            try:
+                sink = create_sink(entry)
+            except (OSError, ValueError, TypeError) as error:
+                self.start_errors.append(f'Cannot start sink: {error}')
+                continue
+            sink.start()
+            self.sinks.append(sink)
+        # Registered after the outputs, so queued samples are written before they close
+        atexit.register(self.close)
+
+    def offer(self, sample: DPSSample) -> None:
+        """Offer polled sample to every sink, never blocks"""
+        for sink in self.sinks:
+            sink.offer(sample)
+
+    def get_printable_status(self) -> str:
+        if not self.sinks and not self.start_errors:
+            return 'No sinks configured'
+        return '\n'.join([str(sink) for sink in self.sinks] + self.start_errors)
+
+    def close(self) -> None:
+        """Write queued samples of all sinks and close them"""
+        for sink in self.sinks:
+            sink.close()
+
+if __name__ == "__main__":
+    print('Sinks module is not meant to be run standalone')
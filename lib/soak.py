@@ -0,0 +1,221 @@
+"""
+Soak module runs a sustained load of polls and setpoint writes against a
+device to qualify serial adapters and cabling. Every transaction is timed
+and classified, a report line is printed for each interval and a summary
+at the end
+
+Writes put back the setpoints read at start, so the output of the device
+does not change during the run
+"""
+
+import math
+import os
+import random
+import resource
+import sys
+from functools import partial
+from time import monotonic
+from minimalmodbus import ModbusException, NoResponseError, InvalidResponseError
+from serial import SerialException
+
+from .discovery import Discovery
+from .dps_engine import DPSEngine
+from .sim_instrument import SimInstrument
+from .utils import conf_get
+
+# Histogram resolution, buckets per decade from 10 us to 100 s
+BUCKETS_PER_DECADE = 20
+MIN_LATENCY = 1e-5
+DECADES = 7
+# Defaults when not configured
+WRITE_RATIO = 0.2
+REPORT_INTERVAL = 10.0
+# Invalid responses counted as CRC errors, minimalmodbus reports them as 'Checksum error in rtu mode'
+CRC_ERROR_MARKERS = ('checksum', 'crc')
+
+
+def is_crc_error(error: InvalidResponseError) -> bool:
+    """True if invalid response failed its checksum"""
+    text = str(error).lower()
+    return any(marker in text for marker in CRC_ERROR_MARKERS)
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram, constant memory for any run length"""
+    def __init__(self) -> None:
+        self.counts: list[int] = [0] * (BUCKETS_PER_DECADE * DECADES + 1)
+        self.count: int = 0
+        self.max: float = 0.0
+
+    def add(self, latency: float) -> None:
+        """Add latency in seconds"""
+        index = int(math.log10(max(latency, MIN_LATENCY) / MIN_LATENCY) * BUCKETS_PER_DECADE)
+        self.counts[min(index, len(self.counts) - 1)] += 1
+        self.count += 1
+        if latency > self.max:
+            self.max = latency
+
+    def percentile(self, pct: float) -> float:
+        """Upper edge of bucket holding the percentile"""
+        if not self.count:
+            return 0.0
+        rank = self.count * pct / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.max, MIN_LATENCY * 10 ** ((index + 1) / BUCKETS_PER_DECADE))
+        return self.max
+
+class SoakCounters:
+    """Transaction and error counts of a period"""
+    def __init__(self) -> None:
+        self.polls: int = 0
+        self.writes: int = 0
+        self.timeouts: int = 0
+        self.crc_errors: int = 0
+        self.invalid: int = 0
+        self.other_errors: int = 0
+        self.latency = LatencyHistogram()
+
+    def transactions(self) -> int:
+        return self.polls + self.writes
+
+    def errors(self) -> int:
+        return self.timeouts + self.crc_errors + self.invalid + self.other_errors
+
+def rss_bytes() -> int:
+    """Resident memory of this process, peak resident memory where current is not available"""
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS bytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+class SoakTest:
+    """Sustained poll/write load with periodic reports"""
+    def __init__(self, engine: DPSEngine, duration: float, write_ratio: float = WRITE_RATIO,
+                 report_interval: float = REPORT_INTERVAL, seed: int or None = None) -> None:
+        """Constructor, engine must be connected. write_ratio is the share of setpoint writes"""
+        self.engine: DPSEngine = engine
+        self.duration: float = duration
+        self.write_ratio: float = write_ratio
+        self.report_interval: float = report_interval
+        self.random = random.Random(seed)
+        self.total = SoakCounters()
+
+    def __transaction(self, counters: SoakCounters, setpoints: tuple[float, float]) -> None:
+        """Run one poll or write and account for it in counters"""
+        write = self.random.random() < self.write_ratio
+        t_start = monotonic()
+        try:
+            if write:
+                self.engine.set_volts_and_amps(*setpoints)
+            else:
+                self.engine.get_registers()
+        except NoResponseError:
+            counters.timeouts += 1
+        except InvalidResponseError as error:
+            if is_crc_error(error):
+                counters.crc_errors += 1
+            else:
+                counters.invalid += 1
+        except (ModbusException, SerialException, OSError):
+            counters.other_errors += 1
+        counters.latency.add(monotonic() - t_start)
+        if write:
+            counters.writes += 1
+        else:
+            counters.polls += 1
+
+    @staticmethod
+    def __accumulate(total: SoakCounters, period: SoakCounters) -> None:
+        """Add period counts into total"""
+        for name in ('polls', 'writes', 'timeouts', 'crc_errors', 'invalid', 'other_errors'):
+            setattr(total, name, getattr(total, name) + getattr(period, name))
+        for index, count in enumerate(period.latency.counts):
+            total.latency.counts[index] += count
+        total.latency.count += period.latency.count
+        total.latency.max = max(total.latency.max, period.latency.max)
+
+    @staticmethod
+    def format_line(label: str, counters: SoakCounters, elapsed: float, rss: int) -> str:
+        """One report line"""
+        latency = counters.latency
+        rate = counters.transactions() / elapsed if elapsed else 0.0
+        return (f'{label:>8}{rate:>9.1f}{latency.percentile(50) * 1e3:>9.2f}{latency.percentile(95) * 1e3:>9.2f}'
+                f'{latency.percentile(99) * 1e3:>9.2f}{latency.max * 1e3:>9.2f}{counters.timeouts:>9}'
+                f'{counters.crc_errors:>7}{counters.invalid + counters.other_errors:>7}{rss / 1048576:>9.1f}')
+
+    def run(self) -> tuple[bool, str]:
+        """Run soak for duration, reports are printed while running. Returns summary"""
+        registers = self.engine.get_registers()
+        scale = self.engine.scale
+        setpoints = (registers.u_set / scale.volts_scale, registers.i_set / scale.amps_scale)
+        rss_start = rss_bytes()
+        print(f'Soak {self.duration:.0f} s, {self.write_ratio * 100.0:.0f} % writes of '
+              f'{setpoints[0]} V {setpoints[1]} A')
+        print(f'{"t [s]":>8}{"tx/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"max ms":>9}'
+              f'{"timeout":>9}{"crc":>7}{"other":>7}{"RSS MiB":>9}')
+        t_begin = monotonic()
+        t_end = t_begin + self.duration
+        try:
+            while monotonic() < t_end:
+                period = SoakCounters()
+                t_period = monotonic()
+                t_report = min(t_period + self.report_interval, t_end)
+                while monotonic() < t_report:
+                    self.__transaction(period, setpoints)
+                self.__accumulate(self.total, period)
+                print(self.format_line(f'{monotonic() - t_begin:.0f}', period, monotonic() - t_period, rss_bytes()))
+        except KeyboardInterrupt:
+            print('Soak interrupted')
+        elapsed = monotonic() - t_begin
+        rss_end = rss_bytes()
+        total = self.total
+        transactions = total.transactions()
+        error_rate = 100.0 * total.errors() / transactions if transactions else 0.0
+        summary = (f'{self.format_line("total", total, elapsed, rss_end)}\n'
+                   f'Transactions:\t{transactions} ({total.polls} polls, {total.writes} writes) in {elapsed:.1f} s\n'
+                   f'Sustained:\t{transactions / elapsed if elapsed else 0.0:.1f} tx/s\n'
+                   f'Errors:\t\t{total.errors()} ({error_rate:.3f} %): {total.timeouts} timeouts, '
+                   f'{total.crc_errors} CRC, {total.invalid} invalid, {total.other_errors} other\n'
+                   f'Memory:\t\t{rss_start / 1048576:.1f} MiB -> {rss_end / 1048576:.1f} MiB '
+                   f'({(rss_end - rss_start) / 1024:+.0f} KiB)')
+        return total.errors() == 0, summary
+
+def run_soak(conf: dict, duration: float, simulate: bool = False) -> tuple[bool, str]:
+    """Connect to configured device, discovered device or simulated device and run soak.
+    Settings come from the soak section of configuration
+    """
+    engine = DPSEngine(capture_path = conf_get(conf, 'misc', 'capture_file'))
+    port = conf['connection']['tty_port']
+    slave = conf['connection']['slave']
+    baud_rate = conf['connection']['baud_rate']
+    first_sample = None
+    if simulate:
+        engine.instrument_factory = partial(SimInstrument,
+                                            latency = conf_get(conf, 'soak', 'sim_latency') or 0.0,
+                                            timeout_rate = conf_get(conf, 'soak', 'sim_timeout_rate') or 0.0,
+                                            crc_error_rate = conf_get(conf, 'soak', 'sim_crc_error_rate') or 0.0)
+    else:
+        discovery = Discovery(conf)
+        if discovery.enabled:
+            device = discovery.locate(port, slave, baud_rate)
+            if device is None:
+                return False, 'ERROR: No DPS device found.'
+            port, slave, baud_rate = device.port, device.slave, device.baud_rate
+            first_sample = discovery.samples.get(device)
+    conn, msg = engine.connect(port, slave, baud_rate, first_sample)
+    if not conn:
+        return False, 'ERROR: Cannot connect to DPS device.'
+    # Zero write ratio is valid, poll-only soak
+    write_ratio = conf_get(conf, 'soak', 'write_ratio')
+    soak = SoakTest(engine, duration,
+                    write_ratio = WRITE_RATIO if write_ratio is None else write_ratio,
+                    report_interval = conf_get(conf, 'soak', 'report_interval') or REPORT_INTERVAL)
+    return soak.run()
+
+if __name__ == "__main__":
+    print('Soak test is not meant to be run standalone')
@@ -0,0 +1,157 @@
+"""
+SQLite store keeps polled samples in an SQLite database for ad-hoc SQL
+analysis. Samples are inserted in batches, one transaction and one
+prepared statement per batch, in WAL mode with synchronous NORMAL: a
+batch costs one sequential WAL append and no fsync, which keeps up with
+the fastest poll rate also on SD cards
+
+Schema:
+=======
+
+samples         t, t_start (wall time of read end and start [s]), raw registers
+                u_set .. version, indexed on t
+models          model, name, volts_scale, amps_scale, watts_scale of known models
+samples_units   view of samples with set and output values in V, A and W
+
+    SELECT avg(p_out) FROM samples_units WHERE onoff AND t > strftime('%s', 'now', '-1 hour')
+"""
+
+import sqlite3
+from time import monotonic, time
+import numpy as np
+
+from .bus_scheduler import LatencyStats
+from .dps_models import MODELS, SCALE_TABLES, DEFAULT_SCALE, VOLTS_FIELDS, AMPS_FIELDS, WATTS_FIELDS
+from .dps_status import DPSSample, REGISTER_FIELDS
+from .session_store import format_wall_time, parse_wall_time, print_samples
+
+SQLITE_MAGIC = b'SQLite format 3\0'
+# Scale column of models for registers shown in units by samples_units
+UNIT_SCALES: dict[str, str] = {**{name: 'volts_scale' for name in VOLTS_FIELDS},
+                               **{name: 'amps_scale' for name in AMPS_FIELDS},
+                               **{name: 'watts_scale' for name in WATTS_FIELDS}}
+SCHEMA: tuple[str, ...] = (
+    'CREATE TABLE IF NOT EXISTS samples (t REAL NOT NULL, t_start REAL NOT NULL, '
+    + ', '.join(f'{name} INTEGER NOT NULL' for name in REGISTER_FIELDS) + ')',
+    'CREATE INDEX IF NOT EXISTS samples_t ON samples (t)',
+    'CREATE TABLE IF NOT EXISTS models (model INTEGER PRIMARY KEY, name TEXT, '
+    'volts_scale REAL, amps_scale REAL, watts_scale REAL)',
+    # Unknown models are decoded with the default scale as everywhere else
+    'CREATE VIEW IF NOT EXISTS samples_units AS SELECT t, t_start, '
+    + ', '.join(f's.{name} / coalesce(m.{scale}, {getattr(DEFAULT_SCALE, scale)}) AS {name}'
+                if (scale := UNIT_SCALES.get(name)) else f's.{name}' for name in REGISTER_FIELDS)
+    + ' FROM samples s LEFT JOIN models m USING (model)',
+)
+INSERT_SAMPLE = (f'INSERT INTO samples (t, t_start, {", ".join(REGISTER_FIELDS)}) '
+                 f'VALUES ({", ".join("?" * (len(REGISTER_FIELDS) + 2))})')
+INSERT_MODEL = 'INSERT OR REPLACE INTO models VALUES (?, ?, ?, ?, ?)'
+
+
+class SQLiteWriter:
+    """Inserts batches of samples, used by one thread at a time"""
+    def __init__(self, path: str) -> None:
+        """Constructor, samples are appended to an existing database"""
+        self.path: str = path
+        # Writer thread of a sink is not the thread that opened the database
+        self.__db = sqlite3.connect(path, check_same_thread = False)
+        self.__db.execute('PRAGMA journal_mode = WAL')
+        # Commits are not synced to disk, WAL keeps the database consistent on power loss
+        self.__db.execute('PRAGMA synchronous = NORMAL')
+        with self.__db:
+            for statement in SCHEMA:
+                self.__db.execute(statement)
+            self.__db.executemany(INSERT_MODEL, ((number, model.name, scale.volts_scale, scale.amps_scale,
+                                                   scale.watts_scale) for (number, model), scale in
+                                                  zip(MODELS.items(), SCALE_TABLES.values())))
+        # Monotonic sample times are stored as wall time
+        self.__wall_offset: float = time() - monotonic()
+        self.rows: int = 0
+        self.insert_time: float = 0.0
+        # Time to insert and commit one batch
+        self.commit_time: LatencyStats = LatencyStats()
+
+    def add_batch(self, samples: list[DPSSample]) -> None:
+        """Insert samples in one transaction, raises sqlite3.Error"""
+        offset = self.__wall_offset
+        t_start = monotonic()
+        with self.__db:
+            self.__db.executemany(INSERT_SAMPLE, [(sample.t + offset, sample.t_start + offset, *sample.registers())
+                                                  for sample in samples])
+        elapsed = monotonic() - t_start
+        self.rows += len(samples)
+        self.insert_time += elapsed
+        self.commit_time.add(elapsed)
+
+    def rate(self) -> float:
+        """Inserted rows per second of insert time"""
+        return self.rows / self.insert_time if self.insert_time else 0.0
+
+    def close(self) -> None:
+        self.__db.close()
+
+    def __str__(self) -> str:
+        return f'{self.rows} rows, {self.rate():.0f} rows/s, commit {self.commit_time}'
+
+def connect_read_only(path: str) -> sqlite3.Connection:
+    """Read-only connection, also while a writer is inserting. Raises sqlite3.Error"""
+    return sqlite3.connect(f'file:{path}?mode=ro', uri = True)
+
+def query_arrays(path: str, sql: str, params: tuple = ()) -> dict[str, np.ndarray]:
+    """Run query and return result columns as arrays by column name, float64 for numeric
+    columns (NULL is NaN), object for others. Raises sqlite3.Error
+    """
+    db = connect_read_only(path)
+    try:
+        cursor = db.execute(sql, params)
+        names = [column[0] for column in cursor.description]
+        rows = cursor.fetchall()
+    finally:
+        db.close()
+    if not rows:
+        return {name: np.zeros(0) for name in names}
+    arrays: dict[str, np.ndarray] = {}
+    for name, values in zip(names, zip(*rows)):
+        try:
+            arrays[name] = np.array(values, dtype = np.float64)
+        except (TypeError, ValueError):
+            arrays[name] = np.array(values, dtype = object)
+    return arrays
+
+def query_samples(path: str, t_from: float, t_to: float, units: bool = True) -> dict[str, np.ndarray]:
+    """Samples with read end between wall times t_from and t_to by time index, as arrays of
+    t, t_start and registers by name, values in V, A and W if units
+    """
+    table = 'samples_units' if units else 'samples'
+    return query_arrays(path, f'SELECT * FROM {table} WHERE t BETWEEN ? AND ? ORDER BY t', (t_from, t_to))
+
+def is_sqlite(path: str) -> bool:
+    """True if file at path is an SQLite database"""
+    with open(path, 'rb') as file:
+        return file.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+def print_sqlite_query(path: str, start: str or None, end: str or None) -> None:
+    """Print samples between start and end or a summary of the database, as print_query
+    of session store does. Raises ValueError on invalid input, sqlite3.Error
+    """
+    db = connect_read_only(path)
+    try:
+        count, t_first, t_last = db.execute('SELECT count(*), min(t), max(t) FROM samples').fetchone()
+        if not count:
+            print(f'{path}: no samples')
+            return
+        if start or end:
+            t_from = parse_wall_time(start, t_first) if start else t_first
+            t_to = parse_wall_time(end, t_first) if end else t_last
+            rows = db.execute(f'SELECT t, t_start, {", ".join(REGISTER_FIELDS)} FROM samples '
+                              f'WHERE t BETWEEN ? AND ? ORDER BY t', (t_from, t_to))
+            print_samples(DPSSample(row[2:], row[0], row[1]) for row in rows)
+            return
+        print(f'Database:\t{path}\n'
+              f'From:\t\t{format_wall_time(t_first)}\n'
+              f'To:\t\t{format_wall_time(t_last)}\n'
+              f'Samples:\t{count}')
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    print('SQLite store is not meant to be run standalone')
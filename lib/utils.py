@@ -67,14 +67,6 @@ def validate_int(value: str) -> bool:
     except ValueError:
         return False
 
-def ivoltsf(value: int) -> float:
-    """Convert volts from int to float, scaling"""
-    return value / 100.0
-
-def iampsf(value: int) -> float:
-    """Convert amps from int to float, scaling"""
-    return value / 1000.0
-
-def iwattsf(value: int) -> float:
-    """Convert watts from int to float, scaling"""
-    return value / 100.0
+def conf_get(conf: dict, section: str, key: str, default = None):
+    """Get value from configuration, default if section or key is missing"""
+    return (conf.get(section) or {}).get(key, default)
@@ -1,15 +1,72 @@
 """User Interfaces for DPS Control"""
+import atexit
+import sqlite3
 import sys
 import os
+from argparse import ArgumentParser
+from functools import partial
 from yaml import safe_load, YAMLError
+from lib.archive import compress_session, is_archive, print_archive_query, CHUNK_SAMPLES
+from lib.discovery import CACHE_FILE
 from lib.dps_controller import DPSController
+from lib.modbus_capture import ReplayInstrument
+from lib.presets import PRESETS_FILE
+from lib.profiling import profiler
+from lib.session_store import print_query
+from lib.soak import run_soak
+from lib.sqlite_store import is_sqlite, print_sqlite_query
+from lib.utils import conf_get
 from ui.dps_cli import DPSCli
 from ui.dps_gui import dps_gui
 
+def parse_args():
+    """Parse command line arguments"""
+    parser = ArgumentParser(description = 'Control DPS power supply')
+    parser.add_argument('--cli', action = 'store_true', help = 'start command line interface instead of GUI')
+    parser.add_argument('--capture', metavar = 'FILE', help = 'log all Modbus traffic to FILE')
+    parser.add_argument('--replay', metavar = 'FILE', help = 'replay captured Modbus traffic instead of serial port')
+    parser.add_argument('--replay-speed', type = float, default = 1.0, metavar = 'X',
+                        help = 'replay speed, 1 is recorded timing, 0 as fast as possible (default 1)')
+    parser.add_argument('--profile', action = 'store_true',
+                        help = 'profile CPU and allocations, report is written on exit')
+    parser.add_argument('--soak', type = float, metavar = 'SECONDS',
+                        help = 'run polls and setpoint writes for SECONDS and report rate, latency and errors')
+    parser.add_argument('--simulate', action = 'store_true',
+                        help = 'soak against simulated device instead of serial port')
+    parser.add_argument('--query', metavar = 'SESSION',
+                        help = 'query recorded session, archive or SQLite database: summary, samples between --start '
+                               'and --end or --events')
+    parser.add_argument('--start', metavar = 'TIME', help = 'query from TIME, HH:MM[:SS] or YYYY-MM-DD HH:MM[:SS]')
+    parser.add_argument('--end', metavar = 'TIME', help = 'query until TIME')
+    parser.add_argument('--events', nargs = '?', const = 'all', metavar = 'KINDS',
+                        help = 'list events, all or comma separated power_on, power_off, cv_to_cc, cc_to_cv, '
+                               'protect, trip')
+    parser.add_argument('--compress', metavar = 'SESSION',
+                        help = 'write samples of recorded SESSION into a compressed archive, --query reads it')
+    return parser.parse_args()
+
 def main():
     """dps-control application"""
     # Arguments
-    args: list[str] = sys.argv
+    args = parse_args()
+
+    # Session query needs neither configuration nor device
+    if args.query:
+        try:
+            if is_archive(args.query):
+                if args.events is not None:
+                    raise ValueError('Archives hold samples only, query events on the session')
+                print_archive_query(args.query, args.start, args.end)
+            elif is_sqlite(args.query):
+                if args.events is not None:
+                    raise ValueError('Databases hold samples only, query events on the session')
+                print_sqlite_query(args.query, args.start, args.end)
+            else:
+                print_query(args.query, args.start, args.end, args.events)
+        except (OSError, ValueError, sqlite3.Error) as error:
+            print(error)
+            sys.exit(1)
+        sys.exit(0)
 
     # Try reading configuration
     try:
@@ -21,15 +78,51 @@ def main():
     except YAMLError as error:
         print(f'Error parsing configuration file {error}')
 
+    # Presets file sits next to configuration unless given with a path
+    conf['presets'] = dict(conf.get('presets') or {})
+    conf['presets']['file'] = os.path.join(bundle_dir, conf['presets'].get('file') or PRESETS_FILE)
+    # Discovery cache too
+    conf['discovery'] = dict(conf.get('discovery') or {})
+    conf['discovery']['cache_file'] = os.path.join(bundle_dir, conf['discovery'].get('cache_file') or CACHE_FILE)
+
+    if args.compress:
+        ok, result = compress_session(args.compress,
+                                      chunk_samples = conf_get(conf, 'session', 'archive_chunk') or CHUNK_SAMPLES)
+        print(result)
+        sys.exit(0 if ok else 1)
+
     # Print config if debug
     if conf['misc']['debug']:
         print (conf)
 
+    # Replayed traffic does not come from a serial port, there is nothing to discover
+    if args.replay:
+        conf['discovery'] = dict(conf.get('discovery') or {}, enabled = False)
+
+    if args.capture:
+        conf['misc']['capture_file'] = args.capture
+
+    # Soak runs on its own engine, no user interface
+    if args.soak:
+        ok, summary = run_soak(conf, args.soak, args.simulate)
+        print(summary)
+        sys.exit(0 if ok else 1)
+
     # Create controller
     controller = DPSController(conf)
 
+    # Captured traffic is served in place of the serial port
+    if args.replay:
+        controller.engine.instrument_factory = partial(ReplayInstrument, args.replay, args.replay_speed)
+
+    if args.profile:
+        profiler.start()
+
+    # Write profile report on exit if profiling is still running
+    atexit.register(lambda: print(profiler.stop()[1]) if profiler.active else None)
+
     # Start CLI if requested
-    if len(args) > 1 and args[1] == '--cli':
+    if args.cli:
         ui = DPSCli(controller)
         ui.start()
     else:
@@ -0,0 +1,97 @@
+"""
+Asynchronous command executor for the GUI. Commands are passed to the
+controller in a worker thread so the Qt main thread never waits for the
+bus. Completion is signalled back to the main thread
+"""
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal, Slot
+from lib.dps_controller import DPSController
+
+
+class CommandTask(QRunnable):
+    """Single controller command, result is filled in when run"""
+    def __init__(self, executor: 'CommandExecutor', cmd: str, tag: str = '') -> None:
+        super(CommandTask, self).__init__()
+        self.setAutoDelete(False)
+        self.cmd: str = cmd
+        self.tag: str = tag
+        self.ret: bool = False
+        self.msg: str = ''
+        self.cancelled: bool = False
+        self.__executor = executor
+
+    @Slot()
+    def run(self):
+        """Execute command unless it was cancelled while queued, completion is signalled
+        also when the command raises
+        """
+        try:
+            if not self.cancelled:
+                self.ret, self.msg = self.__executor.controller.parse_command(self.cmd)
+        except Exception as error:
+            # Bus timeouts and whatever else a handler raises must not leave the task pending
+            self.ret, self.msg = False, f'Command failed: {type(error).__name__}: {error}'
+        finally:
+            self.__executor.task_done.emit(self)
+
+class CommandExecutor(QObject):
+    """Runs controller commands off the main thread. Normal commands run one at a
+    time in submission order, urgent ones (power) have their own thread so they
+    reach the bus without waiting for a slow command
+    """
+    # Emitted in main thread with the finished CommandTask
+    finished = Signal(object)
+    # Number of commands queued or running
+    pending_changed = Signal(int)
+    # Internal, emitted from worker threads
+    task_done = Signal(object)
+
+    def __init__(self, controller: DPSController) -> None:
+        super(CommandExecutor, self).__init__()
+        self.controller: DPSController = controller
+        self.__pool = QThreadPool()
+        self.__pool.setMaxThreadCount(1)
+        self.__urgent_pool = QThreadPool()
+        self.__urgent_pool.setMaxThreadCount(1)
+        self.__pending: list[CommandTask] = []
+        self.task_done.connect(self.__task_done)
+
+    def pending(self) -> int:
+        """Number of commands queued or running"""
+        return len(self.__pending)
+
+    def submit(self, cmd: str, tag: str = '', urgent: bool = False) -> CommandTask:
+        """Queue command for execution, tag tells the caller where it came from"""
+        task = CommandTask(self, cmd, tag)
+        self.__pending.append(task)
+        (self.__urgent_pool if urgent else self.__pool).start(task)
+        self.pending_changed.emit(len(self.__pending))
+        return task
+
+    def cancel(self) -> int:
+        """Cancel commands not started yet, command on the bus is let to finish.
+        Returns number of cancelled commands
+        """
+        cancelled = 0
+        for task in list(self.__pending):
+            if self.__pool.tryTake(task) or self.__urgent_pool.tryTake(task):
+                task.cancelled = True
+                cancelled += 1
+                self.task_done.emit(task)
+        return cancelled
+
+    def shutdown(self, timeout_ms: int = 1000) -> None:
+        """Cancel queued commands and wait for running ones"""
+        self.cancel()
+        self.__pool.waitForDone(timeout_ms)
+        self.__urgent_pool.waitForDone(timeout_ms)
+
+    @Slot(object)
+    def __task_done(self, task: CommandTask) -> None:
+        """Runs in main thread, forwards result"""
+        if task in self.__pending:
+            self.__pending.remove(task)
+        self.pending_changed.emit(len(self.__pending))
+        self.finished.emit(task)
+
+if __name__ == "__main__":
+    print('Command executor is not meant to be run standalone')
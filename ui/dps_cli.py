@@ -1,8 +1,23 @@
 """
 Simple CLI to use DPS Control engine
 """
+import sys
+from queue import Empty
+from time import monotonic
 from lib.dps_controller import DPSController
 from lib.dps_status import DPSStatus
+from lib.rolling_stats import RollingStats
+from lib.utils import conf_get
+
+# Live monitor channels: (label, register name, quantity, unit)
+MONITOR_CHANNELS: tuple = (
+    ('U-Out', 'u_out', 'volts', 'V'),
+    ('I-Out', 'i_out', 'amps', 'A'),
+    ('P-Out', 'p_out', 'watts', 'W'),
+)
+MONITOR_COLUMNS: tuple = ('now', 'min', 'max', 'mean', 'stddev')
+MONITOR_LABEL_WIDTH = 8
+MONITOR_CELL_WIDTH = 10
 
 
 class DPSCli:
@@ -11,6 +26,10 @@ class DPSCli:
         """Set up all variables"""
         self.controller: DPSController = controller
         self.running: bool = False
+        # Protection trips already printed
+        self.__trips_shown: int = 0
+        # Poll errors already printed
+        self.__errors_shown: int = 0
 
     def print_help(self) -> None:
         """Print generic help for commands available"""
@@ -20,8 +39,24 @@ class DPSCli:
         print('\ta <value>\tSet current to value (float)')
         print('\tv <value>\tSet voltage to value (float)')
         print('\tx\t\tToggle output power ON/OFF. Set to OFF on startup for safety reasons.')
+        print('\te [reset]\tShow or reset output energy (Wh) and charge (Ah)')
+        print('\tt\t\tList protection trips')
+        print('\tcp <W> / cr <ohm>\tHold output power or resistance with software loop')
+        print('\tcv\t\tStop CP/CR loop, back to hardware CV/CC')
+        print('\tr\t\tShow CP/CR loop rate and regulation error')
+        print('\tb\t\tShow bus queueing latency per transaction class')
+        print('\tj [reset]\tShow or reset poll interval, jitter and sample age statistics')
+        print('\tprofile start|stop\tStart profiling or stop and write report')
+        print('\tg c|s|x 0/1|va V A|start|stop\tGroup: connect, sample with skew, broadcast power or setpoints, sweep')
+        print('\trecord [<file>]|stop\tRecord samples and events into indexed session file, query with --query')
+        print('\thist [<window>|reset]\tOutput min/mean/max history of window, e.g. 90s, 15m, 6h, 30d (default 1h)')
+        print('\tsinks\t\tShow samples written and dropped per telemetry sink')
+        print('\tmem <n>\t\tRecall memory group M0-M9 into output setpoints')
+        print('\tmem r <n> | mem w <n> <V> <A> [<ovp> <ocp> <opp>]\tRead or write memory group')
+        print('\tmem load [<file>]\tWrite memory groups from presets file (dps_presets.yaml)')
+        print('\td\t\tScan serial ports for DPS devices')
         print('\tp <port>\tSet device port to <port> eg. /dev/ttyUSB0')
-        print('\tl\t\tLive monitoring mode, exit with [CTRL-C]')
+        print('\tl\t\tLive monitoring mode with rolling statistics, exit with [CTRL-C]')
         print('\th\t\tPrint this text')
         print('\tq\t\tQuit program')
 
@@ -50,22 +85,133 @@ class DPSCli:
                     continue
 
                 print('Running live monitoring, press [CTRL-C] to stop...')
-                self.controller.start_events()
-                try:
-                    while True:
-                        stat: DPSStatus = self.controller.event_queue.get(block = True, timeout= None)
-                        uout =  float(stat.registers.u_out/100.0)
-                        iout = float(stat.registers.i_out/1000.0)
-                        pout = float(stat.registers.p_out/100.0)
-                        print(f'U-Out: \x1b[1;31m{uout:.2f}\x1b[0m V\tI-Out: \x1b[1;31m{iout:.3f}\x1b[0m A\tP-Out: \x1b[1;31m{pout:.2f}\x1b[0m W')
-                        print('\x1b[2F')
-                except KeyboardInterrupt:
-                    self.controller.stop_events()
-                    print('\n')
+                self.live_monitor()
+                continue
 
             ret: tuple[bool, str] = self.controller.parse_command(cmd)
             print(ret[1])
+            self.__print_new_trips()
+            self.__print_new_poll_errors()
+
+    def __print_new_trips(self) -> None:
+        """Print protection trips since last call, the prompt is not interrupted while waiting for input"""
+        trip_count = self.controller.protection.trip_count
+        if trip_count == self.__trips_shown:
+            return
+        trips = self.controller.get_trips()
+        for trip in trips[-min(trip_count - self.__trips_shown, len(trips)):]:
+            print(f'PROTECTION TRIP: {trip}')
+        self.__trips_shown = trip_count
+
+    def __print_new_poll_errors(self) -> None:
+        """Print count and last error of polls failed since last call"""
+        timing = self.controller.poll_timing
+        # Timing statistics are reset on connect
+        if timing.errors > self.__errors_shown:
+            print(f'{timing.errors - self.__errors_shown} poll errors, last {timing.last_error}')
+        self.__errors_shown = timing.errors
+
+
+    def live_monitor(self) -> None:
+        """Show live values with rolling statistics until CTRL-C. Samples are
+        consumed at poll rate, screen is refreshed at its own rate and only
+        changed cells are rewritten, in a single write per refresh
+        """
+        conf = self.controller.conf
+        window: int = conf_get(conf, 'monitor', 'window', 60)
+        refresh: float = conf_get(conf, 'monitor', 'refresh_interval', 0.5)
+        stats: list[RollingStats] = [RollingStats(window) for _ in MONITOR_CHANNELS]
+        latest: list[int] = [0] * len(MONITOR_CHANNELS)
+        queue = self.controller.event_queue
+
+        # Scale divisor and decimals of each channel for connected model
+        model = self.controller.engine.scale.model
+        scaling: list[tuple[float, int]] = [
+            (10.0 ** decimals, decimals) for decimals in
+            (getattr(model, f'{quantity}_decimals') for _, _, quantity, _ in MONITOR_CHANNELS)
+        ]
 
+        # Start from fresh samples only
+        while not queue.empty():
+            queue.get_nowait()
+
+        print(f'Window: {window} samples')
+        header = ' ' * MONITOR_LABEL_WIDTH + ''.join(f'{col:>{MONITOR_CELL_WIDTH}}' for col in MONITOR_COLUMNS)
+        # Table is followed by one line of poll timing
+        sys.stdout.write(header + '\n' + '\n'.join(label for label, *_ in MONITOR_CHANNELS) + '\n\n')
+        sys.stdout.flush()
+        shown: dict[tuple[int, int] or str, str] = {}
+        timing = self.controller.poll_timing
+        channels = {channel[1] for channel in MONITOR_CHANNELS}
+        # Screen is redrawn after a keyframe, a change of a monitored value or its statistics,
+        # or a change of the timing line
+        dirty = True
+        timing_line = ''
+        # Trips are shown on the timing line
+        last_trip = ''
+        next_refresh = monotonic()
+        try:
+            while True:
+                try:
+                    stat: DPSStatus = queue.get(timeout = max(0.0, next_refresh - monotonic()))
+                    if stat is None or stat.registers is None:
+                        continue
+                    timing.consumed(stat.registers)
+                    if stat.trip is not None:
+                        last_trip = f'  \x1b[1;31mTRIP {stat.trip.rule} {stat.trip.value:.3f}\x1b[0m'
+                        dirty = True
+                    if stat.keyframe or not channels.isdisjoint(stat.changed):
+                        dirty = True
+                    for n, channel in enumerate(MONITOR_CHANNELS):
+                        value: int = getattr(stat.registers, channel[1])
+                        latest[n] = value
+                        # Window statistics change also when the value stays the same
+                        if stats[n].add(value):
+                            dirty = True
+                except Empty:
+                    pass
+                now = monotonic()
+                if now < next_refresh:
+                    continue
+                next_refresh = now + refresh
+                line = f'Timing: {timing.get_summary()}{last_trip}'
+                if not dirty and line == timing_line:
+                    continue
+                dirty = False
+                timing_line = line
+                self.__render_monitor(stats, latest, scaling, shown, timing_line)
+        except KeyboardInterrupt:
+            print('\n')
+
+    @staticmethod
+    def __render_monitor(stats: list[RollingStats], latest: list[int], scaling: list[tuple[float, int]],
+                         shown: dict[tuple[int, int] or str, str], timing: str) -> None:
+        """Rewrite cells of the monitor table and the timing line whose text has changed"""
+        rows = len(MONITOR_CHANNELS)
+        out: list[str] = []
+        for row, (_, _, _, unit) in enumerate(MONITOR_CHANNELS):
+            scale, decimals = scaling[row]
+            rs = stats[row]
+            if not len(rs):
+                continue
+            values = (latest[row], rs.min(), rs.max(), rs.mean(), rs.stddev())
+            for col, value in enumerate(values):
+                text = f'{value / scale:>{MONITOR_CELL_WIDTH - 2}.{decimals + (col == 4)}f} {unit}'
+                if shown.get((row, col)) == text:
+                    continue
+                shown[(row, col)] = text
+                if col == 0:
+                    text = f'\x1b[1;31m{text}\x1b[0m'
+                # Cursor sits below the timing line, move up to the row and over to the cell
+                up = rows - row + 1
+                column = MONITOR_LABEL_WIDTH + col * MONITOR_CELL_WIDTH + 1
+                out.append(f'\x1b[{up}A\x1b[{column}G{text}\x1b[{up}B\r')
+        if shown.get('timing') != timing:
+            shown['timing'] = timing
+            out.append(f'\x1b[1A\x1b[2K{timing}\x1b[1B\r')
+        if out:
+            sys.stdout.write(''.join(out))
+            sys.stdout.flush()
 
     def start(self) -> None:
         """Start CLI"""
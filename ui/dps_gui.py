@@ -2,11 +2,16 @@
 import sys
 from PySide6.QtWidgets import *
 from PySide6.QtCore import Qt, QFile, QTextStream, QThreadPool, Slot, QRunnable
+from PySide6.QtGui import QKeySequence, QShortcut
 from custom_widgets import dialbar, statusindicator
 from custom_widgets.statusindicator import StatusIndicator
 from lib.dps_controller import DPSController
 from lib.dps_status import DPSStatus
-from lib.utils import button_factory, get_label, get_lineedit, ivoltsf, iampsf, iwattsf
+from lib.profiling import profiler
+from lib.utils import button_factory, get_label, get_lineedit
+from ui.command_executor import CommandExecutor, CommandTask
+from ui.history_chart import HistoryChart
+from ui.log_pane import LogPane, LogLevel
 # noinspection PyUnresolvedReferences
 import ui.breeze_pyside6
 
@@ -16,14 +21,18 @@ VOUT_NAME = 'volts_out'
 AOUT_NAME = 'amps_out'
 POUT_NAME = 'power_out'
 VIN_NAME = 'volts_in'
+ENERGY_NAME = 'energy_out'
+TIMING_NAME = 'poll_timing'
 CV_NAME = 'cv_indicator'
 CC_NAME = 'cc_indicator'
 CONN_NAME = 'conn_indicator'
+BUSY_NAME = 'busy_indicator'
 SETBUTTON_NAME = 'button_set'
 CONBUTTON_NAME = 'button_connect'
 PWRBUTTON_NAME = 'button_power'
 CLIEDIT_NAME = 'cli_edit'
 PORT_NAME = 'port_edit'
+SLAVE_NAME = 'slave_edit'
 VCONTROL_NAME = 'volt_control'
 ACONTROL_NAME = 'amp_control'
 
@@ -58,7 +67,9 @@ class EventUpdater(QRunnable):
             if data is None:
                 #print('Event handler quitting...')
                 break
-            self.__update_callback(data)
+            # Only samples taken from the event queue count for sample age
+            age = self.__controller.poll_timing.consumed(data.registers)
+            self.__update_callback(data, age)
 
 class DPSMainWindow(QMainWindow):
     def __init__(self, controller: DPSController):
@@ -66,11 +77,19 @@ class DPSMainWindow(QMainWindow):
         self.thread_manager = QThreadPool()
         self.setWindowTitle('DPS-Control')
         self.setMinimumSize(800, 600)
-        self.log_pane = QPlainTextEdit()
         self.controller = controller
+        self.log_pane = LogPane(controller.conf.get('log'))
         self.__running = False
         self.__flag_update_controls = True
+        self.__trips_shown = 0
+        self.__errors_shown = 0
+        self.__first_sample_shown = False
+        profiler.register(self, 'update_status', 'DPSMainWindow.update_status')
         self.eventupdater = EventUpdater(self.controller, self.update_status)
+        # Controller commands run in worker threads, results come back as signals
+        self.executor = CommandExecutor(self.controller)
+        self.executor.finished.connect(self.__command_finished)
+        self.executor.pending_changed.connect(self.__pending_changed)
 
     @staticmethod
     def __retstr(code: bool, msg: str) -> str:
@@ -97,7 +116,8 @@ class DPSMainWindow(QMainWindow):
         baud_edit.setText(self.controller.get_baud_rate())
         baud_edit.setEnabled(False)
         slave_label:QLabel = get_label('Slave', fontsize)
-        slave_edit: QLineEdit = get_lineedit('', fontsize, 2)
+        slave_edit: QLineEdit = get_lineedit('', fontsize, 3)
+        slave_edit.setObjectName(SLAVE_NAME)
         slave_edit.setMaximumWidth(140)
         slave_edit.setAlignment(Qt.AlignmentFlag.AlignRight)
         slave_edit.setText(self.controller.get_slave())
@@ -130,6 +150,16 @@ class DPSMainWindow(QMainWindow):
         status_hbox.addWidget(status_label)
         status_hbox.addWidget(status_indicator)
 
+        busy_hbox = QHBoxLayout()
+        busy_label = get_label('Busy', 12)
+        busy_label.setAlignment(Qt.AlignmentFlag.AlignVCenter)
+        busy_indicator = statusindicator.StatusIndicator(size = 20)
+        busy_indicator.setObjectName(BUSY_NAME)
+        busy_indicator.setToolTip('Commands pending, [Esc] cancels queued ones')
+        busy_hbox.addStretch()
+        busy_hbox.addWidget(busy_label)
+        busy_hbox.addWidget(busy_indicator)
+
         button_connect: QPushButton = button_factory('Connect')
         button_connect.setObjectName(CONBUTTON_NAME)
         button_connect.clicked.connect(self, self.__handle_buttons)
@@ -146,6 +176,7 @@ class DPSMainWindow(QMainWindow):
         layout.addLayout(cv_hbox)
         layout.addLayout(cc_hbox)
         layout.addLayout(status_hbox)
+        layout.addLayout(busy_hbox)
         layout.addWidget(button_connect)
         return layout
 
@@ -256,6 +287,14 @@ class DPSMainWindow(QMainWindow):
         volt_in_hbox.addWidget(volt_in_edit)
         volt_in_hbox.addWidget(volt_in_unit_label)
 
+        energy_label: QLabel = get_label('0.0000 Wh\n0.0000 Ah', label_size-4)
+        energy_label.setObjectName(ENERGY_NAME)
+        energy_label.setAlignment(Qt.AlignmentFlag.AlignRight)
+
+        timing_label: QLabel = get_label('Age - ms\nJitter - ms', label_size-8)
+        timing_label.setObjectName(TIMING_NAME)
+        timing_label.setAlignment(Qt.AlignmentFlag.AlignRight)
+
         button_onoff = button_factory('Power', toggle=True)
         button_onoff.setObjectName(PWRBUTTON_NAME)
         button_onoff.setCheckable(True)
@@ -278,6 +317,8 @@ class DPSMainWindow(QMainWindow):
         layout.addLayout(power_out_hbox)
         layout.addWidget(volt_in_label)
         layout.addLayout(volt_in_hbox)
+        layout.addWidget(energy_label)
+        layout.addWidget(timing_label)
         #layout.addWidget(QHLine())
         layout.addWidget(button_onoff)
 
@@ -323,7 +364,11 @@ class DPSMainWindow(QMainWindow):
         self.log_pane.setReadOnly(True)
         self.log_pane.setFocusPolicy(Qt.FocusPolicy.NoFocus)
         self.log_pane.setFont(DEFAULT_FONT)
-        layout.addWidget(self.log_pane)
+        # Log and output history share the space as tabs
+        tabs = QTabWidget()
+        tabs.addTab(self.log_pane, 'Log')
+        tabs.addTab(HistoryChart(self.controller.history), 'History')
+        layout.addWidget(tabs)
         return layout
 
     def __get_cli_layout(self) -> QHBoxLayout:
@@ -340,6 +385,8 @@ class DPSMainWindow(QMainWindow):
         return layout
 
     def closeEvent(self, event):
+        self.executor.shutdown()
+        self.log_pane.close_sink()
         self.controller.event_queue.put_nowait(None)
         self.__running = False
 
@@ -356,6 +403,10 @@ class DPSMainWindow(QMainWindow):
         button_pwr.setEnabled(True)
         button_conn = self.findChild(QPushButton, CONBUTTON_NAME)
         button_conn.setEnabled(False)
+        port_edit = self.findChild(QLineEdit, PORT_NAME)
+        port_edit.setText(self.controller.get_port())
+        slave_edit = self.findChild(QLineEdit, SLAVE_NAME)
+        slave_edit.setText(self.controller.get_slave())
 
     def __print_cli_help(self):
         """Print help about available CLI commands"""
@@ -365,6 +416,24 @@ class DPSMainWindow(QMainWindow):
         self.log('    v  <value>\tSet voltage to value (float)')
         self.log('    va <value> <value> \tSet voltage and current to value (float)')
         self.log('    x\t\tToggle output power ON/OFF.')
+        self.log('    e [reset]\tShow or reset output energy and charge')
+        self.log('    t\t\tList protection trips')
+        self.log('    record [<file>]|stop\tRecord samples and events into indexed session file')
+        self.log('    hist [<window>|reset]\tOutput min/mean/max history of window, e.g. 15m, 6h, 30d')
+        self.log('    sinks\t\tShow samples written and dropped per telemetry sink')
+        self.log('    mem <n>\t\tRecall memory group M0-M9')
+        self.log('    mem r <n> | mem w <n> <V> <A> [<ovp> <ocp> <opp>]\tRead or write memory group')
+        self.log('    mem load [<file>]\tWrite memory groups from presets file')
+        self.log('    d\t\tScan serial ports for DPS devices')
+        self.log('    cp <W> / cr <ohm>\tHold output power or resistance')
+        self.log('    cv\t\tStop CP/CR loop')
+        self.log('    r\t\tShow CP/CR loop rate and regulation error')
+        self.log('    b\t\tShow bus queueing latency per class')
+        self.log('    j [reset]\tShow or reset poll interval, jitter and sample age')
+        self.log('    profile start|stop\tStart profiling or stop and write report')
+        self.log('    g c|s|x 0/1|va V A|start|stop\tGroup: connect, sample with skew, broadcast power or setpoints, sweep')
+        self.log('    loglevel <level>\tShow log messages of level debug, info, warning or error and above')
+        self.log('    cancel\t\tCancel queued commands, also [Esc]')
         self.log('    h\t\tPrint this text')
         self.log('    q\t\tQuit program')
 
@@ -385,27 +454,78 @@ class DPSMainWindow(QMainWindow):
                 self.__print_cli_help()
                 cli_edit.setText('')
                 return
+            elif main_cmd == 'loglevel':
+                self.__set_log_level(command.split()[1:])
+                cli_edit.setText('')
+                return
+            elif main_cmd == 'cancel':
+                self.__cancel_commands()
+                cli_edit.setText('')
+                return
 
-            # Let controller parse the command and act upon it
-            ret, msg = self.controller.parse_command(command)
+            # Let controller parse the command and act upon it in worker thread, power commands
+            # have their own worker like the Power button
+            self.executor.submit(command, 'cli', urgent = main_cmd == 'x')
             cli_edit.setText('')
 
-            # If we connected through CLI, update UI accordingly
-            if main_cmd == 'c':
-                if ret:
-                    self.__connected_success()
-            elif main_cmd == 'x':
-                if ret:
-                    button_pwr = self.findChild(QPushButton, PWRBUTTON_NAME)
-                    button_pwr.setChecked(not button_pwr.isChecked())
-            elif main_cmd == 'i':
-                if ret:
-                    self.log('DPS5005 registers:')
-
-            # Update GUI control values after CLI command so they stay in sync
-            self.update_status(self.controller.status)
-            self.__flag_update_controls = True
-            self.log(self.__retstr(ret, msg))
+    @Slot(object)
+    def __command_finished(self, task: CommandTask) -> None:
+        """Handle result of command run by executor, called in main thread"""
+        if task.cancelled:
+            self.log(f'Cancelled: {task.cmd}')
+            if task.tag == CONBUTTON_NAME:
+                self.findChild(QPushButton, CONBUTTON_NAME).setEnabled(True)
+            return
+        ret, msg = task.ret, task.msg
+        main_cmd = task.cmd.split()[0] if task.cmd.split() else task.cmd
+        if task.tag == CONBUTTON_NAME:
+            # We are connected, light LED
+            if ret:
+                self.__connected_success()
+            else:
+                self.findChild(QPushButton, CONBUTTON_NAME).setEnabled(True)
+            self.log(self.__retstr(ret, msg), LogLevel.INFO if ret else LogLevel.WARNING)
+            return
+        if task.tag != 'cli':
+            self.log(self.__retstr(ret, msg), LogLevel.INFO if ret else LogLevel.WARNING)
+            return
+
+        # If we connected through CLI, update UI accordingly
+        if main_cmd == 'c':
+            if ret:
+                self.__connected_success()
+        elif main_cmd == 'x':
+            if ret:
+                # x 0 and x 1 set rather than toggle, button follows the switched state
+                button_pwr = self.findChild(QPushButton, PWRBUTTON_NAME)
+                button_pwr.setChecked(bool(self.controller.get_power_state()))
+        elif main_cmd == 'i':
+            if ret:
+                self.log('DPS5005 registers:')
+
+        # GUI control values follow the setpoints of the next polled sample
+        self.__flag_update_controls = True
+        self.log(self.__retstr(ret, msg), LogLevel.INFO if ret else LogLevel.WARNING)
+
+    @Slot(int)
+    def __pending_changed(self, pending: int) -> None:
+        """Light busy indicator while commands are pending"""
+        busy = self.findChild(StatusIndicator, BUSY_NAME)
+        busy.setEnabled(pending > 0)
+        busy.update()
+
+    def __set_log_level(self, args: list[str]) -> None:
+        """Set level filter of log pane"""
+        names = ', '.join(level.name.lower() for level in LogLevel)
+        if len(args) != 1 or args[0].upper() not in LogLevel.__members__:
+            self.log(f'Log level is {self.log_pane.level.name.lower()}, use loglevel {names}', LogLevel.WARNING)
+            return
+        self.log_pane.set_level(LogLevel[args[0].upper()])
+
+    def __cancel_commands(self) -> None:
+        """Cancel queued commands, command already on the bus finishes"""
+        cancelled = self.executor.cancel()
+        self.log(f'{cancelled} queued commands cancelled' if cancelled else 'No queued commands to cancel')
 
     def __handle_buttons(self) -> None:
         """Handle button presses from UI, form command for controller"""
@@ -413,15 +533,14 @@ class DPSMainWindow(QMainWindow):
         sender = self.sender()
         sender_name = sender.objectName()
         if sender_name == PWRBUTTON_NAME:
-            cmd = 'x'
+            # Power has its own worker, switching off never waits behind other commands
+            self.executor.submit('x', sender_name, urgent = True)
+            return
         elif sender_name == CONBUTTON_NAME:
             self.log('Connecting')
-            cmd: str = f'c {self.controller.status.port}'
-            ret, msg = self.controller.parse_command(cmd)
-            # We are connected, light LED
-            if ret:
-                self.__connected_success()
-            self.log(self.__retstr(ret, msg))
+            sender.setEnabled(False)
+            # Port and slave are discovered, configured ones are tried first
+            self.executor.submit('c', sender_name)
             return
         elif sender_name == SETBUTTON_NAME:
             vcontrol = self.findChild(dialbar.DialBar, name = VCONTROL_NAME)
@@ -431,8 +550,7 @@ class DPSMainWindow(QMainWindow):
             cmd: str = f'va {vstr} {astr}'
             sender.setEnabled(False)
         # Send command
-        ret, msg = self.controller.parse_command(cmd)
-        self.log(self.__retstr(ret, msg))
+        self.executor.submit(cmd, sender_name)
 
     def __update_controls(self, volts: int, amps: int):
         """Update control dials to be in sync with settings, they may
@@ -443,28 +561,59 @@ class DPSMainWindow(QMainWindow):
         vcontrol.set_value(volts)
         acontrol.set_value(amps)
 
-    def update_status(self, status: DPSStatus):
-        """Update UI according to status information"""
+    def update_status(self, status: DPSStatus, age: float or None = None):
+        """Update UI according to status information, age of polled sample when taken from event queue"""
+        u_set, i_set, u_out, i_out, p_out, u_in = status.registers.to_units(self.controller.engine.scale)
+
         # On first update, set the control values to what has been set in device
         if self.__flag_update_controls:
-            self.__update_controls(status.registers.u_set * 10, status.registers.i_set)
+            self.__update_controls(int(round(u_set * 1000)), int(round(i_set * 1000)))
             self.__flag_update_controls = False
 
-        vout = self.findChild(QLineEdit, VOUT_NAME)
-        aout = self.findChild(QLineEdit, AOUT_NAME)
-        pout = self.findChild(QLineEdit, POUT_NAME)
-        vin = self.findChild(QLineEdit, VIN_NAME)
-        cv = self.findChild(StatusIndicator, CV_NAME)
-        cc = self.findChild(StatusIndicator, CC_NAME)
-        vout.setText(str(ivoltsf(status.registers.u_out)))
-        aout.setText(str(iampsf(status.registers.i_out)))
-        pout.setText(str(iwattsf(status.registers.p_out)))
-        vin.setText(str(ivoltsf(status.registers.u_in)))
-        port_edit = self.findChild(QLineEdit, PORT_NAME)
-        port_edit.setText(self.controller.status.port)
+        # Only widgets of changed fields are touched, keyframes refresh all of them
+        changed = status.changed
+        for name, field, value in ((VOUT_NAME, 'u_out', u_out), (AOUT_NAME, 'i_out', i_out),
+                                   (POUT_NAME, 'p_out', p_out), (VIN_NAME, 'u_in', u_in)):
+            if field in changed:
+                self.findChild(QLineEdit, name).setText(str(value))
+        # Energy keeps counting while output is on
+        if status.keyframe or status.registers.onoff:
+            energy = self.controller.get_energy()
+            energy_label = self.findChild(QLabel, ENERGY_NAME)
+            energy_label.setText(f'{energy.wh:.4f} Wh\n{energy.ah:.4f} Ah')
+        # Age of the sample when shown, jitter of the poll interval
+        timing = self.controller.poll_timing
+        if status.keyframe and age is not None:
+            timing_label = self.findChild(QLabel, TIMING_NAME)
+            timing_label.setText(f'Age {age * 1000.0:.0f} ms\nJitter p99 {timing.get_jitter(99) * 1000.0:.0f} ms')
+        if status.keyframe:
+            port_edit = self.findChild(QLineEdit, PORT_NAME)
+            port_edit.setText(self.controller.status.port)
+
+        if not self.__first_sample_shown and self.controller.time_to_first_sample is not None:
+            self.log(f'First sample {self.controller.time_to_first_sample * 1000.0:.1f} ms after connect')
+            self.__first_sample_shown = True
+
+        # Report new protection trips, power button follows the output state
+        trip_count = self.controller.protection.trip_count
+        if trip_count != self.__trips_shown:
+            trips = self.controller.get_trips()
+            for trip in trips[-min(trip_count - self.__trips_shown, len(trips)):]:
+                self.log(f'PROTECTION TRIP: {trip}', LogLevel.ERROR)
+            self.__trips_shown = trip_count
+            button_pwr = self.findChild(QPushButton, PWRBUTTON_NAME)
+            button_pwr.setChecked(False)
+        # Report failed polls, timing statistics are reset on connect
+        if status.keyframe:
+            if timing.errors > self.__errors_shown:
+                self.log(f'{timing.errors - self.__errors_shown} poll errors, last {timing.last_error}',
+                         LogLevel.WARNING)
+            self.__errors_shown = timing.errors
 
         # Handle CV/CC indicator
-        if self.controller.status.connected:
+        if 'cvcc' in changed and self.controller.status.connected:
+            cv = self.findChild(StatusIndicator, CV_NAME)
+            cc = self.findChild(StatusIndicator, CC_NAME)
             if status.registers.cvcc == 0:
                 cv.setEnabled(True)
                 cc.setEnabled(False)
@@ -472,7 +621,8 @@ class DPSMainWindow(QMainWindow):
                 cv.setEnabled(False)
                 cc.setEnabled(True)
 
-        self.update()
+        if changed or status.registers.onoff:
+            self.update()
 
     # Public methods
     def setup(self) -> None:
@@ -488,12 +638,14 @@ class DPSMainWindow(QMainWindow):
 
         main_v_layout.addLayout(header_h_layout, 1)
         main_v_layout.addLayout(panel_h_layout, 5)
-        log_label: QLabel = get_label('Log:', 12)
-        main_v_layout.addWidget(log_label)
         main_v_layout.addLayout(log_h_layout, 3)
 
         main_v_layout.addLayout(cli_h_layout, 1)
 
+        # [Esc] cancels queued commands
+        cancel_shortcut = QShortcut(QKeySequence(Qt.Key.Key_Escape), self)
+        cancel_shortcut.activated.connect(self.__cancel_commands)
+
         # Set up event handling from controller
         self.__running = True
         self.thread_manager.start(self.eventupdater)
@@ -503,9 +655,9 @@ class DPSMainWindow(QMainWindow):
         central_widget.setLayout(main_v_layout)
         self.setCentralWidget(central_widget)
 
-    def log(self, txt: str) -> None:
-        """Append log message to log panel"""
-        self.log_pane.appendPlainText(txt)
+    def log(self, txt: str, level: LogLevel = LogLevel.INFO) -> None:
+        """Append log message to log panel, safe from any thread"""
+        self.log_pane.append(txt, level)
 
 def set_styles(app: QApplication) -> None:
     """Set style from breeze themes"""
@@ -0,0 +1,113 @@
+"""
+History chart for the GUI. Shows min/max band and mean of one output
+channel over a selectable window from the controller rollup history. The
+rollup picks the tier and merges buckets down to one per pixel column, so
+drawing costs the same for a minute and for a month
+"""
+from PySide6.QtWidgets import QWidget, QComboBox, QHBoxLayout, QVBoxLayout
+from PySide6.QtGui import QPainter, QColor, QPen, QPolygonF
+from PySide6.QtCore import Qt, QTimer, QPointF, QRectF
+import numpy as np
+
+from lib.rollup import Rollup, RollupSeries, format_duration
+
+# Windows offered in the selector, seconds
+WINDOWS: tuple[float, ...] = (60.0, 900.0, 3600.0, 6 * 3600.0, 86400.0, 7 * 86400.0, 30 * 86400.0)
+CHANNEL_LABELS: tuple[tuple[str, str], ...] = (('U-Out', 'V'), ('I-Out', 'A'), ('P-Out', 'W'))
+REFRESH_INTERVAL = 1.0
+MARGIN = 4
+
+
+class HistoryPlot(QWidget):
+    """Plot area, min/max band with mean line"""
+    def __init__(self) -> None:
+        super(HistoryPlot, self).__init__()
+        self.series: RollupSeries or None = None
+        self.window: float = WINDOWS[0]
+        self.channel: int = 0
+        self.band_color: QColor = QColor(0x30, 0x60, 0x90)
+        self.mean_color: QColor = QColor(0xee, 0xee, 0x40)
+        self.text_color: QColor = QColor(0xcc, 0xcc, 0xcc)
+
+    def paintEvent(self, event):
+        """Handle paint event"""
+        paint = QPainter(self)
+        paint.fillRect(self.rect(), QColor(0x20, 0x20, 0x20))
+        name, unit = CHANNEL_LABELS[self.channel]
+        paint.setPen(self.text_color)
+        series = self.series
+        if series is None or not len(series.t):
+            paint.drawText(self.rect(), Qt.AlignmentFlag.AlignCenter, 'No history')
+            return
+        low = series.min[:, self.channel]
+        high = series.max[:, self.channel]
+        mean = series.mean[:, self.channel]
+        v_min, v_max = float(low.min()), float(high.max())
+        if v_max - v_min < 1e-9:
+            v_min, v_max = v_min - 0.5, v_max + 0.5
+        width = self.width() - 2 * MARGIN
+        height = self.height() - 2 * MARGIN
+        t_end = series.t[-1] + series.width
+        x = MARGIN + width * (1.0 - (t_end - series.t) / self.window)
+        def to_y(values: np.ndarray) -> np.ndarray:
+            return MARGIN + height * (v_max - values) / (v_max - v_min)
+        y_low, y_high, y_mean = to_y(low), to_y(high), to_y(mean)
+        column = max(1.0, width * series.width / self.window)
+
+        paint.setPen(Qt.PenStyle.NoPen)
+        paint.setBrush(self.band_color)
+        for n in range(len(x)):
+            paint.drawRect(QRectF(x[n], y_high[n], column, max(1.0, y_low[n] - y_high[n])))
+        paint.setRenderHint(QPainter.RenderHint.Antialiasing)
+        paint.setPen(QPen(self.mean_color, 1.5))
+        paint.setBrush(Qt.BrushStyle.NoBrush)
+        paint.drawPolyline(QPolygonF([QPointF(x[n] + column / 2, y_mean[n]) for n in range(len(x))]))
+
+        paint.setPen(self.text_color)
+        paint.drawText(MARGIN + 2, MARGIN + 12, f'{name} max {v_max:.3f} {unit}')
+        paint.drawText(MARGIN + 2, self.height() - MARGIN - 2, f'min {v_min:.3f} {unit}')
+        paint.drawText(QRectF(0, MARGIN, self.width() - MARGIN - 2, 14), Qt.AlignmentFlag.AlignRight,
+                       f'{format_duration(self.window)}, {format_duration(series.width)} buckets')
+
+class HistoryChart(QWidget):
+    """Window and channel selectors over history plot, refreshed by timer while shown"""
+    def __init__(self, history: Rollup) -> None:
+        super(HistoryChart, self).__init__()
+        self.history: Rollup = history
+        self.plot = HistoryPlot()
+        window_select = QComboBox()
+        window_select.addItems([format_duration(window) for window in WINDOWS])
+        window_select.currentIndexChanged.connect(self.__window_changed)
+        channel_select = QComboBox()
+        channel_select.addItems([name for name, _ in CHANNEL_LABELS])
+        channel_select.currentIndexChanged.connect(self.__channel_changed)
+        selectors = QHBoxLayout()
+        selectors.addWidget(window_select)
+        selectors.addWidget(channel_select)
+        selectors.addStretch()
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(selectors)
+        layout.addWidget(self.plot, 1)
+        self.setLayout(layout)
+        self.__timer = QTimer(self)
+        self.__timer.timeout.connect(self.refresh)
+        self.__timer.start(int(REFRESH_INTERVAL * 1000))
+
+    def __window_changed(self, index: int) -> None:
+        self.plot.window = WINDOWS[index]
+        self.refresh()
+
+    def __channel_changed(self, index: int) -> None:
+        self.plot.channel = index
+        self.plot.update()
+
+    def refresh(self) -> None:
+        """Query history at one bucket per pixel column and repaint, skipped while hidden"""
+        if not self.isVisible():
+            return
+        self.plot.series = self.history.series(self.plot.window, max(1, self.plot.width() - 2 * MARGIN))
+        self.plot.update()
+
+if __name__ == "__main__":
+    print('History chart is not meant to be run standalone')
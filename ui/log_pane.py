@@ -0,0 +1,98 @@
+"""
+Log pane for the GUI. Messages go into a fixed-capacity ring and are
+appended to the widget in batches by a timer, so logging is cheap from any
+thread and the widget never grows past the ring capacity. Level filter
+selects what is shown, the ring keeps all levels. Optional rotating log
+file is written by a background thread
+"""
+import logging
+import threading
+from collections import deque
+from enum import IntEnum
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
+from PySide6.QtWidgets import QPlainTextEdit
+from PySide6.QtCore import QTimer
+
+# Defaults when not configured
+CAPACITY = 5000
+FLUSH_INTERVAL = 0.1
+MAX_BYTES = 1024 * 1024
+BACKUP_COUNT = 3
+
+
+class LogLevel(IntEnum):
+    """Message levels, same values as in logging module"""
+    DEBUG = logging.DEBUG
+    INFO = logging.INFO
+    WARNING = logging.WARNING
+    ERROR = logging.ERROR
+
+class LogPane(QPlainTextEdit):
+    """Bounded, batched log view"""
+    def __init__(self, conf: dict or None = None) -> None:
+        """Constructor, conf is the log section of configuration"""
+        super(LogPane, self).__init__()
+        conf = conf or {}
+        self.capacity: int = conf.get('capacity') or CAPACITY
+        self.level: LogLevel = LogLevel[str(conf.get('level') or 'INFO').upper()]
+        self.setMaximumBlockCount(self.capacity)
+        self.__ring: deque = deque(maxlen = self.capacity)
+        self.__pending: deque = deque(maxlen = self.capacity)
+        self.__lock = threading.Lock()
+        self.__timer = QTimer(self)
+        self.__timer.timeout.connect(self.flush)
+        self.__timer.start(int((conf.get('flush_interval') or FLUSH_INTERVAL) * 1000))
+
+        # File sink, records are formatted and written by listener thread
+        self.__file_logger: logging.Logger or None = None
+        self.__listener: QueueListener or None = None
+        if conf.get('file'):
+            handler = RotatingFileHandler(conf['file'], maxBytes = conf.get('max_bytes') or MAX_BYTES,
+                                          backupCount = conf.get('backup_count') or BACKUP_COUNT)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+            queue: SimpleQueue = SimpleQueue()
+            self.__listener = QueueListener(queue, handler)
+            self.__listener.start()
+            self.__file_logger = logging.getLogger('dps_control.gui')
+            self.__file_logger.propagate = False
+            self.__file_logger.setLevel(logging.DEBUG)
+            self.__file_logger.addHandler(QueueHandler(queue))
+
+    def append(self, text: str, level: LogLevel = LogLevel.INFO) -> None:
+        """Add message, safe to call from any thread. Shown on next flush"""
+        record = (level, text)
+        with self.__lock:
+            self.__ring.append(record)
+            self.__pending.append(record)
+        if self.__file_logger is not None:
+            self.__file_logger.log(level, text)
+
+    def flush(self) -> None:
+        """Append pending messages to widget in one operation, runs in GUI thread"""
+        with self.__lock:
+            if not self.__pending:
+                return
+            pending, self.__pending = self.__pending, deque(maxlen = self.capacity)
+        shown = [text for level, text in pending if level >= self.level]
+        if shown:
+            self.appendPlainText('\n'.join(shown))
+
+    def set_level(self, level: LogLevel) -> None:
+        """Change level filter, pane is rebuilt from the ring"""
+        self.level = level
+        with self.__lock:
+            records = list(self.__ring)
+            self.__pending.clear()
+        self.setPlainText('\n'.join(text for lvl, text in records if lvl >= level))
+        self.moveCursor(self.textCursor().MoveOperation.End)
+
+    def close_sink(self) -> None:
+        """Stop file writer thread, pending records are written first"""
+        self.__timer.stop()
+        if self.__listener is not None:
+            self.__listener.stop()
+            self.__listener = None
+
+if __name__ == "__main__":
+    print('Log pane is not meant to be run standalone')